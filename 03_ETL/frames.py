@@ -0,0 +1,96 @@
+import queue
+import threading
+from typing import Iterable, Iterator, List, TypeVar
+
+import pyarrow as pa
+
+T = TypeVar('T')
+
+# 先読みスレッドの終端を表す印
+_DONE = object()
+
+
+def rebatch(batches: Iterable[pa.RecordBatch], size: int) -> Iterator[pa.Table]:
+    """
+    任意の大きさのレコードバッチをちょうど size 行ずつに切り直す
+
+    最後の1つだけは size 行未満になりうる。保持するのは size 行ぶんだけ。
+
+    Args:
+        batches (Iterable[pa.RecordBatch]): 読み込んだバッチ
+        size (int): 1フレームの行数
+
+    Returns:
+        Iterator[pa.Table]: size 行のテーブル
+    """
+    if size <= 0:
+        raise ValueError(f"frame size must be positive, got {size}")
+    pending: List[pa.RecordBatch] = []
+    rows = 0
+    for batch in batches:
+        if batch.num_rows == 0:
+            continue
+        pending.append(batch)
+        rows += batch.num_rows
+        while rows >= size:
+            table = pa.Table.from_batches(pending)
+            yield table.slice(0, size)
+            rest = table.slice(size)
+            pending = rest.to_batches()
+            rows = rest.num_rows
+    if rows:
+        yield pa.Table.from_batches(pending)
+
+
+def prefetch(iterator: Iterator[T], depth: int = 1) -> Iterator[T]:
+    """
+    次の要素をバックグラウンドのスレッドで先に作っておく
+
+    読み込み・パースを下流の処理と重ねる。メモリに載るのは
+    先読み depth 個と処理中の1個だけ。途中で反復をやめた場合はスレッドも止まる。
+
+    Args:
+        iterator (Iterator[T]): 元のイテレータ
+        depth (int): 先読みする個数 (0 なら先読みしない)
+
+    Returns:
+        Iterator[T]: 同じ要素を同じ順で返すイテレータ
+    """
+    if depth <= 0:
+        yield from iterator
+        return
+
+    buffer: queue.Queue = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        try:
+            for item in iterator:
+                if not put((item, None)):
+                    return
+            put((_DONE, None))
+        except BaseException as e:
+            put((_DONE, e))
+
+    thread = threading.Thread(target=produce, name='frame-prefetch', daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if item is _DONE:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
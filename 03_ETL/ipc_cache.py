@@ -0,0 +1,141 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator, Optional, Union
+
+import polars as pl
+
+# 内容ハッシュを計算するときの読み込み単位
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def content_hash(path: Union[str, Path]) -> str:
+    """
+    ファイル内容の BLAKE2b ハッシュ
+
+    Args:
+        path (Union[str, Path]): ファイルのパス
+
+    Returns:
+        str: 16進ダイジェスト
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@contextmanager
+def _locked(path: Path) -> Iterator[None]:
+    """
+    同じキャッシュを複数プロセスが同時に作らないための排他ロック
+    """
+    with open(path, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+class IpcCache:
+    def __init__(self, cache_dir: Union[str, Path]) -> None:
+        """
+        IpcCacheクラスの初期化
+
+        元ファイルを初回だけパースして非圧縮の Arrow IPC (Feather v2) に書き出し、
+        以後はそのファイルをメモリマップして返す。メモリマップはコピーしないので、
+        同じホストの複数のワーカーはページキャッシュ上の同じページを共有する。
+
+        キャッシュは元ファイルの mtime・サイズ・内容ハッシュで管理する。
+        mtime だけが変わった場合 (touch やコピー) は内容ハッシュが一致すれば作り直さない。
+
+        Args:
+            cache_dir (Union[str, Path]): キャッシュの置き場所
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _paths(self, source: Path, variant: str = '') -> tuple:
+        key = hashlib.blake2b(f'{source.resolve()}|{variant}'.encode(), digest_size=8).hexdigest()
+        stem = f'{source.name}.{key}'
+        return (self.cache_dir / f'{stem}.arrow', self.cache_dir / f'{stem}.json',
+                self.cache_dir / f'{stem}.lock')
+
+    def _is_fresh(self, source: Path, data_path: Path, meta_path: Path) -> bool:
+        """
+        キャッシュが元ファイルと一致しているか (mtime が変わっただけなら meta を更新する)
+        """
+        if not data_path.exists() or not meta_path.exists():
+            return False
+        meta = json.loads(meta_path.read_text())
+        stat = source.stat()
+        if meta['size'] != stat.st_size:
+            return False
+        if meta['mtime_ns'] == stat.st_mtime_ns:
+            return True
+        if meta['hash'] != content_hash(source):
+            return False
+        meta['mtime_ns'] = stat.st_mtime_ns
+        self._write_meta(meta_path, meta)
+        return True
+
+    @staticmethod
+    def _write_meta(meta_path: Path, meta: dict) -> None:
+        tmp = meta_path.with_suffix(f'.{os.getpid()}.tmp')
+        tmp.write_text(json.dumps(meta))
+        os.replace(tmp, meta_path)
+
+    def get(self, source: Union[str, Path], parse: Callable[[Path], pl.DataFrame],
+            variant: str = '') -> pl.DataFrame:
+        """
+        キャッシュ済みなら IPC をメモリマップして返し、無ければ作る
+
+        Args:
+            source (Union[str, Path]): 元ファイル
+            parse (Callable[[Path], pl.DataFrame]): 元ファイルのパーサー
+            variant (str): 同じ元ファイルから作る別のキャッシュを区別する名前
+
+        Returns:
+            pl.DataFrame: メモリマップされたデータ
+        """
+        source = Path(source)
+        data_path, meta_path, lock_path = self._paths(source, variant)
+        if not self._is_fresh(source, data_path, meta_path):
+            with _locked(lock_path):
+                # ロック待ちの間に他のプロセスが作っていれば再利用する
+                if not self._is_fresh(source, data_path, meta_path):
+                    self._build(source, parse, data_path, meta_path)
+        return pl.read_ipc(data_path, memory_map=True)
+
+    def _build(self, source: Path, parse: Callable[[Path], pl.DataFrame],
+               data_path: Path, meta_path: Path) -> None:
+        """
+        元ファイルをパースして IPC に書き出す (一時ファイル経由で原子的に置き換える)
+        """
+        stat = source.stat()
+        digest = content_hash(source)
+        logging.info(f"Building IPC cache: {source} -> {data_path}")
+        tmp = data_path.with_suffix(f'.{os.getpid()}.tmp')
+        # メモリマップで読めるよう非圧縮で書く
+        parse(source).write_ipc(tmp, compression='uncompressed')
+        os.replace(tmp, data_path)
+        self._write_meta(meta_path, {'source': str(source), 'size': stat.st_size,
+                                     'mtime_ns': stat.st_mtime_ns, 'hash': digest})
+
+    def clear(self, source: Optional[Union[str, Path]] = None) -> None:
+        """
+        キャッシュを削除する
+
+        Args:
+            source (Optional[Union[str, Path]]): 元ファイル (None なら全て)
+        """
+        paths = self._paths(Path(source)) if source else list(self.cache_dir.iterdir())
+        for path in paths:
+            if Path(path).exists():
+                Path(path).unlink()
@@ -0,0 +1,509 @@
+import csv
+import logging
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Type, Union
+
+import pandas as pd
+import polars as pl
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+import yaml
+from pandera import SchemaModel
+from pandera.errors import SchemaError
+
+from frames import prefetch, rebatch
+from ipc_cache import IpcCache
+from lookup import LookupIndex
+from schema import ConditionSchema, FbcSchema, QuotationSchema, arrow_types, polars_dtypes, schema_columns
+from validation import validate_polars
+
+# ログの設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# config を渡さない場合の既定パス
+DEFAULT_QUOTATION_PATH = 'quotation.csv'
+DEFAULT_CONDITION_PATH = 'condition.csv'
+
+# cache_path を指定しない場合の ruler データのキャッシュ置き場 (ruler_data_path からの相対)
+DEFAULT_RULER_CACHE_DIR = '.ipc_cache'
+
+# 行フィルタ (1つまたは複数の Polars 式。複数なら AND)
+Filters = Optional[Union[pl.Expr, Sequence[pl.Expr]]]
+
+
+# =====================================================================
+# (A) Config
+# =====================================================================
+@dataclass
+class Config:
+    """
+    ETL の設定 (config.yaml)
+    """
+    quotation_path: str
+    condition_table: str
+    lut_table_path: Optional[str]
+    ruler_data_path: Optional[str]
+    pen: int
+    book: int
+    readmode: Dict[str, str]
+    output_path: str
+    cache_path: Optional[str] = None
+
+    @classmethod
+    def from_yaml(cls, path: Union[str, Path]) -> 'Config':
+        """
+        YAML から設定を読み込む
+
+        Args:
+            path (Union[str, Path]): 設定ファイルのパス
+
+        Returns:
+            Config: 設定
+
+        Raises:
+            FileNotFoundError: ファイルが無い
+            KeyError: 必須キーが無い
+            TypeError: frame_size が整数でない
+        """
+        if not Path(path).exists():
+            raise FileNotFoundError(f"Config file not found: {path}")
+        with open(path) as file:
+            data = yaml.safe_load(file)
+
+        input_path = data['input_path']
+        frame_size = data['frame_size']
+        for key in ('pen', 'book'):
+            value = frame_size[key]
+            if not isinstance(value, int) or isinstance(value, bool):
+                raise TypeError(f"frame_size.{key} must be int, got {type(value).__name__}")
+
+        return cls(
+            quotation_path=input_path['quotation_path'],
+            condition_table=input_path['condition_table'],
+            lut_table_path=input_path.get('lut_table_path'),
+            ruler_data_path=input_path.get('ruler_data_path'),
+            pen=frame_size['pen'],
+            book=frame_size['book'],
+            readmode=dict(data['readmode']),
+            output_path=data['output_path'],
+            cache_path=data.get('cache_path'),
+        )
+
+
+# =====================================================================
+# (B) Loader
+# =====================================================================
+def _conform(frame: Union[pl.DataFrame, pl.LazyFrame], schema: Type[SchemaModel]):
+    """
+    スキーマで宣言されたカラムを宣言どおりの dtype にキャストする
+
+    変換できない値を null にして黙って通すことはしない (validate=False でも不正値は失敗する)。
+    DataFrame は変換できない値のあるカラムをまとめて SchemaError で報告し、
+    LazyFrame は strict なキャストにして collect 時に失敗させる。
+    スキーマに無いカラムや欠けているカラムはそのまま残す。
+
+    Args:
+        frame (Union[pl.DataFrame, pl.LazyFrame]): 読み込んだデータ
+        schema (Type[SchemaModel]): スキーマ
+
+    Returns:
+        Union[pl.DataFrame, pl.LazyFrame]: キャスト後のデータ
+
+    Raises:
+        SchemaError: 宣言された dtype に変換できない値がある (DataFrame のとき)
+    """
+    if isinstance(frame, pl.LazyFrame):
+        names = frame.collect_schema().names()
+        dtypes = {name: dtype for name, dtype in polars_dtypes(schema).items() if name in names}
+        return frame.with_columns([pl.col(name).cast(dtype, strict=True) for name, dtype in dtypes.items()])
+
+    dtypes = {name: dtype for name, dtype in polars_dtypes(schema).items() if name in frame.columns}
+    cast = frame.with_columns([pl.col(name).cast(dtype, strict=False) for name, dtype in dtypes.items()])
+    errors = [f"column '{name}' has {lost} value(s) not castable to {dtype}"
+              for name, dtype in dtypes.items()
+              if (lost := cast[name].null_count() - frame[name].null_count())]
+    if errors:
+        raise SchemaError(schema.to_schema(), frame, f"{schema.__name__}: " + '; '.join(errors))
+    return cast
+
+
+def _project(lf: pl.LazyFrame, schema: Type[SchemaModel], filters: Filters) -> pl.LazyFrame:
+    """
+    LazyFrame に行フィルタと列の射影を付ける
+
+    フィルタ -> 射影 -> キャストの順で組み立てるため、Polars の最適化で
+    フィルタと射影はどちらもスキャンに押し込まれ、不要な列や行は読まれない。
+
+    Args:
+        lf (pl.LazyFrame): スキャン
+        schema (Type[SchemaModel]): 読み込むカラムを宣言したスキーマ
+        filters (Filters): 行フィルタ (元ファイルのカラム名・型で書く)
+
+    Returns:
+        pl.LazyFrame: 射影済みのスキャン
+    """
+    if filters is not None:
+        if isinstance(filters, pl.Expr):
+            filters = [filters]
+        for expr in filters:
+            lf = lf.filter(expr)
+    names = lf.collect_schema().names()
+    lf = lf.select([name for name in schema_columns(schema) if name in names])
+    return _conform(lf, schema)
+
+
+class Loader:
+    def __init__(self, config: Optional[Config]) -> None:
+        """
+        Loaderクラスの初期化
+
+        Args:
+            config (Optional[Config]): 設定 (None なら既定パスを使う)
+        """
+        self.config = config
+        self._ruler_cache: Optional[IpcCache] = None
+        self._lookup_indexes: Dict[Tuple[str, Tuple[str, ...]], LookupIndex] = {}
+
+    @property
+    def quotation_path(self) -> str:
+        return self.config.quotation_path if self.config else DEFAULT_QUOTATION_PATH
+
+    @property
+    def condition_path(self) -> str:
+        return self.config.condition_table if self.config else DEFAULT_CONDITION_PATH
+
+    @property
+    def ruler_data_path(self) -> Path:
+        if not self.config or not self.config.ruler_data_path:
+            raise ValueError("ruler_data_path is not configured")
+        return Path(self.config.ruler_data_path)
+
+    @property
+    def ruler_cache(self) -> IpcCache:
+        if self._ruler_cache is None:
+            cache_dir = self.config.cache_path or self.ruler_data_path / DEFAULT_RULER_CACHE_DIR
+            self._ruler_cache = IpcCache(cache_dir)
+        return self._ruler_cache
+
+    # -----------------------------------------------------------------
+    # 一括読み込み
+    # -----------------------------------------------------------------
+    def load_quotation_csv(self, validate: bool = False) -> pl.DataFrame:
+        """
+        Quotation CSV を読み込む
+
+        Args:
+            validate (bool): QuotationSchema で検証するか
+
+        Returns:
+            pl.DataFrame: Quotation データ
+        """
+        logging.info(f"Loading quotation: {self.quotation_path}")
+        df = _conform(pl.read_csv(self.quotation_path), QuotationSchema)
+        return self.validate(df, QuotationSchema) if validate else df
+
+    def load_condition_csv(self, validate: bool = False) -> pl.DataFrame:
+        """
+        Condition CSV を読み込む
+
+        Args:
+            validate (bool): ConditionSchema で検証するか
+
+        Returns:
+            pl.DataFrame: Condition データ
+        """
+        logging.info(f"Loading condition: {self.condition_path}")
+        df = _conform(pl.read_csv(self.condition_path), ConditionSchema)
+        return self.validate(df, ConditionSchema) if validate else df
+
+    def load_fbc_parquet(self, path: Path, validate: bool = False) -> pl.DataFrame:
+        """
+        fbc の Parquet を読み込む
+
+        Args:
+            path (Path): Parquet ファイルのパス
+            validate (bool): FbcSchema で検証するか
+
+        Returns:
+            pl.DataFrame: fbc データ
+        """
+        logging.info(f"Loading fbc: {path}")
+        df = _conform(pl.read_parquet(path), FbcSchema)
+        return self.validate(df, FbcSchema) if validate else df
+
+    def validate(self, frame: Union[pl.DataFrame, pl.LazyFrame],
+                 schema: Type[SchemaModel] = QuotationSchema) -> Union[pl.DataFrame, pl.LazyFrame]:
+        """
+        Polars のままスキーマ検証する (to_pandas によるコピーをしない)
+
+        Args:
+            frame (Union[pl.DataFrame, pl.LazyFrame]): 検証するデータ
+            schema (Type[SchemaModel]): スキーマ
+
+        Returns:
+            Union[pl.DataFrame, pl.LazyFrame]: 検証済みのデータ
+
+        Raises:
+            SchemaError: スキーマに違反している
+        """
+        return validate_polars(frame, schema)
+
+    # -----------------------------------------------------------------
+    # pandas との受け渡し (Arrow 経由)
+    # -----------------------------------------------------------------
+    def to_pandas(self, frame: Union[pl.DataFrame, pl.LazyFrame],
+                  zero_copy_strings: bool = False) -> pd.DataFrame:
+        """
+        Arrow バッファを共有した pandas DataFrame を返す
+
+        Polars のメモリを Arrow C Data Interface で pyarrow に渡し、
+        pd.ArrowDtype のカラムとして包むだけなので、NumPy 配列や
+        object 型の文字列は作らない。
+
+        保証:
+          - 数値・bool・日時のカラムはコピーしない (Polars とバッファを共有)
+          - 文字列は Python オブジェクトにしない。zero_copy_strings=True なら
+            Polars の string_view をそのまま共有する (コピーなし)。ただし pandas は
+            string_view の演算に未対応なので、比較や .str を使う場合は既定の
+            False にする (large_string への変換が1回だけ走る)
+
+        Args:
+            frame (Union[pl.DataFrame, pl.LazyFrame]): Loader の出力
+            zero_copy_strings (bool): 文字列も string_view のまま共有するか
+
+        Returns:
+            pd.DataFrame: ArrowDtype のカラムを持つ DataFrame
+        """
+        if isinstance(frame, pl.LazyFrame):
+            frame = frame.collect()
+        compat = pl.CompatLevel.newest() if zero_copy_strings else pl.CompatLevel.oldest()
+        return frame.to_arrow(compat_level=compat).to_pandas(types_mapper=pd.ArrowDtype)
+
+    @staticmethod
+    def from_pandas(pdf: pd.DataFrame) -> pl.DataFrame:
+        """
+        ArrowDtype の pandas DataFrame を Polars に戻す
+
+        ArrowDtype のカラムは Arrow 配列をそのまま渡すのでコピーしない。
+
+        Args:
+            pdf (pd.DataFrame): pandas 側の処理結果
+
+        Returns:
+            pl.DataFrame: Polars のデータ
+        """
+        return pl.from_pandas(pdf)
+
+    # -----------------------------------------------------------------
+    # 遅延読み込み (射影・フィルタをスキャンに押し込む)
+    # -----------------------------------------------------------------
+    def scan_quotation_csv(self, filters: Filters = None) -> pl.LazyFrame:
+        """
+        Quotation CSV の遅延スキャン
+
+        QuotationSchema で宣言されたカラムだけを読む。
+
+        Args:
+            filters (Filters): 行フィルタ
+
+        Returns:
+            pl.LazyFrame: Quotation のスキャン
+        """
+        return _project(pl.scan_csv(self.quotation_path), QuotationSchema, filters)
+
+    def scan_condition_csv(self, filters: Filters = None) -> pl.LazyFrame:
+        """
+        Condition CSV の遅延スキャン
+
+        Args:
+            filters (Filters): 行フィルタ
+
+        Returns:
+            pl.LazyFrame: Condition のスキャン
+        """
+        return _project(pl.scan_csv(self.condition_path), ConditionSchema, filters)
+
+    def scan_fbc_parquet(self, path: Union[str, Path], filters: Filters = None,
+                         schema: Type[SchemaModel] = FbcSchema) -> pl.LazyFrame:
+        """
+        fbc Parquet の遅延スキャン
+
+        fbc の Parquet はジョブが使うより多くのカラムを持つため、
+        スキーマで宣言されたカラムの列チャンクだけを読む。
+
+        Args:
+            path (Union[str, Path]): Parquet ファイル (グロブ可)
+            filters (Filters): 行フィルタ (行グループの統計で枝刈りされる)
+            schema (Type[SchemaModel]): 読み込むカラムを宣言したスキーマ
+
+        Returns:
+            pl.LazyFrame: fbc のスキャン
+        """
+        return _project(pl.scan_parquet(str(path)), schema, filters)
+
+    def scan_ruler_data(self, pattern: str = '**/*.parquet', filters: Filters = None,
+                        schema: Type[SchemaModel] = FbcSchema) -> pl.LazyFrame:
+        """
+        ruler_data_path 以下の全ファイルを1つの並列スキャンとして読む
+
+        Args:
+            pattern (str): ruler_data_path からのグロブ (*.csv なら CSV として読む)
+            filters (Filters): 行フィルタ
+            schema (Type[SchemaModel]): 読み込むカラムを宣言したスキーマ
+
+        Returns:
+            pl.LazyFrame: 全ファイルをまとめたスキャン
+        """
+        source = str(self.ruler_data_path / pattern)
+        lf = pl.scan_csv(source) if pattern.endswith('.csv') else pl.scan_parquet(source)
+        return _project(lf, schema, filters)
+
+    # -----------------------------------------------------------------
+    # ruler データ (メモリマップした Arrow IPC キャッシュ)
+    # -----------------------------------------------------------------
+    def load_ruler_data(self, pattern: str = '**/*.parquet',
+                        schema: Type[SchemaModel] = FbcSchema) -> pl.DataFrame:
+        """
+        ruler_data_path 以下のファイルを IPC キャッシュ経由で読み込む
+
+        初回はファイルごとにパースして Arrow IPC に変換し、2回目以降は
+        キャッシュをメモリマップするだけなのでパースもコピーも発生しない。
+
+        Args:
+            pattern (str): ruler_data_path からのグロブ (*.csv なら CSV として読む)
+            schema (Type[SchemaModel]): 読み込むカラムを宣言したスキーマ
+
+        Returns:
+            pl.DataFrame: 全ファイルを連結したデータ (チャンクは結合しない)
+        """
+        parse = pl.read_csv if pattern.endswith('.csv') else pl.read_parquet
+        columns = schema_columns(schema)
+        frames = []
+        for source in sorted(self.ruler_data_path.glob(pattern)):
+            if DEFAULT_RULER_CACHE_DIR in source.parts:
+                continue
+            df = self.ruler_cache.get(source, parse)
+            frames.append(_conform(df.select([c for c in columns if c in df.columns]), schema))
+        if not frames:
+            raise FileNotFoundError(f"No ruler data matching {pattern} in {self.ruler_data_path}")
+        return pl.concat(frames, how='vertical_relaxed', rechunk=False)
+
+    # -----------------------------------------------------------------
+    # frame_size ごとの逐次読み込み
+    # -----------------------------------------------------------------
+    def _frame_size(self, key: str) -> int:
+        if not self.config:
+            raise ValueError(f"frame size is required when no config is given (frame_size.{key})")
+        return getattr(self.config, key)
+
+    @staticmethod
+    def _csv_batches(path: Union[str, Path], schema: Type[SchemaModel]) -> Iterator:
+        """
+        CSV をスキーマのカラムだけ、スキーマの型でストリーミングで読む
+        """
+        with open(path, newline='') as file:
+            header = next(csv.reader(file))
+        types = {name: t for name, t in arrow_types(schema).items() if name in header}
+        reader = pa_csv.open_csv(
+            str(path), convert_options=pa_csv.ConvertOptions(column_types=types, include_columns=list(types)))
+        yield from reader
+
+    @staticmethod
+    def _parquet_batches(path: Union[str, Path], schema: Type[SchemaModel], size: int) -> Iterator:
+        """
+        Parquet をスキーマのカラムだけ行グループ単位で読む
+        """
+        parquet = pq.ParquetFile(str(path))
+        names = set(parquet.schema_arrow.names)
+        columns = [name for name in schema_columns(schema) if name in names]
+        yield from parquet.iter_batches(batch_size=size, columns=columns)
+
+    def _iter_frames(self, batches: Iterator, schema: Type[SchemaModel], size: int,
+                     prefetch_depth: int) -> Iterator[pl.DataFrame]:
+        frames = (_conform(pl.from_arrow(table), schema) for table in rebatch(batches, size))
+        return prefetch(frames, prefetch_depth)
+
+    def iter_quotation_frames(self, size: Optional[int] = None,
+                              prefetch_depth: int = 1) -> Iterator[pl.DataFrame]:
+        """
+        Quotation CSV を frame_size.pen 行ずつ返す
+
+        次のフレームはバックグラウンドで先読みするため、下流の処理と読み込みが重なる。
+        メモリに載るのはフレーム数個ぶんだけなので、RAM より大きい入力も処理できる。
+
+        Args:
+            size (Optional[int]): 1フレームの行数 (既定: frame_size.pen)
+            prefetch_depth (int): 先読みするフレーム数
+
+        Returns:
+            Iterator[pl.DataFrame]: ちょうど size 行のフレーム (最後だけ端数)
+        """
+        size = size or self._frame_size('pen')
+        batches = self._csv_batches(self.quotation_path, QuotationSchema)
+        return self._iter_frames(batches, QuotationSchema, size, prefetch_depth)
+
+    def iter_fbc_frames(self, path: Union[str, Path], size: Optional[int] = None,
+                        prefetch_depth: int = 1) -> Iterator[pl.DataFrame]:
+        """
+        fbc データ (Parquet または CSV) を frame_size.book 行ずつ返す
+
+        Args:
+            path (Union[str, Path]): fbc ファイル
+            size (Optional[int]): 1フレームの行数 (既定: frame_size.book)
+            prefetch_depth (int): 先読みするフレーム数
+
+        Returns:
+            Iterator[pl.DataFrame]: ちょうど size 行のフレーム (最後だけ端数)
+        """
+        size = size or self._frame_size('book')
+        if str(path).endswith('.csv'):
+            batches = self._csv_batches(path, FbcSchema)
+        else:
+            batches = self._parquet_batches(path, FbcSchema, size)
+        return self._iter_frames(batches, FbcSchema, size, prefetch_depth)
+
+    # -----------------------------------------------------------------
+    # condition_table / LUT との索引付き結合
+    # -----------------------------------------------------------------
+    def lookup_index(self, table: str, on: List[str]) -> LookupIndex:
+        """
+        ディメンション表の索引を返す (プロセス内でも LUT の隣にもキャッシュする)
+
+        Args:
+            table (str): 'condition' (condition_table) / 'lut' (lut_table_path)
+            on (List[str]): キーのカラム
+
+        Returns:
+            LookupIndex: 索引
+        """
+        paths = {'condition': self.condition_path,
+                 'lut': self.config.lut_table_path if self.config else None}
+        if table not in paths:
+            raise ValueError(f"Unknown lookup table: {table}")
+        if not paths[table]:
+            raise ValueError(f"{table} table path is not configured")
+        key = (table, tuple(on))
+        index = self._lookup_indexes.get(key)
+        if index is None:
+            index = self._lookup_indexes[key] = LookupIndex.from_file(paths[table], on)
+        return index
+
+    def lookup_join(self, batch: pl.DataFrame, table: str, on: List[str],
+                    how: str = 'left') -> pl.DataFrame:
+        """
+        バッチにディメンション表を結合する
+
+        iter_quotation_frames / iter_fbc_frames のバッチごとに呼ぶ想定。
+        索引は1回だけ作られ、全バッチで使い回される。
+
+        Args:
+            batch (pl.DataFrame): プローブ側のバッチ
+            table (str): 'condition' / 'lut'
+            on (List[str]): キーのカラム
+            how (str): 'left' / 'inner'
+
+        Returns:
+            pl.DataFrame: 結合結果
+        """
+        return self.lookup_index(table, on).probe(batch, how=how)
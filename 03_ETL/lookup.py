@@ -0,0 +1,129 @@
+from pathlib import Path
+from typing import List, Union
+
+import numpy as np
+import polars as pl
+
+from ipc_cache import IpcCache
+
+# キーのハッシュを入れるカラム
+HASH_COLUMN = '__key_hash'
+
+# キーのハッシュのシード (変えるとキャッシュは作り直しになる)
+HASH_SEED = 0x46424321
+
+
+def _key_hash(frame: pl.DataFrame, on: List[str]) -> pl.Series:
+    """
+    キー (複合キー可) の 64bit ハッシュ
+
+    Args:
+        frame (pl.DataFrame): キーを含むデータ
+        on (List[str]): キーのカラム
+
+    Returns:
+        pl.Series: UInt64 のハッシュ
+    """
+    return frame.select(pl.struct(on).hash(HASH_SEED).alias(HASH_COLUMN)).to_series()
+
+
+def build_index_frame(table: pl.DataFrame, on: List[str]) -> pl.DataFrame:
+    """
+    ディメンション表をキーのハッシュ順に並べた索引を作る
+
+    Args:
+        table (pl.DataFrame): ディメンション表 (condition_table / LUT)
+        on (List[str]): キーのカラム
+
+    Returns:
+        pl.DataFrame: 先頭にハッシュのカラムを持ち、ハッシュ昇順に並んだ表
+
+    Raises:
+        ValueError: キーが一意でない (多対多の結合になる)
+    """
+    if table.select(on).is_duplicated().any():
+        raise ValueError(f"Lookup keys {on} are not unique")
+    indexed = table.insert_column(0, _key_hash(table, on)).sort(HASH_COLUMN)
+    if indexed[HASH_COLUMN].is_duplicated().any():
+        raise ValueError(f"Hash collision in lookup keys {on}; change HASH_SEED")
+    return indexed
+
+
+class LookupIndex:
+    def __init__(self, indexed: pl.DataFrame, on: List[str]) -> None:
+        """
+        LookupIndexクラスの初期化
+
+        ハッシュ昇順に並んだディメンション表を searchsorted で引く。
+        プローブ側のバッチごとに一般的な merge (ハッシュ表の構築) をせず、
+        作り置きの索引に二分探索するだけで結合できる。
+
+        Args:
+            indexed (pl.DataFrame): build_index_frame の結果
+            on (List[str]): キーのカラム
+        """
+        self.on = on
+        self.hashes = indexed[HASH_COLUMN].to_numpy()
+        self.keys = indexed.select(on)
+        self.payload = indexed.drop([HASH_COLUMN] + on)
+
+    @classmethod
+    def from_file(cls, path: Union[str, Path], on: List[str]) -> 'LookupIndex':
+        """
+        ディメンション表のファイルから索引を作る (LUT の隣にキャッシュする)
+
+        索引は LUT と同じディレクトリに Arrow IPC で保存してメモリマップで読む。
+        LUT の内容が変わったとき (と Polars のバージョンが変わってハッシュが
+        変わりうるとき) だけ作り直す。
+
+        Args:
+            path (Union[str, Path]): CSV または Parquet のディメンション表
+            on (List[str]): キーのカラム
+
+        Returns:
+            LookupIndex: 索引
+        """
+        path = Path(path)
+        parse = pl.read_parquet if path.suffix == '.parquet' else pl.read_csv
+        variant = f"lookup:{','.join(on)}:{HASH_SEED}:{pl.__version__}"
+        indexed = IpcCache(path.parent).get(path, lambda p: build_index_frame(parse(p), on), variant)
+        return cls(indexed, on)
+
+    def probe(self, batch: pl.DataFrame, how: str = 'left') -> pl.DataFrame:
+        """
+        プローブ側のバッチにディメンション表のカラムを付ける
+
+        Args:
+            batch (pl.DataFrame): quotation / fbc のバッチ
+            how (str): 'left' (見つからなければ null) / 'inner' (見つかった行だけ)
+
+        Returns:
+            pl.DataFrame: ディメンション表のカラムを付けたバッチ
+                (バッチと同名のカラムには _right を付ける)
+        """
+        if len(self.hashes) == 0:
+            empty = batch.with_columns([pl.lit(None, dtype=t).alias(c) for c, t in self.payload.schema.items()])
+            return empty.clear() if how == 'inner' else empty
+
+        keys = batch.select([pl.col(c).cast(self.keys.schema[c]) for c in self.on])
+        probe_hashes = _key_hash(keys, self.on).to_numpy()
+        pos = np.minimum(np.searchsorted(self.hashes, probe_hashes), len(self.hashes) - 1)
+        found = self.hashes[pos] == probe_hashes
+        index = pl.Series(np.where(found, pos, 0), dtype=pl.UInt32)
+
+        # ハッシュが一致してもキーが違う行 (衝突) は見つからなかった扱いにする
+        matched = self.keys.select(pl.all().gather(index))
+        for c in self.on:
+            found &= (matched[c] == keys[c]).fill_null(False).to_numpy()
+
+        mask = pl.Series(found)
+        payload = self.payload.select(pl.all().gather(index)).select(
+            [pl.when(mask).then(pl.col(c)).otherwise(None)
+             .alias(f'{c}_right' if c in batch.columns else c) for c in self.payload.columns]
+        )
+        joined = pl.concat([batch, payload], how='horizontal')
+        if how == 'inner':
+            return joined.filter(mask)
+        if how == 'left':
+            return joined
+        raise ValueError(f"Unknown how: {how}")
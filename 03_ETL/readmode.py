@@ -0,0 +1,152 @@
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Union
+
+import polars as pl
+import pyarrow.parquet as pq
+
+from loader import Loader
+
+# 読み出しモードの処理: fbc のフレーム -> そのモードの出力
+ReadmodeHandler = Callable[[pl.DataFrame], pl.DataFrame]
+
+# config.readmode の値 (例: 'bigmac') -> 処理
+# このモジュールは処理を持たないので空で始まる。使う側が register_readmode で登録するか、
+# MultiReadmodeRunner に handlers で渡す (どちらも無い readmode は KeyError)
+READMODE_HANDLERS: Dict[str, ReadmodeHandler] = {}
+
+
+def register_readmode(name: str) -> Callable[[ReadmodeHandler], ReadmodeHandler]:
+    """
+    読み出しモードの処理を登録するデコレータ
+
+    Args:
+        name (str): config.readmode の値
+
+    Returns:
+        Callable[[ReadmodeHandler], ReadmodeHandler]: デコレータ
+    """
+    def decorator(func: ReadmodeHandler) -> ReadmodeHandler:
+        READMODE_HANDLERS[name] = func
+        return func
+    return decorator
+
+
+class ParquetSink:
+    def __init__(self, path: Union[str, Path]) -> None:
+        """
+        ParquetSinkクラスの初期化
+
+        フレームを受け取るたびに1つの Parquet ファイルへ行グループとして追記する。
+        書き込み中のファイルは .tmp で、close したときに本来の名前にする。
+
+        Args:
+            path (Union[str, Path]): 出力ファイル
+        """
+        self.path = Path(path)
+        self.tmp = self.path.with_suffix(self.path.suffix + '.tmp')
+        self.writer: Optional[pq.ParquetWriter] = None
+        self.rows = 0
+
+    def write(self, frame: pl.DataFrame) -> None:
+        """
+        フレームを追記する
+        """
+        table = frame.to_arrow()
+        if self.writer is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.writer = pq.ParquetWriter(self.tmp, table.schema)
+        self.writer.write_table(table)
+        self.rows += len(frame)
+
+    def close(self) -> None:
+        """
+        ファイルを閉じて本来の名前にする
+        """
+        if self.writer is not None:
+            self.writer.close()
+            self.tmp.replace(self.path)
+            self.writer = None
+
+    def abort(self) -> None:
+        """
+        書きかけのファイルを捨てる (途中までの出力を残さない)
+        """
+        if self.writer is not None:
+            self.writer.close()
+            self.tmp.unlink()
+            self.writer = None
+
+
+class MultiReadmodeRunner:
+    def __init__(self, loader: Loader, handlers: Optional[Dict[str, ReadmodeHandler]] = None,
+                 workers: Optional[int] = None) -> None:
+        """
+        MultiReadmodeRunnerクラスの初期化
+
+        config.readmode の全モードを1回のスキャンで計算する。
+        fbc の入力は frame_size.book 行ずつ1回だけ読んでパースし、
+        同じフレームを全モードの処理に渡して、モードごとの出力先に書く。
+        モード数 N に対して読み込みとパースのコストは 1/N になる。
+
+        Args:
+            loader (Loader): 設定済みの Loader
+            handlers (Optional[Dict[str, ReadmodeHandler]]): config.readmode の値 -> 処理
+                (既定: register_readmode で登録したもの。このモジュール自体は何も登録しない)
+            workers (Optional[int]): 1フレームに対してモードを並列に処理するスレッド数
+
+        Raises:
+            ValueError: Loader に config が無い場合
+            KeyError: config.readmode に処理が登録されていない値がある場合
+        """
+        if not loader.config:
+            raise ValueError("MultiReadmodeRunner requires a configured Loader")
+        registry = READMODE_HANDLERS if handlers is None else handlers
+        self.loader = loader
+        self.modes: Dict[str, ReadmodeHandler] = {}
+        for mode, name in loader.config.readmode.items():
+            if name not in registry:
+                raise KeyError(f"No handler registered for readmode {mode} ({name}); "
+                               f"register one with register_readmode({name!r}) or pass handlers")
+            self.modes[mode] = registry[name]
+        self.workers = workers or max(len(self.modes), 1)
+
+    def _sinks(self, source: Path) -> Dict[str, ParquetSink]:
+        # 別のディレクトリにある同じ名前の入力が同じ出力を上書きしないよう、入力のパスのハッシュを付ける
+        digest = hashlib.blake2b(str(source.resolve()).encode(), digest_size=4).hexdigest()
+        output = Path(self.loader.config.output_path)
+        return {mode: ParquetSink(output / mode / f'{source.stem}-{digest}.parquet') for mode in self.modes}
+
+    def run(self, paths: Iterable[Union[str, Path]]) -> Dict[str, List[Path]]:
+        """
+        入力ファイルを1回ずつ読み、全モードの出力を書く
+
+        Args:
+            paths (Iterable[Union[str, Path]]): fbc の入力ファイル
+
+        Returns:
+            Dict[str, List[Path]]: モード -> 書き出したファイル
+                (output_path/<モード>/<入力の stem>-<入力のパスのハッシュ>.parquet)
+        """
+        written: Dict[str, List[Path]] = {mode: [] for mode in self.modes}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for path in map(Path, paths):
+                logging.info(f"Shared scan ({', '.join(self.modes)}): {path}")
+                sinks = self._sinks(path)
+                try:
+                    for frame in self.loader.iter_fbc_frames(path):
+                        futures = {mode: pool.submit(handler, frame) for mode, handler in self.modes.items()}
+                        for mode, future in futures.items():
+                            sinks[mode].write(future.result())
+                except BaseException:
+                    for sink in sinks.values():
+                        sink.abort()
+                    raise
+                for sink in sinks.values():
+                    sink.close()
+                for mode, sink in sinks.items():
+                    if sink.rows:
+                        written[mode].append(sink.path)
+        return written
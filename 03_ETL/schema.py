@@ -0,0 +1,108 @@
+from typing import Dict, List, Type
+
+import pandera as pa
+import polars as pl
+import pyarrow
+from pandera import SchemaModel
+from pandera.typing import Series
+
+# =====================================================================
+# Pandera スキーマ (リネーム後のカラム)
+# =====================================================================
+class QuotationSchema(SchemaModel):
+    """
+    Quotation 用のカラムを定義 (リネーム後のみ)
+    """
+    ID: Series[int] = pa.Field()
+    testid: Series[int] = pa.Field()
+    exam_number: Series[int] = pa.Field()
+    buddy: Series[int] = pa.Field()
+    stapler: Series[int] = pa.Field()
+    tracking_marker: Series[float] = pa.Field()
+    read_crinkle: Series[float] = pa.Field()
+    stapler_time: Series[int] = pa.Field()
+    tape: Series[str] = pa.Field()
+    tape_temp: Series[float] = pa.Field()
+    ink_cycle: Series[float] = pa.Field()
+
+    class Config:
+        strict = True
+
+
+class ConditionSchema(SchemaModel):
+    """
+    Condition 用
+    """
+    scotch_temp: Series[int] = pa.Field()
+    scotch_time: Series[str] = pa.Field()
+    tape: Series[int] = pa.Field()
+    stapler_temp: Series[float] = pa.Field()
+
+    class Config:
+        strict = True
+
+
+# fbc の Parquet は Quotation と同じカラム構成
+FbcSchema = QuotationSchema
+
+
+# pandera の dtype 名 -> Polars の dtype
+POLARS_DTYPES = {
+    'int64': pl.Int64,
+    'float64': pl.Float64,
+    'str': pl.Utf8,
+    'bool': pl.Boolean,
+}
+
+# pandera の dtype 名 -> Arrow の型 (pyarrow でストリーミング読み込みするとき)
+ARROW_TYPES = {
+    'int64': pyarrow.int64(),
+    'float64': pyarrow.float64(),
+    'str': pyarrow.string(),
+    'bool': pyarrow.bool_(),
+}
+
+
+def schema_columns(model: Type[SchemaModel]) -> List[str]:
+    """
+    スキーマで宣言されたカラム名を宣言順に返す
+
+    Args:
+        model (Type[SchemaModel]): スキーマ
+
+    Returns:
+        List[str]: カラム名
+    """
+    return list(model.to_schema().columns)
+
+
+def polars_dtypes(model: Type[SchemaModel]) -> Dict[str, pl.DataType]:
+    """
+    スキーマのカラム -> Polars の dtype
+
+    Args:
+        model (Type[SchemaModel]): スキーマ
+
+    Returns:
+        Dict[str, pl.DataType]: カラム名 -> dtype
+    """
+    return {
+        name: POLARS_DTYPES[str(column.dtype)]
+        for name, column in model.to_schema().columns.items()
+    }
+
+
+def arrow_types(model: Type[SchemaModel]) -> Dict[str, pyarrow.DataType]:
+    """
+    スキーマのカラム -> Arrow の型
+
+    Args:
+        model (Type[SchemaModel]): スキーマ
+
+    Returns:
+        Dict[str, pyarrow.DataType]: カラム名 -> 型
+    """
+    return {
+        name: ARROW_TYPES[str(column.dtype)]
+        for name, column in model.to_schema().columns.items()
+    }
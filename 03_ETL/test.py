@@ -8,13 +8,18 @@ from io import StringIO, BytesIO
 import yaml
 
 import pandera as pa
-from pandera.typing import SchemaModel, Series
+from pandera import SchemaModel
+from pandera.typing import Series
 
 # =====================================================================
 # (A) Config クラス (loader.py) を想定
 # =====================================================================
 from loader import Config, Loader
 
+# モックの side_effect 内ではパッチ前の関数を使う (パッチ後の関数を呼ぶと再帰する)
+_real_read_csv = pl.read_csv
+_real_read_parquet = pl.read_parquet
+
 # シナリオ1: 正常 (全キーあり, 型OK)
 FAKE_YAML_DATA_NORMAL = {
     "input_path": {
@@ -117,37 +122,7 @@ def test_config_wrong_type():
 # =====================================================================
 # (B) Pandera スキーマ (SchemaModel) => QuotationSchema, ConditionSchema
 # =====================================================================
-class QuotationSchema(SchemaModel):
-    """
-    Quotation 用のカラムを定義 (リネーム後のみ)
-    """
-    ID: Series[int] = pa.Field()
-    testid: Series[int] = pa.Field()
-    exam_number: Series[int] = pa.Field()
-    buddy: Series[int] = pa.Field()
-    stapler: Series[int] = pa.Field()
-    tracking_marker: Series[float] = pa.Field()
-    read_crinkle: Series[float] = pa.Field()
-    stapler_time: Series[int] = pa.Field()
-    tape: Series[str] = pa.Field()
-    tape_temp: Series[float] = pa.Field()
-    ink_cycle: Series[float] = pa.Field()
-
-    class Config:
-        strict = True
-
-
-class ConditionSchema(SchemaModel):
-    """
-    Condition 用
-    """
-    scotch_temp: Series[int] = pa.Field()
-    scotch_time: Series[str] = pa.Field()
-    tape: Series[int] = pa.Field()
-    stapler_temp: Series[float] = pa.Field()
-
-    class Config:
-        strict = True
+from schema import ConditionSchema, QuotationSchema
 
 
 # =====================================================================
@@ -177,9 +152,9 @@ def side_effect_read_csv(file_path, *, columns=None, dtypes=None, **kwargs):
     polars.read_csv のモック
     """
     if "quotation" in str(file_path).lower():
-        return pl.read_csv(StringIO(FAKE_QUOTATION_CSV))
+        return _real_read_csv(StringIO(FAKE_QUOTATION_CSV))
     elif "condition" in str(file_path).lower():
-        return pl.read_csv(StringIO(FAKE_CONDITION_CSV))
+        return _real_read_csv(StringIO(FAKE_CONDITION_CSV))
     else:
         return pl.DataFrame()
 
@@ -219,10 +194,11 @@ def make_side_effect_csv(csv_text: str):
     factory for polars.read_csv => Param CSV
     """
     def _side_effect_read_csv(file_path, **kwargs):
-        return pl.read_csv(StringIO(csv_text))
+        return _real_read_csv(StringIO(csv_text))
     return _side_effect_read_csv
 
 import pandera.errors
+import pyarrow.parquet as pq
 
 @pytest.mark.parametrize("csv_text, expected_fail", [
     (FAKE_QUOTATION_CSV, False),           # 正常
@@ -236,13 +212,12 @@ def test_load_quotation_csv_scenarios(mock_loader, csv_text, expected_fail):
     => Pandera => QuotationSchema
     """
     with patch("polars.read_csv", side_effect=make_side_effect_csv(csv_text)):
-        df = mock_loader.load_quotation_csv()
-        pdf = df.to_pandas()
         if expected_fail:
+            # 型不正は読み込み時に (null にせず) 失敗する
             with pytest.raises(pandera.errors.SchemaError):
-                QuotationSchema.validate(pdf)
+                QuotationSchema.validate(mock_loader.load_quotation_csv().to_pandas())
         else:
-            QuotationSchema.validate(pdf)
+            QuotationSchema.validate(mock_loader.load_quotation_csv().to_pandas())
 
 
 # =====================================================================
@@ -290,7 +265,7 @@ def make_side_effect_parquet(parquet_bytes: bytes):
     patch("polars.read_parquet") => BytesIO(parquet_bytes)
     """
     def _side_effect_read_parquet(file_path, **kwargs):
-        return pl.read_parquet(BytesIO(parquet_bytes))
+        return _real_read_parquet(BytesIO(parquet_bytes))
     return _side_effect_read_parquet
 
 def test_load_quotation_parquet_valid(mock_loader):
@@ -309,7 +284,405 @@ def test_load_quotation_parquet_invalid(mock_loader):
     """
     data_bytes = make_fake_parquet(valid=False)
     with patch("polars.read_parquet", side_effect=make_side_effect_parquet(data_bytes)):
-        df = mock_loader.load_fbc_parquet(Path("fake.parquet"))
-        pdf = df.to_pandas()
-        with pytest.raises(pa.errors.SchemaError):
-            QuotationSchema.validate(pdf)
\ No newline at end of file
+        with pytest.raises(pa.errors.SchemaError, match="read_crinkle"):
+            mock_loader.load_fbc_parquet(Path("fake.parquet"))
+
+# =====================================================================
+# (F) 遅延スキャン (射影・フィルタの押し込み)
+# =====================================================================
+@pytest.fixture
+def wide_fbc_dir(tmp_path):
+    """
+    ジョブが使わないカラムを多数持つ fbc Parquet を2ファイル作る
+    """
+    ruler = tmp_path / "ruler"
+    (ruler / "we3000").mkdir(parents=True)
+    base = pl.read_parquet(BytesIO(make_fake_parquet(valid=True)))
+    wide = base.with_columns([pl.lit(i).alias(f"unused_{i}") for i in range(20)])
+    wide.write_parquet(ruler / "we3000" / "a.parquet")
+    wide.with_columns(pl.col("ID") + 10).write_parquet(ruler / "b.parquet")
+    return ruler
+
+
+def make_loader(tmp_path, ruler_data_path=None):
+    quotation = tmp_path / "quotation.csv"
+    quotation.write_text(FAKE_QUOTATION_CSV_EXTRA_COL)
+    return Loader(Config(
+        quotation_path=str(quotation), condition_table="", lut_table_path=None,
+        ruler_data_path=str(ruler_data_path) if ruler_data_path else None,
+        pen=1, book=1, readmode={}, output_path=str(tmp_path / "out"),
+    ))
+
+
+def test_scan_quotation_csv_projection_and_filter(tmp_path):
+    """
+    スキーマ外のカラムは読まず、フィルタが効く
+    """
+    loader = make_loader(tmp_path)
+    lf = loader.scan_quotation_csv(filters=pl.col("ID") == 2)
+    assert isinstance(lf, pl.LazyFrame)
+    df = lf.collect()
+    assert "dummy_col" not in df.columns
+    assert df["ID"].to_list() == [2]
+    assert df.schema["tape_temp"] == pl.Float64
+    QuotationSchema.validate(df.to_pandas())
+
+
+def test_scan_quotation_csv_rejects_uncastable_values(tmp_path):
+    """
+    遅延スキャンでも変換できない値は null にせず collect 時に失敗する
+    """
+    loader = make_loader(tmp_path)
+    Path(loader.quotation_path).write_text(FAKE_QUOTATION_CSV_WRONG_TYPE)
+    with pytest.raises(pl.exceptions.PolarsError):
+        loader.scan_quotation_csv().collect()
+
+
+def test_scan_fbc_parquet_reads_only_schema_columns(tmp_path, wide_fbc_dir):
+    """
+    fbc Parquet の射影がスキャンに押し込まれる
+    """
+    loader = make_loader(tmp_path)
+    lf = loader.scan_fbc_parquet(wide_fbc_dir / "b.parquet", filters=pl.col("ID") > 11)
+    plan = lf.explain()
+    assert "unused_0" not in plan
+    assert lf.collect()["ID"].to_list() == [12]
+
+
+def test_scan_ruler_data_multi_file(tmp_path, wide_fbc_dir):
+    """
+    ruler_data_path 以下を1つのスキャンで読む
+    """
+    loader = make_loader(tmp_path, ruler_data_path=wide_fbc_dir)
+    df = loader.scan_ruler_data().collect()
+    assert sorted(df["ID"].to_list()) == [1, 2, 11, 12]
+    assert df.columns == list(QuotationSchema.to_schema().columns)
+
+
+# =====================================================================
+# (G) Polars ネイティブ検証 (to_pandas なし)
+# =====================================================================
+@pytest.mark.parametrize("csv_text, expected_fail", [
+    (FAKE_QUOTATION_CSV, False),
+    (FAKE_QUOTATION_CSV_MISSING_COL, True),
+    (FAKE_QUOTATION_CSV_WRONG_TYPE,   True),
+    (FAKE_QUOTATION_CSV_EXTRA_COL,    True),
+])
+def test_validate_polars_scenarios(mock_loader, csv_text, expected_fail):
+    """
+    pandas 版 (D) と同じ4シナリオを Polars のまま検証する
+    """
+    with patch("polars.read_csv", side_effect=make_side_effect_csv(csv_text)):
+        if expected_fail:
+            with pytest.raises(pandera.errors.SchemaError):
+                mock_loader.load_quotation_csv(validate=True)
+        else:
+            mock_loader.load_quotation_csv(validate=True)
+
+
+def test_validate_polars_lazy(mock_loader):
+    """
+    LazyFrame も検証でき、検証後も LazyFrame のまま
+    """
+    lf = _real_read_csv(StringIO(FAKE_CONDITION_CSV)).lazy()
+    assert isinstance(mock_loader.validate(lf, ConditionSchema), pl.LazyFrame)
+    with pytest.raises(pandera.errors.SchemaError):
+        mock_loader.validate(lf, QuotationSchema)
+
+
+class RangeSchema(SchemaModel):
+    """
+    値域・欠損のチェック用
+    """
+    stapler: Series[int] = pa.Field(ge=100, le=200)
+    tape: Series[str] = pa.Field(isin=["3mon", "6mon"])
+    tape_temp: Series[float] = pa.Field(nullable=True)
+
+
+@pytest.mark.parametrize("frame, expected_fail", [
+    (pl.DataFrame({"stapler": [168, 120], "tape": ["3mon", "6mon"], "tape_temp": [62.0, None]}), False),
+    (pl.DataFrame({"stapler": [168, 99], "tape": ["3mon", "6mon"], "tape_temp": [62.0, 1.0]}), True),
+    (pl.DataFrame({"stapler": [168, None], "tape": ["3mon", "6mon"], "tape_temp": [62.0, 1.0]}), True),
+    (pl.DataFrame({"stapler": [168, 120], "tape": ["3mon", "1yr"], "tape_temp": [62.0, 1.0]}), True),
+])
+def test_validate_polars_checks(mock_loader, frame, expected_fail):
+    """
+    値域 (ge/le)・isin・nullable を Polars 式で判定する
+    """
+    for data in (frame, frame.lazy()):
+        if expected_fail:
+            with pytest.raises(pandera.errors.SchemaError):
+                mock_loader.validate(data, RangeSchema)
+        else:
+            mock_loader.validate(data, RangeSchema)
+
+
+# =====================================================================
+# (H) Arrow 経由のゼロコピー受け渡し
+# =====================================================================
+def _buffer_addresses(array) -> list:
+    import pyarrow
+    if isinstance(array, pyarrow.ChunkedArray):
+        assert array.num_chunks == 1
+        array = array.chunk(0)
+    return [b.address for b in array.buffers() if b is not None]
+
+
+@pytest.mark.parametrize("zero_copy_strings", [False, True])
+def test_to_pandas_shares_buffers(mock_loader, zero_copy_strings):
+    """
+    数値カラムは常に、文字列は zero_copy_strings=True のとき Polars とバッファを共有する
+    """
+    df = _real_read_csv(StringIO(FAKE_QUOTATION_CSV))
+    pdf = mock_loader.to_pandas(df, zero_copy_strings=zero_copy_strings)
+    assert all(str(t).endswith("[pyarrow]") for t in pdf.dtypes)
+    compat = pl.CompatLevel.newest() if zero_copy_strings else pl.CompatLevel.oldest()
+    for name in ("ID", "tracking_marker"):
+        assert _buffer_addresses(pdf[name].array._pa_array) == _buffer_addresses(df[name].to_arrow())
+    shared = _buffer_addresses(pdf["tape"].array._pa_array) == \
+        _buffer_addresses(df["tape"].to_arrow(compat_level=compat))
+    assert shared or not zero_copy_strings
+    assert pdf["ID"].tolist() == [1, 2]
+
+
+def test_from_pandas_round_trip(mock_loader):
+    """
+    pandas 側で処理した結果を Polars に戻せる
+    """
+    df = _real_read_csv(StringIO(FAKE_QUOTATION_CSV))
+    pdf = mock_loader.to_pandas(df)
+    pdf = pdf[pdf["tape"] == "3mon"]
+    assert Loader.from_pandas(pdf).equals(df)
+
+
+# =====================================================================
+# (I) ruler データの IPC キャッシュ
+# =====================================================================
+import os
+
+
+def test_load_ruler_data_uses_ipc_cache(tmp_path, wide_fbc_dir):
+    """
+    2回目以降はパースせず、mtime だけの変更では作り直さず、内容が変われば作り直す
+    """
+    loader = make_loader(tmp_path, ruler_data_path=wide_fbc_dir)
+    with patch("polars.read_parquet", wraps=_real_read_parquet) as read_parquet:
+        first = loader.load_ruler_data()
+        assert read_parquet.call_count == 2
+        second = loader.load_ruler_data()
+        assert read_parquet.call_count == 2
+        assert second.equals(first)
+        assert second.columns == list(QuotationSchema.to_schema().columns)
+
+        source = wide_fbc_dir / "b.parquet"
+        os.utime(source, ns=(source.stat().st_atime_ns, source.stat().st_mtime_ns + 10**9))
+        loader.load_ruler_data()
+        assert read_parquet.call_count == 2
+
+        _real_read_parquet(source).with_columns(pl.col("ID") + 100).write_parquet(source)
+        third = loader.load_ruler_data()
+        assert read_parquet.call_count == 3
+    assert sorted(third["ID"].to_list()) == [1, 2, 111, 112]
+    assert list((wide_fbc_dir / ".ipc_cache").glob("*.arrow"))
+
+
+# =====================================================================
+# (J) frame_size ごとのイテレータ
+# =====================================================================
+def make_rows(n: int) -> pl.DataFrame:
+    base = _real_read_csv(StringIO(FAKE_QUOTATION_CSV))
+    return pl.concat([base] * (n // 2)).with_columns(pl.int_range(0, pl.len()).alias("ID"))
+
+
+@pytest.mark.parametrize("size", [1, 7, 25, 1000])
+def test_iter_fbc_frames_exact_sizes(tmp_path, size):
+    """
+    Parquet (行グループ 10 行) を size 行ずつ切り直して返す
+    """
+    data = make_rows(50).with_columns([pl.lit(0).alias("unused")])
+    path = tmp_path / "fbc.parquet"
+    data.write_parquet(path, row_group_size=10)
+    loader = make_loader(tmp_path)
+    frames = list(loader.iter_fbc_frames(path, size=size))
+    assert [len(f) for f in frames[:-1]] == [size] * (len(frames) - 1)
+    assert 0 < len(frames[-1]) <= size
+    merged = pl.concat(frames)
+    assert merged["ID"].to_list() == list(range(50))
+    assert "unused" not in merged.columns
+    QuotationSchema.validate(merged.to_pandas())
+
+
+def test_iter_quotation_frames_uses_pen(tmp_path):
+    """
+    Quotation CSV は frame_size.pen 行ずつ
+    """
+    loader = make_loader(tmp_path)
+    make_rows(30).write_csv(loader.config.quotation_path)
+    loader.config.pen = 8
+    frames = list(loader.iter_quotation_frames())
+    assert [len(f) for f in frames] == [8, 8, 8, 6]
+    assert frames[0].schema["tape_temp"] == pl.Float64
+
+
+def test_iter_frames_stops_prefetch_early(tmp_path):
+    """
+    途中で反復をやめても先読みスレッドが残らない
+    """
+    import threading
+    path = tmp_path / "fbc.parquet"
+    make_rows(100).write_parquet(path, row_group_size=5)
+    loader = make_loader(tmp_path)
+    frames = loader.iter_fbc_frames(path, size=5, prefetch_depth=2)
+    next(frames)
+    frames.close()
+    assert not [t for t in threading.enumerate() if t.name == "frame-prefetch"]
+
+
+# =====================================================================
+# (K) condition_table / LUT の索引付き結合
+# =====================================================================
+FAKE_LUT_CSV = """\
+tape,stapler,lut_gain,lut_name
+3mon,168,1.5,alpha
+3mon,120,2.5,beta
+6mon,168,3.5,gamma
+"""
+
+
+def test_lookup_join_matches_polars_join(tmp_path):
+    """
+    複合キーの結合結果が Polars の left join と一致し、索引は LUT の隣に1回だけ作られる
+    """
+    lut = tmp_path / "lut.csv"
+    lut.write_text(FAKE_LUT_CSV)
+    loader = make_loader(tmp_path)
+    loader.config.lut_table_path = str(lut)
+    batch = make_rows(6).with_columns(
+        pl.Series("stapler", [168, 120, 999, 168, 120, 168]),
+        pl.Series("tape", ["3mon", "3mon", "3mon", "6mon", "6mon", "x"]),
+    )
+    with patch("polars.read_csv", wraps=_real_read_csv) as read_csv:
+        got = loader.lookup_join(batch, "lut", on=["tape", "stapler"])
+        loader.lookup_join(batch, "lut", on=["tape", "stapler"])
+        Loader(loader.config).lookup_join(batch, "lut", on=["tape", "stapler"])
+        assert read_csv.call_count == 1
+    expected = batch.join(_real_read_csv(lut), on=["tape", "stapler"], how="left")
+    assert got.equals(expected)
+    assert list(tmp_path.glob("lut.csv.*.arrow"))
+
+    inner = loader.lookup_join(batch, "lut", on=["tape", "stapler"], how="inner")
+    assert inner["lut_name"].to_list() == ["alpha", "beta", "gamma"]
+
+
+def test_lookup_index_rebuilds_when_lut_changes(tmp_path):
+    """
+    LUT が変わったときだけ索引を作り直す
+    """
+    lut = tmp_path / "lut.csv"
+    lut.write_text(FAKE_LUT_CSV)
+    loader = make_loader(tmp_path)
+    loader.config.lut_table_path = str(lut)
+    batch = pl.DataFrame({"tape": ["6mon"], "stapler": [168]})
+    assert loader.lookup_join(batch, "lut", on=["tape", "stapler"])["lut_gain"].to_list() == [3.5]
+
+    lut.write_text(FAKE_LUT_CSV.replace("3.5,gamma", "9.5,gamma"))
+    fresh = Loader(loader.config)
+    assert fresh.lookup_join(batch, "lut", on=["tape", "stapler"])["lut_gain"].to_list() == [9.5]
+
+
+def test_lookup_index_rejects_duplicate_keys(tmp_path):
+    """
+    キーが一意でない LUT は多対多になるのでエラー
+    """
+    lut = tmp_path / "lut.csv"
+    lut.write_text(FAKE_LUT_CSV + "6mon,168,4.5,delta\n")
+    loader = make_loader(tmp_path)
+    loader.config.lut_table_path = str(lut)
+    with pytest.raises(ValueError):
+        loader.lookup_index("lut", on=["tape", "stapler"])
+
+
+# =====================================================================
+# (L) 複数 readmode の共有スキャン
+# =====================================================================
+from readmode import MultiReadmodeRunner
+
+
+def test_multi_readmode_scans_each_input_once(tmp_path):
+    """
+    入力は1回だけ読み、readmode ごとの出力先に書く
+    """
+    loader = make_loader(tmp_path)
+    loader.config.readmode = {"ber1": "bigmac", "ber2": "drink"}
+    loader.config.book = 4
+    paths = []
+    for i in range(2):
+        path = tmp_path / f"fbc{i}.parquet"
+        make_rows(10).with_columns(pl.col("ID") + 100 * i).write_parquet(path)
+        paths.append(path)
+
+    handlers = {
+        "bigmac": lambda df: df.select("ID", (pl.col("stapler") * 2).alias("x")),
+        "drink": lambda df: df.filter(pl.col("buddy") == 1).select("ID"),
+    }
+    runner = MultiReadmodeRunner(loader, handlers=handlers)
+    with patch("pyarrow.parquet.ParquetFile", wraps=pq.ParquetFile) as opened:
+        written = runner.run(paths)
+        assert opened.call_count == 2
+
+    ber1 = pl.read_parquet(written["ber1"])
+    ber2 = pl.read_parquet(written["ber2"])
+    assert len(ber1) == 20 and ber1["x"].to_list()[:2] == [336, 240]
+    assert ber2["ID"].to_list() == [1, 3, 5, 7, 9, 101, 103, 105, 107, 109]
+    assert written["ber1"][0].parent == tmp_path / "out" / "ber1"
+    assert written["ber1"][0].name.startswith("fbc0-")
+
+
+def test_multi_readmode_same_stem_inputs_do_not_collide(tmp_path):
+    """
+    別のディレクトリにある同じ名前の入力は別々の出力に書く
+    """
+    loader = make_loader(tmp_path)
+    loader.config.readmode = {"ber1": "bigmac"}
+    paths = []
+    for i in range(2):
+        path = tmp_path / f"lot{i}" / "fbc.parquet"
+        path.parent.mkdir()
+        make_rows(10).with_columns(pl.col("ID") + 100 * i).write_parquet(path)
+        paths.append(path)
+
+    written = MultiReadmodeRunner(loader, handlers={"bigmac": lambda df: df.select("ID")}).run(paths)
+    assert len(set(written["ber1"])) == 2
+    assert sorted(pl.read_parquet(written["ber1"])["ID"].to_list()) == list(range(10)) + list(range(100, 110))
+
+
+def test_multi_readmode_unknown_handler(tmp_path):
+    """
+    登録されていない readmode は実行前にエラー
+    """
+    loader = make_loader(tmp_path)
+    loader.config.readmode = {"ber1": "unknown"}
+    with pytest.raises(KeyError, match="register_readmode"):
+        MultiReadmodeRunner(loader, handlers={})
+
+
+def test_multi_readmode_failure_leaves_no_partial_output(tmp_path):
+    """
+    処理が失敗したら書きかけのファイルを残さない
+    """
+    loader = make_loader(tmp_path)
+    loader.config.readmode = {"ber1": "bigmac"}
+    loader.config.book = 2
+    path = tmp_path / "fbc.parquet"
+    make_rows(10).write_parquet(path)
+    calls = []
+
+    def flaky(df):
+        calls.append(len(df))
+        if len(calls) == 3:
+            raise RuntimeError("boom")
+        return df
+
+    with pytest.raises(RuntimeError):
+        MultiReadmodeRunner(loader, handlers={"bigmac": flaky}).run([path])
+    assert not list((tmp_path / "out").rglob("*.parquet*"))
@@ -0,0 +1,116 @@
+from typing import Callable, Dict, List, Type, Union
+
+import polars as pl
+from pandera import SchemaModel
+from pandera.errors import SchemaError
+
+from schema import polars_dtypes
+
+
+def _pattern(statistics: dict) -> str:
+    """
+    str_matches / str_contains の正規表現 (re.Pattern なら文字列に戻す)
+    """
+    pattern = statistics['pattern']
+    return getattr(pattern, 'pattern', pattern)
+
+
+# pandera の組み込みチェック名 -> 「値が正しい」を表す Polars 式
+CHECK_EXPRESSIONS: Dict[str, Callable[[pl.Expr, dict], pl.Expr]] = {
+    'greater_than': lambda c, s: c > s['min_value'],
+    'greater_than_or_equal_to': lambda c, s: c >= s['min_value'],
+    'less_than': lambda c, s: c < s['max_value'],
+    'less_than_or_equal_to': lambda c, s: c <= s['max_value'],
+    'equal_to': lambda c, s: c == s['value'],
+    'not_equal_to': lambda c, s: c != s['value'],
+    'in_range': lambda c, s: (
+        (c >= s['min_value'] if s.get('include_min', True) else c > s['min_value'])
+        & (c <= s['max_value'] if s.get('include_max', True) else c < s['max_value'])
+    ),
+    'isin': lambda c, s: c.is_in(list(s['allowed_values'])),
+    'notin': lambda c, s: ~c.is_in(list(s['forbidden_values'])),
+    'str_matches': lambda c, s: c.str.contains('^(?:' + _pattern(s) + ')'),
+    'str_contains': lambda c, s: c.str.contains(_pattern(s)),
+    'str_startswith': lambda c, s: c.str.starts_with(s['string']),
+    'str_endswith': lambda c, s: c.str.ends_with(s['string']),
+}
+
+
+def _null_expr(name: str, dtype: pl.DataType) -> pl.Expr:
+    """
+    欠損を表す式 (pandas と同じく float の NaN も欠損とみなす)
+    """
+    col = pl.col(name)
+    return col.is_null() | col.is_nan() if dtype.is_float() else col.is_null()
+
+
+def _failure(model: Type[SchemaModel], data, message: str) -> SchemaError:
+    return SchemaError(model.to_schema(), data, message)
+
+
+def validate_polars(frame: Union[pl.DataFrame, pl.LazyFrame],
+                    model: Type[SchemaModel]) -> Union[pl.DataFrame, pl.LazyFrame]:
+    """
+    pandas に変換せずに Polars のデータをスキーマで検証する
+
+    カラムの有無・strict・dtype はスキーマ情報だけで判定するので、
+    LazyFrame ならデータを読まない。欠損と値域のチェックは集約式にまとめて
+    1回の select (LazyFrame なら1回の collect) で評価し、対象カラム以外は読まない。
+
+    Args:
+        frame (Union[pl.DataFrame, pl.LazyFrame]): 検証するデータ
+        model (Type[SchemaModel]): スキーマ
+
+    Returns:
+        Union[pl.DataFrame, pl.LazyFrame]: 検証済みのデータ (入力そのもの)
+
+    Raises:
+        SchemaError: スキーマに違反している (全ての違反をまとめて報告する)
+        NotImplementedError: Polars で評価できないチェックがある
+    """
+    schema = model.to_schema()
+    actual = frame.collect_schema() if isinstance(frame, pl.LazyFrame) else frame.schema
+    expected = polars_dtypes(model)
+    errors: List[str] = []
+
+    missing = [name for name in expected if name not in actual]
+    if missing:
+        errors.append(f"column(s) {missing} not in dataframe")
+    if schema.strict:
+        extra = [name for name in actual if name not in expected]
+        if extra:
+            errors.append(f"column(s) {extra} not in schema")
+
+    exprs: List[pl.Expr] = []
+    labels: List[str] = []
+    for name, column in schema.columns.items():
+        if name not in actual:
+            continue
+        if actual[name] != expected[name]:
+            errors.append(f"expected column '{name}' to have type {expected[name]}, got {actual[name]}")
+            continue
+        if not column.nullable:
+            exprs.append(_null_expr(name, actual[name]).sum().alias(f'{name}:not_nullable'))
+            labels.append(f"non-nullable column '{name}' contains null values")
+        if column.unique:
+            exprs.append((pl.len() - pl.col(name).n_unique()).alias(f'{name}:unique'))
+            labels.append(f"column '{name}' not unique")
+        for check in column.checks:
+            if check.name not in CHECK_EXPRESSIONS:
+                raise NotImplementedError(f"Check '{check.name}' on '{name}' is not supported for polars")
+            passed = CHECK_EXPRESSIONS[check.name](pl.col(name), check.statistics or {})
+            # pandera と同じく欠損はチェック対象外
+            exprs.append((~passed).fill_null(False).sum().alias(f'{name}:{check.name}'))
+            labels.append(f"column '{name}' failed {check.name} {check.statistics}")
+
+    if exprs:
+        counts = frame.select(exprs)
+        if isinstance(counts, pl.LazyFrame):
+            counts = counts.collect()
+        for label, value in zip(labels, counts.row(0)):
+            if value:
+                errors.append(f"{label} ({value} rows)")
+
+    if errors:
+        raise _failure(model, frame, f"{model.__name__}: " + '; '.join(errors))
+    return frame
@@ -0,0 +1,387 @@
+"""
+tlc_qlc の単一エントリポイント
+
+スケジューラから1ファイルずつ何千回も起動されるので、起動コストを抑える。
+
+- pandas / numpy / yaml / duckdb はそれを使うサブコマンドの中でだけ import する
+- config.yaml のパース結果を JSON にキャッシュする (mtime とサイズが変わったら作り直す)
+- --import-times で遅延 import の内訳を標準エラーに出す
+- process / run は出力の隣に FBC の分位点と uid の種類数のスケッチを書く (sketches.py)
+- process / run の --pseudonymize で uid をトークンに置き換えてから書く (pseudonymize.py)
+- process / run の --memory-budget-mb を超えるファイルはディスクに逃がしながら処理する (spill.py)
+
+使い方:
+    python cli.py process 3000_0.csv -o processed.csv
+    python cli.py run
+    python cli.py query "SELECT Page, sum(FBC) FROM processed GROUP BY Page"
+    python cli.py config
+    python cli.py serve spool/ --window 0.5
+"""
+import argparse
+import glob
+import importlib
+import json
+import logging
+import os
+import sys
+import time
+from types import ModuleType
+from typing import Any, Dict, Iterable, List, Optional
+
+# 起動時刻 (import 時間の内訳の合計に使う)
+_T0 = time.perf_counter()
+
+# ログの設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# 遅延 import したモジュール -> 秒
+IMPORT_TIMES: Dict[str, float] = {}
+
+# 既定の設定ファイル (このファイルと同じディレクトリ)
+DEFAULT_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.yaml')
+
+
+def lazy_import(name: str) -> ModuleType:
+    """
+    モジュールを必要になった時点で import し、かかった時間を記録する
+
+    Args:
+        name (str): モジュール名
+
+    Returns:
+        ModuleType: モジュール
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    IMPORT_TIMES[name] = time.perf_counter() - start
+    return module
+
+
+def _config_cache_path(path: str) -> str:
+    """
+    設定ファイルのキャッシュの置き場所 (config.yaml -> .config.yaml.json)
+    """
+    directory, name = os.path.split(os.path.abspath(path))
+    return os.path.join(directory, f'.{name}.json')
+
+
+def load_config(path: str = DEFAULT_CONFIG) -> Dict[str, Any]:
+    """
+    設定ファイルを読む (パース結果を JSON にキャッシュする)
+
+    キャッシュが設定ファイルの mtime・サイズと一致すれば yaml を import せずに返す。
+
+    Args:
+        path (str): 設定ファイル
+
+    Returns:
+        Dict[str, Any]: 設定
+    """
+    stat = os.stat(path)
+    cache_path = _config_cache_path(path)
+    try:
+        with open(cache_path) as file:
+            cached = json.load(file)
+        if cached['mtime_ns'] == stat.st_mtime_ns and cached['size'] == stat.st_size:
+            return cached['config']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    yaml = lazy_import('yaml')
+    with open(path) as file:
+        config = yaml.safe_load(file)
+    try:
+        tmp = f'{cache_path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as file:
+            json.dump({'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'config': config}, file)
+        os.replace(tmp, cache_path)
+    except (OSError, TypeError) as e:
+        # 書き込めない場所や JSON にできない値のときはキャッシュしないだけ
+        logging.debug(f"Config cache not written: {e}")
+    return config
+
+
+def report_import_times(stream=None) -> None:
+    """
+    遅延 import の内訳と起動からの経過時間を出力する
+
+    インタプリタ自体の起動時間は含まない (python -X importtime で確認する)。
+
+    Args:
+        stream: 出力先 (既定: 標準エラー)
+    """
+    stream = stream or sys.stderr
+    for name, seconds in IMPORT_TIMES.items():
+        print(f"import {name:<10}{seconds * 1000:9.1f} ms", file=stream)
+    print(f"{'imports':<17}{sum(IMPORT_TIMES.values()) * 1000:9.1f} ms", file=stream)
+    print(f"{'total':<17}{(time.perf_counter() - _T0) * 1000:9.1f} ms", file=stream)
+
+
+def import_pipeline() -> ModuleType:
+    """
+    処理本体 (main.py) を import する (内訳が分かるよう依存を先に個別に読む)
+
+    main.py は yaml を import しない (設定は load_config のキャッシュから読む)。
+    """
+    for name in ('numpy', 'pandas'):
+        lazy_import(name)
+    return lazy_import('main')
+
+
+def _memory_budget(args: argparse.Namespace, config: Dict[str, Any]) -> Optional[int]:
+    """
+    1ファイルの処理に使ってよいメモリ (バイト、--memory-budget-mb か config の memory_budget_mb)
+    """
+    budget_mb = args.memory_budget_mb or config.get('memory_budget_mb')
+    return int(budget_mb) << 20 if budget_mb else None
+
+
+def _write_streamed(frames: Iterable[Any], output: str, args: argparse.Namespace) -> int:
+    """
+    処理結果を順に仮名化・スケッチに加え、全体を pd.concat せずに出力へ追記する (spill.write_frames)
+    """
+    spill = lazy_import('spill')
+    sketches = None if args.no_sketches else lazy_import('sketches').FbcSketches()
+    key = lazy_import('pseudonymize').load_key() if args.pseudonymize else None
+
+    def prepared():
+        for df in frames:
+            if df is None:
+                continue
+            if key is not None:
+                df = sys.modules['pseudonymize'].pseudonymize(df, key=key)
+            if sketches is not None:
+                sketches.update(df)
+            yield df
+
+    if not spill.write_frames(prepared(), output):
+        logging.error("No files were processed")
+        return 1
+    logging.info(f"Wrote {output}")
+    if sketches is not None:
+        sketches.save(lazy_import('sketches').sketch_path(output))
+    return 0
+
+
+def _run_spilled(paths: List[str], pattern: str, output: str, budget: int, args: argparse.Namespace) -> int:
+    """
+    予算を超えるファイルはディスクに逃がしながら処理し、結果を出力に順に追記する (spill.py)
+    """
+    import_pipeline()
+    spill = lazy_import('spill')
+    return _write_streamed(spill.SpillingProcessor(budget, args.spill_dir).iter_files(paths, pattern), output, args)
+
+
+def _write_shared(results: List[Any], output: str, args: argparse.Namespace) -> int:
+    """
+    共有メモリで受け取った結果を出力に書く (shm_handoff.py)
+
+    仮名化もスケッチも要らなければ Arrow のテーブルのまま pandas を通さずに書く。
+    要るときは1ファイルずつ DataFrame にして順に追記する。
+    """
+    shm_handoff = sys.modules['shm_handoff']
+    if args.no_sketches and not args.pseudonymize:
+        if not shm_handoff.stream_to_sink(results, output):
+            logging.error("No files were processed")
+            return 1
+        logging.info(f"Wrote {output}")
+        return 0
+    return _write_streamed(shm_handoff.iter_shared(results), output, args)
+
+
+def cmd_process(args: argparse.Namespace, config: Dict[str, Any]) -> int:
+    """
+    指定したファイルだけを処理する
+    """
+    pattern = args.pattern or config['file_pattern']
+    budget = _memory_budget(args, config)
+    if budget:
+        return _run_spilled(args.files, pattern, args.output or config['output_file'], budget, args)
+    pipeline = import_pipeline()
+    sketches = None if args.no_sketches else lazy_import('sketches').FbcSketches()
+    key = lazy_import('pseudonymize').load_key() if args.pseudonymize else None
+    frames = []
+    for filepath in args.files:
+        df = pipeline.process_file(filepath, pattern)
+        if df is not None:
+            if key is not None:
+                df = sys.modules['pseudonymize'].pseudonymize(df, key=key)
+            frames.append(df)
+            if sketches is not None:
+                sketches.update(df)
+    if not frames:
+        logging.error("No files were processed")
+        return 1
+    output = args.output or config['output_file']
+    pd = sys.modules['pandas']
+    pd.concat(frames, ignore_index=True).to_csv(output, index=False)
+    logging.info(f"Wrote {output}")
+    if sketches is not None:
+        sketches.save(lazy_import('sketches').sketch_path(output))
+    return 0
+
+
+def cmd_run(args: argparse.Namespace, config: Dict[str, Any]) -> int:
+    """
+    config の file_pattern に一致する全てのファイルを処理する (main.py と同じ)
+
+    --workers を指定すると scheduler.py でメモリの予算の範囲で大きい順に並列処理する。
+    1ファイルのメモリの予算 (--memory-budget-mb) があれば spill.py で順に処理する。
+    """
+    output = args.output or config['output_file']
+    pattern = config['file_pattern']
+    budget = _memory_budget(args, config)
+    if budget and not args.workers:
+        return _run_spilled(glob.glob(pattern, recursive=True), pattern, output, budget, args)
+    if budget:
+        # --memory-budget-mb と --workers の組み合わせは run_cli で弾く (ここに来るのは config の値)
+        logging.warning("memory_budget_mb in the config is not applied with --workers "
+                        "(the scheduler bounds memory with --workers-budget-mb)")
+    pipeline = import_pipeline()
+    if args.workers:
+        scheduler = lazy_import('scheduler')
+        paths = [p for p in glob.glob(pattern, recursive=True) if lazy_import('compressed').is_csv_input(p)]
+        history = args.memory_history or os.path.join(os.path.dirname(os.path.abspath(output)),
+                                                      '.memory_history.jsonl')
+        if args.shm_handoff:
+            # ワーカーの結果は共有メモリに置き、パイプには記述子だけを流す
+            results, report = lazy_import('shm_handoff').run_scheduled(
+                paths, pattern, args.workers_budget_mb << 20, args.workers, history=history)
+            print(scheduler.format_report(report), file=sys.stderr)
+            return _write_shared(results, output, args)
+        frames, report = scheduler.run_scheduled(paths, pattern, args.workers_budget_mb << 20, args.workers,
+                                                 history=history)
+        print(scheduler.format_report(report), file=sys.stderr)
+        frames = [f for f in frames if f is not None]
+        if not frames:
+            logging.error("No files were processed")
+            return 1
+        df = sys.modules['pandas'].concat(frames, ignore_index=True)
+    else:
+        try:
+            df = pipeline.process_all_files(pattern)
+        except ValueError:
+            # 処理できたファイルが無いと process_all_files の pd.concat が空で落ちる
+            logging.error("No files were processed")
+            return 1
+    if args.pseudonymize:
+        df = lazy_import('pseudonymize').pseudonymize(df)
+    df.to_csv(output, index=False)
+    logging.info(f"Wrote {output}")
+    if not args.no_sketches:
+        sketches = lazy_import('sketches')
+        sketches.FbcSketches().update(df).save(sketches.sketch_path(output))
+    return 0
+
+
+def cmd_query(args: argparse.Namespace, config: Dict[str, Any]) -> int:
+    """
+    処理済み出力に SQL を実行して表示する (query.py)
+    """
+    query = lazy_import('query')
+    df = query.run_query(args.sql, args.source or config['output_file'])
+    print(df.to_string(index=False))
+    return 0
+
+
+def cmd_serve(args: argparse.Namespace, config: Dict[str, Any]) -> int:
+    """
+    ディレクトリのイベントキューを処理し続ける (handler.py)
+    """
+    handler = lazy_import('handler')
+    worker = handler.WarmHandler(args.config)
+    worker.serve(handler.DirectoryEventSource(args.spool), window=args.window,
+                 max_batch=args.max_batch, idle_timeout=args.idle_timeout)
+    return 0
+
+
+def cmd_config(args: argparse.Namespace, config: Dict[str, Any]) -> int:
+    """
+    パース済みの設定を JSON で表示する
+    """
+    print(json.dumps(config, ensure_ascii=False, indent=2))
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+    引数パーサーを作る
+    """
+    parser = argparse.ArgumentParser(description='TLC / QLC の FBC データ処理')
+    parser.add_argument('--config', default=DEFAULT_CONFIG, help='設定ファイル')
+    parser.add_argument('--import-times', action='store_true', help='import 時間の内訳を標準エラーに出す')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    process = commands.add_parser('process', help='指定したファイルを処理する')
+    process.add_argument('files', nargs='+', help='入力 CSV')
+    process.add_argument('--pattern', help='TLC / QLC の判定に使うパターン (既定: config の file_pattern)')
+    process.add_argument('-o', '--output', help='出力 CSV (既定: config の output_file)')
+    process.add_argument('--no-sketches', action='store_true', help='スケッチを書かない')
+    process.add_argument('--pseudonymize', action='store_true',
+                         help='uid を鍵付きハッシュのトークンにする (鍵は TLC_QLC_PSEUDONYM_KEY)')
+    process.add_argument('--memory-budget-mb', type=int,
+                         help='1ファイルの処理に使ってよいメモリ。超えるファイルはディスクに逃がす (既定: config の memory_budget_mb)')
+    process.add_argument('--spill-dir', help='ディスクに逃がす先 (既定: システムの一時ディレクトリ)')
+    process.set_defaults(func=cmd_process)
+
+    run = commands.add_parser('run', help='file_pattern に一致する全てのファイルを処理する')
+    run.add_argument('-o', '--output', help='出力 CSV (既定: config の output_file)')
+    run.add_argument('--no-sketches', action='store_true', help='スケッチを書かない')
+    run.add_argument('--pseudonymize', action='store_true',
+                     help='uid を鍵付きハッシュのトークンにする (鍵は TLC_QLC_PSEUDONYM_KEY)')
+    run.add_argument('--workers', type=int, help='並列に処理するワーカー数 (指定するとスケジューラを使う)')
+    run.add_argument('--workers-budget-mb', type=int, default=8192,
+                     help='--workers で同時に処理するファイルの RSS の合計の予算 (MB)')
+    run.add_argument('--memory-history', help='メモリの見積もりに使う履歴 (既定: 出力の隣)')
+    run.add_argument('--shm-handoff', action='store_true',
+                     help='ワーカーの結果を共有メモリで受け取る (--workers と一緒に使う)')
+    run.add_argument('--memory-budget-mb', type=int,
+                     help='1ファイルの処理に使ってよいメモリ。超えるファイルはディスクに逃がす (既定: config の memory_budget_mb)')
+    run.add_argument('--spill-dir', help='ディスクに逃がす先 (既定: システムの一時ディレクトリ)')
+    run.set_defaults(func=cmd_run)
+
+    sql = commands.add_parser('query', help='処理済み出力に SQL を実行する')
+    sql.add_argument('sql', help='SQL (ビュー名は processed)')
+    sql.add_argument('--source', help='処理済み出力 (既定: config の output_file)')
+    sql.set_defaults(func=cmd_query)
+
+    serve = commands.add_parser('serve', help='ディレクトリのイベントキューを処理し続ける')
+    serve.add_argument('spool', help='イベントキューのディレクトリ')
+    serve.add_argument('--window', type=float, default=0.5, help='イベントをまとめる時間幅 (秒)')
+    serve.add_argument('--max-batch', type=int, default=64, help='まとめる最大イベント数')
+    serve.add_argument('--idle-timeout', type=float, help='この秒数イベントが無ければ終わる')
+    serve.set_defaults(func=cmd_serve)
+
+    show = commands.add_parser('config', help='設定を表示する')
+    show.set_defaults(func=cmd_config)
+    return parser
+
+
+def run_cli(argv: Optional[List[str]] = None) -> int:
+    """
+    CLI を実行する
+
+    Args:
+        argv (Optional[List[str]]): 引数 (既定: sys.argv[1:])
+
+    Returns:
+        int: 終了コード
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if getattr(args, 'workers', None) and getattr(args, 'memory_budget_mb', None):
+        parser.error('--memory-budget-mb cannot be combined with --workers '
+                     '(use --workers-budget-mb to bound the memory of the workers)')
+    if getattr(args, 'shm_handoff', False) and not args.workers:
+        parser.error('--shm-handoff requires --workers')
+    try:
+        return args.func(args, load_config(args.config))
+    finally:
+        if args.import_times:
+            report_import_times()
+
+
+if __name__ == "__main__":
+    sys.exit(run_cli())
@@ -0,0 +1,294 @@
+"""
+データレイクの小さい Parquet ファイルをまとめる (コンパクション)
+
+WECyc=.../DR=.../ のパーティションごとに、小さいパートを目標サイズのファイルにまとめ、
+(BlockID, Unit, Page) の順に並べ替えて書き直す (圧縮率と min/max による枝刈りが効く)。
+
+取り込みと同時に動かせるよう、各パーティションの _compaction.json を正とする。
+    pending: 書き込み中のまとめたファイル (読む側からは見えない)
+    retired: まとめ済みの元ファイル (読む側からは見えない、猶予後に削除する)
+読む側は live_files() でパーティションの有効なファイルを取る。manifest の置き換えは
+原子的なので、読む側は常に「まとめる前」か「まとめた後」のどちらか一方だけを見る。
+
+まとめたファイルは隠しファイル (.compacted-....parquet.tmp) に書いてから os.replace で出す。
+元ファイルはコミットの後も猶予 (RETIRE_GRACE) の間は元の名前のまま残し、purge_retired で消す。
+コミットの直前に live_files() で一覧を取った読む側も、猶予の間はその一覧をそのまま読める。
+*.parquet を glob するだけの読む側は元ファイルとまとめたファイルを二重に読むので、
+必ず live_files() / lake_live_files() を使う。
+
+使い方:
+    python compaction.py lake/ --target-mb 128 --min-age 60
+"""
+import argparse
+import fcntl
+import json
+import logging
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# ログの設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# パーティションごとの manifest と排他ロック
+MANIFEST_NAME = '_compaction.json'
+LOCK_NAME = '.compaction.lock'
+
+# まとめたファイルの並び順 (存在するカラムだけ使う)
+SORT_COLUMNS = ['BlockID', 'Unit', 'Page']
+
+# まとめたファイルの目標サイズ
+TARGET_BYTES = 128 << 20
+
+# この秒数より新しいファイルは書き込み中かもしれないので触らない
+MIN_AGE = 60.0
+
+# まとめ済みの元ファイルを消すまでの猶予 (読み始めたクエリが読み終わるまで)
+RETIRE_GRACE = 3600.0
+
+
+def _read_manifest(partition: Path) -> Dict:
+    path = partition / MANIFEST_NAME
+    if not path.exists():
+        return {'pending': [], 'retired': {}}
+    return json.loads(path.read_text())
+
+
+def _write_manifest(partition: Path, manifest: Dict) -> None:
+    """
+    manifest を原子的に置き換える (これがコミット)
+    """
+    path = partition / MANIFEST_NAME
+    tmp = partition / f'.{MANIFEST_NAME}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as file:
+        json.dump(manifest, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp, path)
+
+
+@contextmanager
+def _locked(partition: Path) -> Iterator[None]:
+    """
+    同じパーティションを複数のコンパクションが同時に触らないための排他ロック
+    """
+    with open(partition / LOCK_NAME, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def live_files(partition: Union[str, Path]) -> List[Path]:
+    """
+    パーティションの有効なファイル (読む側はこれだけを読む)
+
+    glob の間に manifest が変わったら (コンパクションのコミットをまたいだら) 読み直す。
+
+    Args:
+        partition (Union[str, Path]): パーティションのディレクトリ
+
+    Returns:
+        List[Path]: 有効な Parquet ファイル
+    """
+    partition = Path(partition)
+    manifest = _read_manifest(partition)
+    while True:
+        files = list(partition.glob('*.parquet'))
+        current = _read_manifest(partition)
+        if current == manifest:
+            break
+        manifest = current
+    hidden = set(manifest['pending']) | set(manifest['retired'])
+    return sorted(p for p in files if p.name not in hidden)
+
+
+def partitions(root: Union[str, Path]) -> List[Path]:
+    """
+    Parquet ファイルを直下に持つディレクトリ (パーティション) の一覧
+
+    Args:
+        root (Union[str, Path]): データレイクのルート
+
+    Returns:
+        List[Path]: パーティションのディレクトリ
+    """
+    return sorted({p.parent for p in Path(root).rglob('*.parquet')})
+
+
+def lake_live_files(root: Union[str, Path]) -> List[Path]:
+    """
+    データレイク全体の有効なファイル
+
+    Args:
+        root (Union[str, Path]): データレイクのルート
+
+    Returns:
+        List[Path]: 有効な Parquet ファイル
+    """
+    return [path for partition in partitions(root) for path in live_files(partition)]
+
+
+def _recover(partition: Path, manifest: Dict) -> Dict:
+    """
+    前回途中で止まったコンパクションの書きかけを消す
+    """
+    for tmp in partition.glob('.compacted-*.parquet.tmp'):
+        tmp.unlink(missing_ok=True)
+        logging.info(f"Discarded unfinished compaction output: {tmp}")
+    if not manifest['pending']:
+        return manifest
+    for name in manifest['pending']:
+        (partition / name).unlink(missing_ok=True)
+        logging.info(f"Discarded unfinished compaction output: {partition / name}")
+    manifest = {**manifest, 'pending': []}
+    _write_manifest(partition, manifest)
+    return manifest
+
+
+def _batches(candidates: List[Tuple[Path, int]], target_bytes: int) -> List[List[Path]]:
+    """
+    元ファイルを目標サイズまでの組に分ける (1つしかない組はまとめる意味がないので除く)
+    """
+    batches = []
+    current, current_bytes = [], 0
+    for path, size in candidates:
+        if current and current_bytes + size > target_bytes:
+            batches.append(current)
+            current, current_bytes = [], 0
+        current.append(path)
+        current_bytes += size
+    batches.append(current)
+    return [batch for batch in batches if len(batch) >= 2]
+
+
+def _write_compacted(paths: List[Path], tmp: Path, sort_by: Sequence[str]) -> None:
+    """
+    1組の元ファイルを読み、並べ替えて隠しファイルに書く (メモリに載るのは1組だけ)
+    """
+    table = pa.concat_tables([pq.read_table(path) for path in paths], promote_options='default')
+    keys = [column for column in sort_by if column in table.column_names]
+    if keys:
+        table = table.sort_by([(column, 'ascending') for column in keys])
+    pq.write_table(table, tmp)
+    with open(tmp, 'rb') as file:
+        os.fsync(file.fileno())
+
+
+def compact_partition(partition: Union[str, Path], target_bytes: int = TARGET_BYTES,
+                      min_age: float = MIN_AGE, sort_by: Sequence[str] = SORT_COLUMNS,
+                      now: Optional[float] = None) -> List[Path]:
+    """
+    パーティションの小さいファイルを目標サイズのファイルにまとめる
+
+    元ファイルを目標サイズまでの組に分け、組ごとに次の手順で1つのファイルにまとめる。
+        1. 元ファイルを読み、並べ替えて隠しファイル (.compacted-....parquet.tmp) に書く
+        2. manifest の pending に出力ファイル名を載せてから、隠しファイルを出力ファイル名に変える
+        3. pending を空にし、元ファイルを retired に載せる (1回の置き換えで切り替わる)
+    元ファイルは消さずに元の名前のまま残す (猶予を過ぎてから purge_retired で消す)。
+
+    Args:
+        partition (Union[str, Path]): パーティションのディレクトリ
+        target_bytes (int): まとめたファイルの目標サイズ
+        min_age (float): この秒数より新しいファイルはまとめない
+        sort_by (Sequence[str]): 並び順
+        now (Optional[float]): 現在時刻 (既定: time.time())
+
+    Returns:
+        List[Path]: 書いたファイル (まとめるものが無ければ空)
+    """
+    partition = Path(partition)
+    now = time.time() if now is None else now
+    with _locked(partition):
+        manifest = _recover(partition, _read_manifest(partition))
+        candidates = []
+        for path in live_files(partition):
+            stat = path.stat()
+            if stat.st_size < target_bytes and now - stat.st_mtime >= min_age:
+                candidates.append((path, stat.st_size))
+
+        outputs = []
+        for i, batch in enumerate(_batches(candidates, target_bytes)):
+            name = f'compacted-{uuid.uuid4().hex[:12]}-{i:04d}.parquet'
+            tmp = partition / f'.{name}.tmp'
+            try:
+                _write_compacted(batch, tmp, sort_by)
+            except BaseException:
+                tmp.unlink(missing_ok=True)
+                raise
+
+            manifest = {**manifest, 'pending': [name]}
+            _write_manifest(partition, manifest)
+            os.replace(tmp, partition / name)
+
+            manifest = {'pending': [], 'retired': {**manifest['retired'], **{path.name: now for path in batch}}}
+            _write_manifest(partition, manifest)
+            outputs.append(partition / name)
+            logging.info(f"Compacted {len(batch)} files into {name} in {partition}")
+        return outputs
+
+
+def purge_retired(partition: Union[str, Path], grace: float = RETIRE_GRACE,
+                  now: Optional[float] = None) -> List[str]:
+    """
+    猶予を過ぎたまとめ済みの元ファイルを消す
+
+    Args:
+        partition (Union[str, Path]): パーティションのディレクトリ
+        grace (float): まとめてから消すまでの秒数
+        now (Optional[float]): 現在時刻 (既定: time.time())
+
+    Returns:
+        List[str]: 消したファイル名
+    """
+    partition = Path(partition)
+    now = time.time() if now is None else now
+    with _locked(partition):
+        manifest = _read_manifest(partition)
+        expired = [name for name, retired_at in manifest['retired'].items() if now - retired_at >= grace]
+        for name in expired:
+            (partition / name).unlink(missing_ok=True)
+        if expired:
+            retired = {k: v for k, v in manifest['retired'].items() if k not in expired}
+            _write_manifest(partition, {**manifest, 'retired': retired})
+        return expired
+
+
+def compact_lake(root: Union[str, Path], target_bytes: int = TARGET_BYTES, min_age: float = MIN_AGE,
+                 grace: float = RETIRE_GRACE) -> Dict[Path, List[Path]]:
+    """
+    データレイクの全パーティションをまとめ、猶予を過ぎた元ファイルを消す
+
+    Args:
+        root (Union[str, Path]): データレイクのルート
+        target_bytes (int): まとめたファイルの目標サイズ
+        min_age (float): この秒数より新しいファイルはまとめない
+        grace (float): まとめてから元ファイルを消すまでの秒数
+
+    Returns:
+        Dict[Path, List[Path]]: パーティション -> 書いたファイル
+    """
+    written = {}
+    for partition in partitions(root):
+        purge_retired(partition, grace)
+        outputs = compact_partition(partition, target_bytes, min_age)
+        if outputs:
+            written[partition] = outputs
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='WECyc/DR パーティションの小さい Parquet をまとめる')
+    parser.add_argument('root', help='データレイクのルート')
+    parser.add_argument('--target-mb', type=int, default=TARGET_BYTES >> 20, help='目標サイズ (MB)')
+    parser.add_argument('--min-age', type=float, default=MIN_AGE, help='この秒数より新しいファイルは触らない')
+    parser.add_argument('--grace', type=float, default=RETIRE_GRACE, help='元ファイルを消すまでの秒数')
+    args = parser.parse_args()
+    compact_lake(args.root, args.target_mb << 20, args.min_age, args.grace)
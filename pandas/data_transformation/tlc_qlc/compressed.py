@@ -0,0 +1,286 @@
+"""
+圧縮された入力 (.csv.gz / .csv.zst / .csv.lz4) を一時ファイルを作らずに読む
+
+スイープは圧縮して保管されることが多い。手で伸長してから処理するとディスクの読み書きが倍になるので、
+伸長しながらそのまま pd.read_csv に流す。
+
+- 伸長は CSV のパースと別に動かす (外部コマンドなら別プロセス、ライブラリなら別スレッド)。
+  zlib / zstd / lz4 の伸長は GIL を手放すので、パースと重なる
+- gzip は pigz があれば使う (読み込み・伸長・CRC の検査を別スレッドで行う)
+- zstd は pzstd があれば使う (pzstd で圧縮した複数フレームのファイルはフレームを並列に伸長する)
+- どちらも無ければ Python の gzip / zstandard / lz4 を使う (zstandard / lz4 が無ければ zstd / lz4 コマンド)
+- メモリの見積もりは伸長後のサイズで行う (uncompressed_size)。gzip は末尾の ISIZE、
+  zstd / lz4 はフレームのヘッダにある元のサイズを読み、無ければ形式ごとの圧縮率で見積もる
+"""
+import gzip
+import io
+import os
+import queue
+import shutil
+import struct
+import subprocess
+import threading
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator, List, Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4frame
+except ImportError:
+    lz4frame = None
+
+# 拡張子 -> 圧縮形式
+CODECS = {'.gz': 'gzip', '.zst': 'zstd', '.lz4': 'lz4'}
+
+# 元のサイズがファイルに無いときに見積もりに使う圧縮率 (数値の CSV での実測より大きめ)
+DEFAULT_RATIOS = {'gzip': 8.0, 'zstd': 10.0, 'lz4': 5.0}
+
+# 伸長したデータを渡す単位と、先に伸長しておくチャンク数
+CHUNK_BYTES = 1 << 20
+QUEUE_CHUNKS = 16
+
+
+def codec_of(path: str) -> Optional[str]:
+    """
+    ファイルの圧縮形式 (圧縮されていなければ None)
+    """
+    return CODECS.get(os.path.splitext(path)[1])
+
+
+def csv_name(path: str) -> str:
+    """
+    圧縮の拡張子を除いたファイル名 (3000_0.csv.gz -> 3000_0.csv)
+    """
+    name = os.path.basename(path)
+    return os.path.splitext(name)[0] if codec_of(name) else name
+
+
+def is_csv_input(path: str) -> bool:
+    """
+    処理する入力か (.csv とその圧縮)
+    """
+    return csv_name(path).endswith('.csv') and (path.endswith('.csv') or codec_of(path) is not None)
+
+
+def _gzip_size(path: str, size: int) -> Optional[int]:
+    """
+    gzip の末尾の ISIZE (元のサイズの下位 32 ビット。4 GiB 以上は折り返すので使えない)
+    """
+    if size < 18:
+        return None
+    with open(path, 'rb') as file:
+        file.seek(-4, os.SEEK_END)
+        isize = struct.unpack('<I', file.read(4))[0]
+    # 折り返した ISIZE は圧縮後より小さくなりうるので信用しない
+    return isize if isize >= size else None
+
+
+def _zstd_size(path: str) -> Optional[int]:
+    """
+    最初の zstd フレームのヘッダにある元のサイズ (Frame_Content_Size)
+    """
+    with open(path, 'rb') as file:
+        header = file.read(18)
+    if len(header) < 6 or header[:4] != b'\x28\xb5\x2f\xfd':
+        return None
+    descriptor = header[4]
+    fcs_flag, single_segment, dict_flag = descriptor >> 6, (descriptor >> 5) & 1, descriptor & 3
+    fcs_bytes = [1 if single_segment else 0, 2, 4, 8][fcs_flag]
+    if fcs_bytes == 0:
+        return None
+    offset = 5 + (0 if single_segment else 1) + [0, 1, 2, 4][dict_flag]
+    field = header[offset:offset + fcs_bytes]
+    if len(field) < fcs_bytes:
+        return None
+    value = int.from_bytes(field, 'little')
+    return value + 256 if fcs_bytes == 2 else value
+
+
+def _lz4_size(path: str) -> Optional[int]:
+    """
+    lz4 フレームのヘッダにある元のサイズ (Content Size。圧縮時に指定したときだけある)
+    """
+    with open(path, 'rb') as file:
+        header = file.read(14)
+    if len(header) < 14 or header[:4] != b'\x04\x22\x4d\x18' or not header[4] & 0x08:
+        return None
+    return struct.unpack('<Q', header[6:14])[0]
+
+
+def uncompressed_size(path: str) -> int:
+    """
+    伸長した後のサイズ (メモリの見積もり用。圧縮されていなければファイルサイズ)
+
+    Args:
+        path (str): 入力ファイル
+
+    Returns:
+        int: 伸長後のバイト数 (ファイルに無ければ圧縮率からの見積もり)
+    """
+    size = os.path.getsize(path)
+    codec = codec_of(path)
+    if codec is None:
+        return size
+    try:
+        exact = {'gzip': lambda: _gzip_size(path, size), 'zstd': lambda: _zstd_size(path),
+                 'lz4': lambda: _lz4_size(path)}[codec]()
+    except OSError:
+        exact = None
+    return exact if exact is not None else int(size * DEFAULT_RATIOS[codec])
+
+
+class BackgroundReader(io.RawIOBase):
+    def __init__(self, source: BinaryIO, chunk_bytes: int = CHUNK_BYTES, queue_chunks: int = QUEUE_CHUNKS) -> None:
+        """
+        BackgroundReaderクラスの初期化
+
+        別スレッドで source を読み (伸長し)、読む側とは有限のキューでつなぐ。
+
+        Args:
+            source (BinaryIO): 伸長しながら読むストリーム
+            chunk_bytes (int): 1回に読むバイト数
+            queue_chunks (int): 先に読んでおくチャンク数
+        """
+        super().__init__()
+        self.source = source
+        self.chunk_bytes = chunk_bytes
+        self.chunks: queue.Queue = queue.Queue(maxsize=queue_chunks)
+        self.buffer = memoryview(b'')
+        self.error: Optional[BaseException] = None
+        self.eof = False
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self._pump, daemon=True)
+        self.thread.start()
+
+    def _pump(self) -> None:
+        try:
+            while not self.stop.is_set():
+                chunk = self.source.read(self.chunk_bytes)
+                if not chunk:
+                    break
+                self._put(chunk)
+        except BaseException as e:
+            self.error = e
+        finally:
+            self._put(None)
+
+    def _put(self, item) -> None:
+        # 読む側が閉じたときに止まれるよう、待ちながら stop を確かめる
+        while not self.stop.is_set():
+            try:
+                self.chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self.buffer:
+            if self.eof:
+                return 0
+            chunk = self.chunks.get()
+            if chunk is None:
+                self.eof = True
+                if self.error is not None:
+                    raise self.error
+                return 0
+            self.buffer = memoryview(chunk)
+        n = min(len(b), len(self.buffer))
+        b[:n] = self.buffer[:n]
+        self.buffer = self.buffer[n:]
+        return n
+
+    def close(self) -> None:
+        if not self.closed:
+            self.stop.set()
+            self.thread.join()
+            self.source.close()
+        super().close()
+
+
+class ProcessReader(io.RawIOBase):
+    def __init__(self, command: List[str]) -> None:
+        """
+        ProcessReaderクラスの初期化
+
+        外部コマンド (pigz / pzstd など) の標準出力を読む。伸長は別プロセスで進む。
+
+        Args:
+            command (List[str]): 伸長したデータを標準出力に書くコマンド
+        """
+        super().__init__()
+        self.command = command
+        self.proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.finished = False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        n = self.proc.stdout.readinto(b)
+        if n == 0 and not self.finished:
+            self.finished = True
+            # 最後まで読んだらコマンドの失敗 (壊れたファイルなど) を確かめる
+            if self.proc.wait() != 0:
+                raise OSError(f"{self.command[0]} failed: {self.proc.stderr.read().decode(errors='replace').strip()}")
+        return n
+
+    def close(self) -> None:
+        if not self.closed:
+            if self.proc.poll() is None:
+                self.proc.terminate()
+            self.proc.wait()
+            self.proc.stdout.close()
+            self.proc.stderr.close()
+        super().close()
+
+
+def _open_decompressed(path: str, codec: str) -> io.RawIOBase:
+    """
+    伸長しながら読むストリーム (パースとは別のプロセスかスレッドで伸長する)
+    """
+    if codec == 'gzip':
+        if shutil.which('pigz'):
+            return ProcessReader(['pigz', '-dc', path])
+        return BackgroundReader(gzip.open(path, 'rb'))
+    if codec == 'zstd':
+        if shutil.which('pzstd'):
+            return ProcessReader(['pzstd', '-dc', '-q', '-p', str(os.cpu_count() or 1), path])
+        if zstandard is not None:
+            return BackgroundReader(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True))
+        if shutil.which('zstd'):
+            return ProcessReader(['zstd', '-dc', '-q', path])
+        raise ImportError("Reading .zst needs the zstandard package or the zstd command")
+    if codec == 'lz4':
+        if lz4frame is not None:
+            return BackgroundReader(lz4frame.open(path, 'rb'))
+        if shutil.which('lz4'):
+            return ProcessReader(['lz4', '-dc', '-q', path])
+        raise ImportError("Reading .lz4 needs the lz4 package or the lz4 command")
+    raise ValueError(f"Unknown codec: {codec}")
+
+
+@contextmanager
+def open_input(path: str) -> Iterator[BinaryIO]:
+    """
+    入力ファイルを開く (圧縮されていれば伸長しながら読む。一時ファイルは作らない)
+
+    Args:
+        path (str): 入力ファイル
+
+    Yields:
+        BinaryIO: バイナリのストリーム
+    """
+    codec = codec_of(path)
+    if codec is None:
+        with open(path, 'rb') as file:
+            yield file
+        return
+    with io.BufferedReader(_open_decompressed(path, codec), CHUNK_BYTES) as stream:
+        yield stream
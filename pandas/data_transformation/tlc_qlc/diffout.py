@@ -0,0 +1,329 @@
+"""
+2つの処理済み出力を行単位で比べる (旧コードと新コード、pandas と Polars、昨日と今日)
+
+全体をメモリに載せずに比べるため、次の順に処理する。
+1. 両方の出力をバッチで読み、キーのハッシュでパーティションに分けて一時ディレクトリの
+   Arrow ファイルに書き出す (同じキーの行は両側とも同じ番号のパーティションに入る)
+2. 書き出しながら、パーティションごとに行数と行ハッシュの合計 (順序に依存しないチェックサム) を取る
+3. チェックサムが一致するパーティションは読み直さずに飛ばし、異なるものだけを
+   キーで突き合わせて追加・削除・変更された行を数える (数値は許容誤差付きで比べる)
+
+キー (uid, WECyc, DR, Unit, Page) は1行を特定しない (1つの Unit に String / WL の行が複数ある)
+ので、同じキーの行はまず値ごと (多重集合として) 一致するものを対にし、残った行だけを
+出現順の番号 (_occurrence) で突き合わせる。同じキーの行の並びが変わっただけなら差分にならない。
+uid と BlockID は実行ごとに乱数で振られるので、別々に処理した出力を比べるときは
+--key WECyc DR Unit Page のように uid を外す。
+
+使い方:
+    python diffout.py old.parquet new.csv --atol 1e-9 --output diff.csv
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# ログの設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# 行を突き合わせるキー
+KEY_COLUMNS = ['uid', 'WECyc', 'DR', 'Unit', 'Page']
+
+# 同じキーの中での出現順
+OCCURRENCE = '_occurrence'
+
+# 既定のパーティション数と、一度に読む行数
+PARTITIONS = 64
+BATCH_ROWS = 1_000_000
+
+
+def iter_batches(source: Union[str, Path], batch_rows: int = BATCH_ROWS) -> Iterator[pa.RecordBatch]:
+    """
+    処理済み出力をバッチで読む (CSV / Parquet / Hive 形式のディレクトリ)
+
+    Args:
+        source (Union[str, Path]): 処理済み出力
+        batch_rows (int): 1バッチの行数の目安
+
+    Yields:
+        pa.RecordBatch: バッチ
+    """
+    source = Path(source)
+    if source.is_dir():
+        fmt = 'parquet' if any(source.rglob('*.parquet')) else 'csv'
+        dataset = ds.dataset(source, format=fmt, partitioning='hive')
+        yield from dataset.to_batches(batch_size=batch_rows)
+    elif source.suffix == '.parquet':
+        yield from pq.ParquetFile(source).iter_batches(batch_size=batch_rows)
+    else:
+        # 1ブロック 64MB で読む (型の推定は最初のブロックで決まる)
+        reader = pyarrow.csv.open_csv(source, read_options=pyarrow.csv.ReadOptions(block_size=64 << 20))
+        yield from reader
+
+
+def _normalized(frame: pd.DataFrame, columns: Sequence[str]) -> pd.DataFrame:
+    """
+    ハッシュ用に型をそろえる (数値は float64、それ以外は文字列)
+
+    CSV と Parquet で同じ値が int64 / float64 になっても同じハッシュになるようにする。
+    """
+    return pd.DataFrame({c: frame[c].astype('float64') if pd.api.types.is_numeric_dtype(frame[c])
+                         else frame[c].astype(str).where(frame[c].notna(), None)
+                         for c in columns})
+
+
+def _hash_rows(frame: pd.DataFrame, columns: Sequence[str]) -> np.ndarray:
+    return pd.util.hash_pandas_object(_normalized(frame, columns), index=False).to_numpy()
+
+
+class PartitionedSide:
+    def __init__(self, source: Union[str, Path], directory: Union[str, Path], key: Sequence[str],
+                 partitions: int = PARTITIONS) -> None:
+        """
+        PartitionedSideクラスの初期化
+
+        片側の出力をキーのハッシュでパーティションの Arrow ファイルに分ける。
+
+        Args:
+            source (Union[str, Path]): 処理済み出力
+            directory (Union[str, Path]): パーティションの書き出し先
+            key (Sequence[str]): 突き合わせのキー
+            partitions (int): パーティション数
+        """
+        self.source = Path(source)
+        self.directory = Path(directory)
+        self.key = list(key)
+        self.partitions = partitions
+        self.columns: List[str] = []
+        self.rows = 0
+        self.counts = np.zeros(partitions, dtype='int64')
+        self.checksums = np.zeros(partitions, dtype='uint64')
+
+    def path(self, partition: int) -> Path:
+        return self.directory / f'part-{partition:04d}.arrow'
+
+    def split(self, batch_rows: int = BATCH_ROWS) -> 'PartitionedSide':
+        """
+        出力を読みながらパーティションに書き出し、チェックサムを取る
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        writers: Dict[int, pa.ipc.RecordBatchFileWriter] = {}
+        try:
+            for batch in iter_batches(self.source, batch_rows):
+                if not self.columns:
+                    self.columns = batch.schema.names
+                    missing = [c for c in self.key if c not in self.columns]
+                    if missing:
+                        raise KeyError(f"Key columns not in {self.source}: {missing}")
+                frame = batch.to_pandas()
+                part = (_hash_rows(frame, self.key) % np.uint64(self.partitions)).astype('int64')
+                # 行ハッシュの合計は行の順序に依存しない (桁あふれは 2^64 で回る)
+                row_hash = _hash_rows(frame, sorted(self.columns))
+                self.counts += np.bincount(part, minlength=self.partitions)
+                # パーティション順に安定ソートして、各パーティションの行を元の順序のまま切り出す
+                order = np.argsort(part, kind='stable')
+                present = np.unique(part)
+                starts = np.searchsorted(part[order], present)
+                ends = np.append(starts[1:], len(order))
+                self.checksums[present] += np.add.reduceat(row_hash[order], starts)
+                for p, lo, hi in zip(present, starts, ends):
+                    if p not in writers:
+                        writers[p] = pa.ipc.new_file(self.path(p), batch.schema)
+                    writers[p].write_batch(batch.take(pa.array(order[lo:hi])))
+                self.rows += len(frame)
+        finally:
+            for writer in writers.values():
+                writer.close()
+        logging.info(f"Partitioned {self.source}: {self.rows} rows into {len(writers)} partitions")
+        return self
+
+    def read(self, partition: int) -> pd.DataFrame:
+        """
+        パーティションを読む
+        """
+        path = self.path(partition)
+        if not path.exists():
+            return pd.DataFrame({c: pd.Series(dtype='float64') for c in self.columns})
+        return pa.ipc.open_file(path).read_all().to_pandas()
+
+
+def _align_keys(left: pd.DataFrame, right: pd.DataFrame, key: Sequence[str]) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    両側でキーの型が違えば merge できる型にそろえる
+    """
+    casts = {}
+    for c in key:
+        if left[c].dtype == right[c].dtype:
+            continue
+        both_numeric = pd.api.types.is_numeric_dtype(left[c]) and pd.api.types.is_numeric_dtype(right[c])
+        casts[c] = 'float64' if both_numeric else str
+    return left.astype(casts), right.astype(casts)
+
+
+def _changed(left: pd.Series, right: pd.Series, rtol: float, atol: float) -> np.ndarray:
+    """
+    値が変わった行 (数値は |a - b| <= atol + rtol * |b| なら同じ、両方 null も同じ)
+    """
+    both_null = (left.isna() & right.isna()).to_numpy()
+    if pd.api.types.is_numeric_dtype(left) and pd.api.types.is_numeric_dtype(right):
+        a = left.to_numpy(dtype='float64', na_value=np.nan)
+        b = right.to_numpy(dtype='float64', na_value=np.nan)
+        with np.errstate(invalid='ignore'):
+            same = np.abs(a - b) <= atol + rtol * np.abs(b)
+    else:
+        same = (left.astype(str) == right.astype(str)).to_numpy()
+    return ~(same | both_null)
+
+
+def _unmatched(left: pd.DataFrame, right: pd.DataFrame, key: Sequence[str],
+               columns: Sequence[str]) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    同じキーで値も同じ行を多重集合として対にして除き、残った行に出現順の番号を足す
+
+    同じキーの行が並び替わっただけなら両側とも何も残らない。値が変わった行だけが残り、
+    キーの中での出現順で突き合わせられる。
+    """
+    frames = []
+    for frame in (left, right):
+        frame = frame.reset_index(drop=True)
+        row_hash = _hash_rows(frame, columns) if len(columns) else np.zeros(len(frame), dtype='uint64')
+        keyed = frame[list(key)].assign(_hash=row_hash)
+        keyed['_n'] = keyed.groupby(list(key) + ['_hash'], sort=False, dropna=False).cumcount()
+        frames.append((frame, keyed))
+    (left, left_keyed), (right, right_keyed) = frames
+    on = list(key) + ['_hash', '_n']
+    # (key, _hash, _n) は片側の中で一意なので、left merge は行数と並びを保つ
+    left_only = left_keyed.merge(right_keyed, on=on, how='left', indicator=True)['_merge'].eq('left_only')
+    right_only = right_keyed.merge(left_keyed, on=on, how='left', indicator=True)['_merge'].eq('left_only')
+    left, right = left[left_only.to_numpy()].copy(), right[right_only.to_numpy()].copy()
+    for frame in (left, right):
+        frame[OCCURRENCE] = frame.groupby(list(key), sort=False, dropna=False).cumcount()
+    return left, right
+
+
+def compare_partition(left: pd.DataFrame, right: pd.DataFrame, key: Sequence[str], columns: Sequence[str],
+                      rtol: float = 0.0, atol: float = 0.0) -> Tuple[pd.DataFrame, Dict[str, int]]:
+    """
+    1つのパーティションを突き合わせる (値まで同じ行を対にした残りを、キーと出現順で)
+
+    Args:
+        left (pd.DataFrame): 旧側のパーティション
+        right (pd.DataFrame): 新側のパーティション
+        key (Sequence[str]): 突き合わせのキー
+        columns (Sequence[str]): 比べるカラム (キー以外の共通カラム)
+        rtol (float): 数値の相対許容誤差
+        atol (float): 数値の絶対許容誤差
+
+    Returns:
+        Tuple[pd.DataFrame, Dict[str, int]]: 差分の行 (_status と <col>_left / <col>_right) と、
+        カラム -> 変更された行数
+    """
+    on = list(key) + [OCCURRENCE]
+    left, right = _align_keys(left, right, key)
+    left, right = _unmatched(left, right, key, columns)
+    merged = left[on + list(columns)].merge(right[on + list(columns)], on=on, how='outer',
+                                            suffixes=('_left', '_right'), indicator=True)
+    status = merged['_merge'].map({'left_only': 'removed', 'right_only': 'added', 'both': ''}).astype(object)
+    both = (merged['_merge'] == 'both').to_numpy()
+
+    by_column = {}
+    any_changed = np.zeros(len(merged), dtype=bool)
+    for c in columns:
+        changed = _changed(merged[f'{c}_left'], merged[f'{c}_right'], rtol, atol) & both
+        if changed.any():
+            by_column[c] = int(changed.sum())
+            any_changed |= changed
+    status[any_changed] = 'changed'
+    diff = merged.drop(columns='_merge')
+    diff.insert(0, '_status', status)
+    return diff[diff['_status'] != ''], by_column
+
+
+def diff_outputs(left: Union[str, Path], right: Union[str, Path], key: Sequence[str] = KEY_COLUMNS,
+                 partitions: int = PARTITIONS, rtol: float = 0.0, atol: float = 0.0,
+                 output: Optional[Union[str, Path]] = None, limit: int = 20,
+                 tmp_dir: Optional[Union[str, Path]] = None, batch_rows: int = BATCH_ROWS) -> Dict:
+    """
+    2つの処理済み出力の差分を数える
+
+    Args:
+        left (Union[str, Path]): 旧側の出力
+        right (Union[str, Path]): 新側の出力
+        key (Sequence[str]): 突き合わせのキー
+        partitions (int): パーティション数 (1パーティションがメモリに載る程度にする)
+        rtol (float): 数値の相対許容誤差
+        atol (float): 数値の絶対許容誤差
+        output (Optional[Union[str, Path]]): 差分の行を書く CSV
+        limit (int): 報告に含める差分の行数
+        tmp_dir (Optional[Union[str, Path]]): パーティションを書き出す場所 (既定: システムの一時ディレクトリ)
+        batch_rows (int): 1バッチの行数の目安
+
+    Returns:
+        Dict: 行数、飛ばしたパーティション数、追加・削除・変更の行数、カラムごとの変更行数、差分の例
+    """
+    if output is not None and os.path.exists(output):
+        os.remove(output)
+    with tempfile.TemporaryDirectory(prefix='diffout-', dir=tmp_dir) as tmp:
+        sides = [PartitionedSide(path, Path(tmp) / name, key, partitions).split(batch_rows)
+                 for path, name in ((left, 'left'), (right, 'right'))]
+        old, new = sides
+        columns = [c for c in old.columns if c in new.columns and c not in key]
+        report = {'left_rows': old.rows, 'right_rows': new.rows, 'partitions': partitions, 'skipped': 0,
+                  'added': 0, 'removed': 0, 'changed': 0, 'changed_by_column': {},
+                  'only_left_columns': [c for c in old.columns if c not in new.columns],
+                  'only_right_columns': [c for c in new.columns if c not in old.columns]}
+        samples = []
+        write_header = True
+        for p in range(partitions):
+            if old.counts[p] == new.counts[p] and old.checksums[p] == new.checksums[p]:
+                report['skipped'] += 1
+                continue
+            diff, by_column = compare_partition(old.read(p), new.read(p), key, columns, rtol, atol)
+            for status in ('added', 'removed', 'changed'):
+                report[status] += int((diff['_status'] == status).sum())
+            for c, n in by_column.items():
+                report['changed_by_column'][c] = report['changed_by_column'].get(c, 0) + n
+            if len(samples) < limit and len(diff):
+                samples.extend(diff.head(limit - len(samples)).to_dict('records'))
+            if output is not None and len(diff):
+                diff.to_csv(output, mode='a', header=write_header, index=False)
+                write_header = False
+    report['samples'] = samples
+    logging.info(f"Compared {left} and {right}: {report['added']} added, {report['removed']} removed, "
+                 f"{report['changed']} changed ({report['skipped']}/{partitions} partitions identical)")
+    return report
+
+
+def is_identical(report: Dict) -> bool:
+    return (report['added'] == report['removed'] == report['changed'] == 0
+            and not report['only_left_columns'] and not report['only_right_columns'])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='2つの処理済み出力 (CSV / Parquet) を行単位で比べる')
+    parser.add_argument('left', help='旧側の出力')
+    parser.add_argument('right', help='新側の出力')
+    parser.add_argument('--key', nargs='+', default=KEY_COLUMNS, help='突き合わせのキー')
+    parser.add_argument('--partitions', type=int, default=PARTITIONS, help='パーティション数')
+    parser.add_argument('--rtol', type=float, default=0.0, help='数値の相対許容誤差')
+    parser.add_argument('--atol', type=float, default=0.0, help='数値の絶対許容誤差')
+    parser.add_argument('-o', '--output', help='差分の行を書く CSV')
+    parser.add_argument('--limit', type=int, default=20, help='表示する差分の行数')
+    parser.add_argument('--tmp-dir', help='パーティションを書き出す場所')
+    args = parser.parse_args()
+
+    result = diff_outputs(args.left, args.right, args.key, args.partitions, args.rtol, args.atol,
+                          args.output, args.limit, args.tmp_dir)
+    print(json.dumps(result, ensure_ascii=False, indent=2, default=str))
+    # diff と同じく、差分があれば終了コード 1
+    sys.exit(0 if is_identical(result) else 1)
@@ -0,0 +1,442 @@
+"""
+複数ホストで process_all_files を分担する (コーディネーターとワーカー)
+
+外部のブローカーは使わず、コーディネーターが TCP (1行1メッセージの JSON) でファイルを貸し出す。
+
+- ワーカーはコーディネーターにファイルのリース (貸し出し) をもらい、処理中は定期的に
+  ハートビートを送る。ハートビートが lease_ttl 秒途切れたリースは期限切れとして別のワーカーに出し直す
+- ワーカーは結果を共有ディレクトリの Parquet に書き、コーディネーターにはその場所だけを返す
+  (データそのものは TCP に流さない)
+- 処理に失敗したファイルは max_attempts 回まで出し直し、それでも失敗したら failed に記録する
+- 同じファイルが2回処理されても、最初に完了した結果だけを使う
+
+入力ファイルと出力ディレクトリは全てのワーカーから同じパスで見える必要がある (NFS など)。
+認証は無いので、信頼できるネットワークの中だけで使う。
+
+1台で試すときは local で N 個のワーカープロセスを立てる (テストもこの構成)。
+
+使い方:
+    python distributed.py coordinator --bind 0.0.0.0:7070 -o processed.csv
+    python distributed.py worker --connect coordinator-host:7070 --output-dir /shared/results
+    python distributed.py local --workers 4 --output-dir results -o processed.csv
+"""
+import argparse
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import socketserver
+import threading
+import time
+import uuid
+from collections import deque
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import pandas as pd
+
+# ログの設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# ハートビートが途切れてからリースを出し直すまでの秒数
+LEASE_TTL = 30.0
+
+# 1ファイルを出し直す最大回数
+MAX_ATTEMPTS = 3
+
+# 貸し出せるファイルが無いときにワーカーが待つ秒数
+POLL_INTERVAL = 0.5
+
+# コーディネーターに繋がらないときにワーカーが諦めるまでの秒数
+CONNECT_TIMEOUT = 30.0
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def parse_address(text: str) -> Tuple[str, int]:
+    """
+    'host:port' -> (host, port)
+    """
+    host, _, port = text.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+class Coordinator:
+    def __init__(self, paths: Sequence[str], pattern: str, address: Tuple[str, int] = ('127.0.0.1', 0),
+                 lease_ttl: float = LEASE_TTL, max_attempts: int = MAX_ATTEMPTS) -> None:
+        """
+        Coordinatorクラスの初期化
+
+        Args:
+            paths (Sequence[str]): 処理するファイル
+            pattern (str): ファイルパターン (ワーカーが TLC / QLC の判定に使う)
+            address (Tuple[str, int]): 待ち受けるアドレス (ポート 0 なら空いているポート)
+            lease_ttl (float): ハートビートが途切れてからリースを出し直すまでの秒数
+            max_attempts (int): 1ファイルを出し直す最大回数
+        """
+        self.paths = list(paths)
+        self.pattern = pattern
+        self.lease_ttl = lease_ttl
+        self.max_attempts = max_attempts
+        self.pending = deque(self.paths)
+        self.leases: Dict[str, Dict] = {}
+        self.attempts: Dict[str, int] = {p: 0 for p in self.paths}
+        self.results: Dict[str, Optional[str]] = {}
+        self.failed: Dict[str, str] = {}
+        self.reissued = 0
+        self.cond = threading.Condition()
+
+        coordinator = self
+
+        class _Handler(socketserver.StreamRequestHandler):
+            def handle(self) -> None:
+                for line in self.rfile:
+                    try:
+                        reply = coordinator.handle(json.loads(line))
+                    except Exception as e:
+                        reply = {'error': str(e)}
+                    self.wfile.write((json.dumps(reply) + '\n').encode())
+                    self.wfile.flush()
+
+        self.server = _Server(address, _Handler)
+        self.address = self.server.server_address[:2]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self) -> 'Coordinator':
+        self.thread.start()
+        logging.info(f"Coordinator listening on {self.address[0]}:{self.address[1]} ({len(self.paths)} files)")
+        return self
+
+    def finished(self) -> bool:
+        return not self.pending and not self.leases
+
+    def _reap(self, now: float) -> None:
+        """
+        ハートビートが途切れたリースを出し直す
+        """
+        for lease, info in list(self.leases.items()):
+            if info['deadline'] < now:
+                del self.leases[lease]
+                logging.warning(f"Lease {lease} on {info['file']} expired (worker {info['worker']})")
+                self.reissued += 1
+                self._retry(info['file'], 'lease expired')
+
+    def _retry(self, path: str, error: str) -> None:
+        if path in self.results:
+            return
+        if self.attempts[path] >= self.max_attempts:
+            self.failed[path] = error
+            logging.error(f"Giving up on {path} after {self.attempts[path]} attempts: {error}")
+        else:
+            self.pending.append(path)
+
+    def handle(self, message: Dict) -> Dict:
+        """
+        ワーカーからのメッセージを1つ処理する
+
+        op:
+            lease      ファイルを借りる -> {'lease', 'file', 'pattern', 'ttl'} / {'wait'} / {'done'}
+            heartbeat  リースを延長する -> {'ok'} (期限切れで出し直したリースなら False)
+            complete   結果の場所を返す -> {'ok'}
+            fail       処理に失敗した -> {'ok'}
+
+        Args:
+            message (Dict): ワーカーからのメッセージ
+
+        Returns:
+            Dict: 返信
+        """
+        op = message['op']
+        now = time.monotonic()
+        with self.cond:
+            self._reap(now)
+            try:
+                if op == 'lease':
+                    if not self.pending:
+                        return {'done': True} if self.finished() else {'wait': POLL_INTERVAL}
+                    path = self.pending.popleft()
+                    self.attempts[path] += 1
+                    lease = uuid.uuid4().hex[:12]
+                    self.leases[lease] = {'file': path, 'worker': message['worker'], 'deadline': now + self.lease_ttl}
+                    logging.info(f"Leased {path} to {message['worker']} ({lease})")
+                    return {'lease': lease, 'file': path, 'pattern': self.pattern, 'ttl': self.lease_ttl}
+
+                info = self.leases.get(message['lease'])
+                if op == 'heartbeat':
+                    if info is None:
+                        return {'ok': False}
+                    info['deadline'] = now + self.lease_ttl
+                    return {'ok': True}
+                if op == 'complete':
+                    path = info['file'] if info else message['file']
+                    self.leases.pop(message['lease'], None)
+                    # 出し直した後に元のワーカーが完了しても、最初の結果だけを使う
+                    if path in self.results:
+                        return {'ok': False}
+                    self.results[path] = message.get('result')
+                    self.failed.pop(path, None)
+                    if path in self.pending:
+                        self.pending.remove(path)
+                    logging.info(f"Completed {path} by {message['worker']}: {message.get('result')}")
+                    return {'ok': True}
+                if op == 'fail':
+                    if info is not None:
+                        del self.leases[message['lease']]
+                        logging.error(f"Worker {message['worker']} failed on {info['file']}: {message.get('error')}")
+                        self._retry(info['file'], message.get('error', ''))
+                    return {'ok': True}
+                raise ValueError(f"Unknown op: {op}")
+            finally:
+                self.cond.notify_all()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        全てのファイルが完了か失敗になるまで待つ (ワーカーがいなくてもリースの期限切れは処理する)
+
+        Args:
+            timeout (Optional[float]): 最大の待ち時間 (秒)
+
+        Returns:
+            bool: 終わったか
+        """
+        end = None if timeout is None else time.monotonic() + timeout
+        with self.cond:
+            while not self.finished():
+                remaining = None if end is None else end - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.cond.wait(min(POLL_INTERVAL, remaining) if remaining is not None else POLL_INTERVAL)
+                self._reap(time.monotonic())
+        return True
+
+    def ordered_results(self) -> List[Optional[str]]:
+        """
+        入力順の結果の場所 (完了したファイルだけ)
+        """
+        return [self.results[p] for p in self.paths if p in self.results]
+
+    def close(self, linger: float = 0.0) -> None:
+        """
+        待ち受けをやめる
+
+        Args:
+            linger (float): 待っているワーカーに終了 (done) を返すために待ち受けを続ける秒数
+        """
+        time.sleep(linger)
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _process_file(path: str, pattern: str) -> Optional[pd.DataFrame]:
+    import main
+    return main.process_file(path, pattern)
+
+
+class Worker:
+    def __init__(self, address: Tuple[str, int], output_dir: Union[str, Path], process: Callable = _process_file,
+                 worker_id: Optional[str] = None, connect_timeout: float = CONNECT_TIMEOUT) -> None:
+        """
+        Workerクラスの初期化
+
+        Args:
+            address (Tuple[str, int]): コーディネーターのアドレス
+            output_dir (Union[str, Path]): 結果を書く共有ディレクトリ
+            process (Callable): 1ファイルの処理 (既定: main.process_file)
+            worker_id (Optional[str]): ワーカーの名前 (既定: ホスト名-PID)
+            connect_timeout (float): コーディネーターに繋がらないときに諦めるまでの秒数
+        """
+        self.address = tuple(address)
+        self.output_dir = Path(output_dir)
+        self.process = process
+        self.worker_id = worker_id or f'{socket.gethostname()}-{os.getpid()}'
+        self.connect_timeout = connect_timeout
+        self.processed = 0
+
+    def request(self, message: Dict) -> Dict:
+        """
+        コーディネーターに1つメッセージを送って返信を受け取る (繋がらなければ再試行する)
+        """
+        message = {**message, 'worker': self.worker_id}
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            try:
+                with socket.create_connection(self.address, timeout=self.connect_timeout) as conn:
+                    conn.sendall((json.dumps(message) + '\n').encode())
+                    with conn.makefile('rb') as reader:
+                        return json.loads(reader.readline())
+            except (OSError, ValueError):
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(POLL_INTERVAL)
+
+    def _heartbeat(self, lease: str, interval: float, stop: threading.Event, lost: threading.Event) -> None:
+        """
+        処理中のリースを延長し続ける (出し直されていたら lost を立てて止める)
+        """
+        while not stop.wait(interval):
+            try:
+                if not self.request({'op': 'heartbeat', 'lease': lease}).get('ok'):
+                    logging.warning(f"Lease {lease} was reissued to another worker")
+                    lost.set()
+                    return
+            except (OSError, ValueError) as e:
+                # 繋がらないか返信が壊れていても、処理は止めずに次のハートビートで再試行する
+                logging.warning(f"Heartbeat failed for {lease}: {e}")
+
+    def _write(self, df: pd.DataFrame, path: str, lease: str) -> str:
+        """
+        結果を共有ディレクトリに原子的に書く
+        """
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        target = self.output_dir / f'{Path(path).stem}-{lease}.parquet'
+        tmp = self.output_dir / f'.{target.name}.tmp'
+        df.to_parquet(tmp, index=False)
+        os.replace(tmp, target)
+        return str(target)
+
+    def run(self) -> int:
+        """
+        貸し出せるファイルが無くなるまで借りて処理する
+
+        Returns:
+            int: 処理したファイル数
+        """
+        while True:
+            reply = self.request({'op': 'lease'})
+            if reply.get('done'):
+                return self.processed
+            if 'wait' in reply:
+                time.sleep(reply['wait'])
+                continue
+            lease, path = reply['lease'], reply['file']
+            stop, lost = threading.Event(), threading.Event()
+            beat = threading.Thread(target=self._heartbeat, args=(lease, reply['ttl'] / 3, stop, lost), daemon=True)
+            beat.start()
+            try:
+                df = self.process(path, reply['pattern'])
+                # 処理中にリースが出し直されたら、結果は書かずにこのファイルを手放す
+                if lost.is_set():
+                    logging.warning(f"Abandoned {path}: lease {lease} was reissued")
+                    continue
+                result = self._write(df, path, lease) if df is not None else None
+            except Exception as e:
+                logging.error(f"Error processing file {path}: {e}")
+                if not lost.is_set():
+                    self.request({'op': 'fail', 'lease': lease, 'error': str(e)})
+                continue
+            finally:
+                stop.set()
+                beat.join()
+            reply = self.request({'op': 'complete', 'lease': lease, 'file': path, 'result': result})
+            if not reply.get('ok'):
+                # 出し直した先のワーカーが先に完了した (この結果は使われないので消す)
+                logging.warning(f"Result of {path} was superseded ({lease})")
+                if result is not None:
+                    Path(result).unlink(missing_ok=True)
+                continue
+            self.processed += 1
+
+
+def _worker_main(address: Tuple[str, int], output_dir: str, process: Callable) -> None:
+    Worker(address, output_dir, process).run()
+
+
+def run_local(paths: Sequence[str], pattern: str, output_dir: Union[str, Path], workers: int = 2,
+              lease_ttl: float = LEASE_TTL, process: Callable = _process_file,
+              timeout: Optional[float] = None) -> Coordinator:
+    """
+    1台でコーディネーターと N 個のワーカープロセスを動かす
+
+    Args:
+        paths (Sequence[str]): 処理するファイル
+        pattern (str): ファイルパターン
+        output_dir (Union[str, Path]): 結果を書くディレクトリ
+        workers (int): ワーカープロセス数
+        lease_ttl (float): リースの期限 (秒)
+        process (Callable): 1ファイルの処理 (モジュールの関数)
+        timeout (Optional[float]): 最大の待ち時間 (秒)
+
+    Returns:
+        Coordinator: 終わったコーディネーター (results / failed / reissued)
+
+    Raises:
+        TimeoutError: timeout までに全てのファイルが終わらなかった
+    """
+    coordinator = Coordinator(paths, pattern, lease_ttl=lease_ttl).start()
+    context = multiprocessing.get_context('spawn')
+    procs = [context.Process(target=_worker_main, args=(coordinator.address, str(output_dir), process))
+             for _ in range(workers)]
+    try:
+        for proc in procs:
+            proc.start()
+        if not coordinator.wait(timeout):
+            with coordinator.cond:
+                unfinished = len(coordinator.pending) + len(coordinator.leases)
+            raise TimeoutError(f"{unfinished} files were not finished within {timeout} seconds")
+    finally:
+        for proc in procs:
+            proc.join(timeout=lease_ttl)
+            if proc.is_alive():
+                proc.terminate()
+        coordinator.close()
+    return coordinator
+
+
+def gather(locations: Sequence[Optional[str]], output: Union[str, Path]) -> int:
+    """
+    ワーカーの結果をまとめて出力 CSV に書く (1ファイルずつ追記する)
+
+    Args:
+        locations (Sequence[Optional[str]]): 結果の場所
+        output (Union[str, Path]): 出力 CSV
+
+    Returns:
+        int: 書いた行数
+    """
+    import spill
+    return spill.write_frames((pd.read_parquet(loc) for loc in locations if loc), output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='複数ホストで process_all_files を分担する')
+    parser.add_argument('--config', default='config.yaml', help='設定ファイル')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    coord = commands.add_parser('coordinator', help='ファイルを貸し出して結果の場所を集める')
+    coord.add_argument('--bind', default='0.0.0.0:7070', help='待ち受けるアドレス')
+    coord.add_argument('--lease-ttl', type=float, default=LEASE_TTL, help='リースの期限 (秒)')
+    coord.add_argument('-o', '--output', help='出力 CSV (既定: config の output_file)')
+
+    work = commands.add_parser('worker', help='コーディネーターからファイルを借りて処理する')
+    work.add_argument('--connect', required=True, help='コーディネーターのアドレス (host:port)')
+    work.add_argument('--output-dir', required=True, help='結果を書く共有ディレクトリ')
+
+    local = commands.add_parser('local', help='1台でコーディネーターと N 個のワーカーを動かす')
+    local.add_argument('--workers', type=int, default=os.cpu_count(), help='ワーカープロセス数')
+    local.add_argument('--output-dir', required=True, help='結果を書くディレクトリ')
+    local.add_argument('--lease-ttl', type=float, default=LEASE_TTL, help='リースの期限 (秒)')
+    local.add_argument('-o', '--output', help='出力 CSV (既定: config の output_file)')
+    args = parser.parse_args()
+
+    if args.command == 'worker':
+        Worker(parse_address(args.connect), args.output_dir).run()
+    else:
+        import yaml
+        with open(args.config) as file:
+            config = yaml.safe_load(file)
+        pattern = config['file_pattern']
+        paths = glob.glob(pattern, recursive=True)
+        if args.command == 'coordinator':
+            server = Coordinator(paths, pattern, parse_address(args.bind), args.lease_ttl).start()
+            server.wait()
+            server.close(linger=POLL_INTERVAL * 4)
+        else:
+            server = run_local(paths, pattern, args.output_dir, args.workers, args.lease_ttl)
+        gather(server.ordered_results(), args.output or config['output_file'])
+        if server.failed:
+            logging.error(f"Failed files: {sorted(server.failed)}")
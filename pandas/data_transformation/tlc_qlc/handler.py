@@ -0,0 +1,384 @@
+"""
+ファイル単位のイベントで起動するハンドラ (Lambda / キューのワーカー想定)
+
+1イベント = 1ファイル。プロセスは起動したまま使い回し、設定・pandas・処理本体は
+最初の1回だけ読み込む。近い時刻に届いたイベントはまとめて1回の処理にする。
+
+ローカルではディレクトリをキューの代わりにする (DirectoryEventSource)。
+    spool/pending/    未処理のイベント (1イベント = 1つの JSON ファイル)
+    spool/processing/ 取り出し済み (rename で取るので複数ワーカーでも重複しない)
+    spool/failed/     処理に失敗したイベント
+
+処理中のワーカーは取り出したイベントの mtime を HEARTBEAT_INTERVAL ごとに更新する (ハートビート)。
+ワーカーが処理中に落ちるとイベントは processing/ に残り mtime が止まるので、serve はキューを
+見るたびに STALE_AFTER (ハートビートの数回分) 更新の無いものを pending/ に戻す。
+長く掛かるバッチはハートビートが続くので戻されない。
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Union
+
+import cli
+
+# ログの設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# まとめる時間幅 (秒): 最初のイベントからこの時間内に届いたものを1回で処理する
+BATCH_WINDOW = 0.5
+
+# 1回の処理でまとめる最大イベント数
+MAX_BATCH = 64
+
+# 処理中のイベントの mtime を更新する間隔 (秒)
+HEARTBEAT_INTERVAL = 30.0
+
+# processing/ でこの秒数 mtime が更新されないイベントは、落ちたワーカーのものとして pending/ に戻す
+STALE_AFTER = 4 * HEARTBEAT_INTERVAL
+
+
+def event_paths(event: Dict[str, Any]) -> List[str]:
+    """
+    イベントから入力ファイルのパスを取り出す
+
+    {"path": "..."} と S3 通知形式 ({"Records": [{"s3": {"object": {"key": "..."}}}]}) を受け付ける。
+    S3 形式のキーはローカルのパスとして扱う。
+
+    Args:
+        event (Dict[str, Any]): イベント
+
+    Returns:
+        List[str]: 入力ファイルのパス
+    """
+    if 'path' in event:
+        return [event['path']]
+    return [record['s3']['object']['key'] for record in event.get('Records', [])]
+
+
+class DirectoryEventSource:
+    def __init__(self, spool_dir: Union[str, Path]) -> None:
+        """
+        DirectoryEventSourceクラスの初期化
+
+        ディレクトリをイベントキューとして使う。put は一時ファイルに書いてから
+        rename するので、読む側が書きかけのイベントを見ることはない。
+
+        Args:
+            spool_dir (Union[str, Path]): キューのディレクトリ
+        """
+        self.spool_dir = Path(spool_dir)
+        self.pending = self.spool_dir / 'pending'
+        self.processing = self.spool_dir / 'processing'
+        self.failed = self.spool_dir / 'failed'
+        for directory in (self.pending, self.processing, self.failed):
+            directory.mkdir(parents=True, exist_ok=True)
+
+    def put(self, event: Dict[str, Any]) -> Path:
+        """
+        イベントを追加する
+
+        Args:
+            event (Dict[str, Any]): イベント
+
+        Returns:
+            Path: イベントのファイル
+        """
+        name = f'{time.time_ns():020d}-{uuid.uuid4().hex[:8]}.json'
+        tmp = self.spool_dir / f'.{name}.tmp'
+        tmp.write_text(json.dumps(event))
+        os.replace(tmp, self.pending / name)
+        return self.pending / name
+
+    def _claim(self, limit: int) -> List[Path]:
+        """
+        未処理のイベントを古い順に取り出す (他のワーカーが先に取ったものは飛ばす)
+        """
+        claimed = []
+        for path in sorted(self.pending.glob('*.json'))[:limit]:
+            target = self.processing / path.name
+            try:
+                os.rename(path, target)
+            except FileNotFoundError:
+                continue
+            # 取り出した時刻を残す (requeue_stale が見る)
+            os.utime(target)
+            claimed.append(target)
+        return claimed
+
+    def touch(self, claimed: List[Path]) -> None:
+        """
+        取り出したイベントの mtime を更新する (処理中であることを示すハートビート)
+        """
+        for path in claimed:
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                continue
+
+    @contextmanager
+    def heartbeat(self, claimed: List[Path], interval: float = HEARTBEAT_INTERVAL) -> Iterator[None]:
+        """
+        with の間、別スレッドで interval 秒ごとに取り出したイベントの mtime を更新する
+
+        Args:
+            claimed (List[Path]): 取り出したイベント
+            interval (float): 更新の間隔 (秒)
+        """
+        stop = threading.Event()
+
+        def beat() -> None:
+            while not stop.wait(interval):
+                self.touch(claimed)
+
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def requeue_stale(self, older_than: float = STALE_AFTER) -> List[Path]:
+        """
+        落ちたワーカーが processing/ に残したイベントを pending/ に戻す
+
+        Args:
+            older_than (float): 最後のハートビートからこの秒数を過ぎたものを戻す
+
+        Returns:
+            List[Path]: 戻したイベント (pending/ 内のファイル)
+        """
+        requeued = []
+        now = time.time()
+        for path in sorted(self.processing.glob('*.json')):
+            try:
+                if now - path.stat().st_mtime < older_than:
+                    continue
+                os.rename(path, self.pending / path.name)
+            except FileNotFoundError:
+                continue
+            logging.warning(f"Requeued stale event: {path.name}")
+            requeued.append(self.pending / path.name)
+        return requeued
+
+    def receive(self, max_events: int = MAX_BATCH, window: float = BATCH_WINDOW,
+                timeout: Optional[float] = None, poll_interval: float = 0.05) -> List[Path]:
+        """
+        イベントをまとめて受け取る
+
+        最初のイベントが届くまで待ち (最大 timeout 秒)、そこから window 秒の間に
+        届いたものを max_events 個までまとめて返す。
+
+        Args:
+            max_events (int): まとめる最大数
+            window (float): まとめる時間幅 (秒)
+            timeout (Optional[float]): 最初のイベントを待つ最大秒数 (None なら無期限)
+            poll_interval (float): ディレクトリを見る間隔 (秒)
+
+        Returns:
+            List[Path]: 取り出したイベント (processing/ 内のファイル、無ければ空)
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        claimed = self._claim(max_events)
+        while not claimed:
+            if deadline is not None and time.monotonic() >= deadline:
+                return []
+            time.sleep(poll_interval)
+            claimed = self._claim(max_events)
+
+        window_end = time.monotonic() + window
+        while len(claimed) < max_events and time.monotonic() < window_end:
+            time.sleep(min(poll_interval, max(window_end - time.monotonic(), 0)))
+            claimed += self._claim(max_events - len(claimed))
+        return claimed
+
+    @staticmethod
+    def load(claimed: Path) -> Dict[str, Any]:
+        """
+        取り出したイベントの中身
+        """
+        return json.loads(claimed.read_text())
+
+    def ack(self, claimed: Path) -> None:
+        """
+        処理済みのイベントを消す
+        """
+        claimed.unlink(missing_ok=True)
+
+    def fail(self, claimed: Path, paths: Optional[List[str]] = None) -> None:
+        """
+        失敗したイベントを failed/ に移す
+
+        Args:
+            claimed (Path): 取り出したイベント
+            paths (Optional[List[str]]): 失敗した入力パス (一部だけ失敗したときに渡す)。
+                渡すと失敗したパスだけのイベントを failed/ に書き、元のイベントは消す
+                (成功したパスを再処理して出力が重複しないように)
+        """
+        if paths is None:
+            os.replace(claimed, self.failed / claimed.name)
+            return
+        for i, path in enumerate(paths):
+            tmp = self.spool_dir / f'.{claimed.stem}-{i:04d}.json.tmp'
+            tmp.write_text(json.dumps({'path': path}))
+            os.replace(tmp, self.failed / f'{claimed.stem}-{i:04d}.json')
+        claimed.unlink(missing_ok=True)
+
+
+class WarmHandler:
+    def __init__(self, config_path: str = cli.DEFAULT_CONFIG,
+                 process: Optional[Callable[[str], Any]] = None,
+                 output_dir: Optional[Union[str, Path]] = None) -> None:
+        """
+        WarmHandlerクラスの初期化
+
+        設定の読み込みと処理本体 (pandas / numpy / main.py) の import を初期化時に
+        1回だけ行い、以後の呼び出しでは使い回す。
+
+        Args:
+            config_path (str): 設定ファイル
+            process (Optional[Callable[[str], Any]]): 1ファイルの処理 (既定: main.process_file)
+            output_dir (Optional[Union[str, Path]]): 出力先 (既定: config の output_file と同じ場所)
+        """
+        self.config = cli.load_config(config_path)
+        self.output_dir = Path(output_dir or os.path.dirname(os.path.abspath(self.config['output_file'])))
+        if process is None:
+            pipeline = cli.import_pipeline()
+            pattern = self.config['file_pattern']
+            process = lambda path: pipeline.process_file(path, pattern)
+        self.process = process
+        self.invocations = 0
+
+    def handle(self, events: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        まとめたイベントを1回の処理で片付け、1つの出力ファイルにする
+
+        Args:
+            events (List[Dict[str, Any]]): イベント
+
+        Returns:
+            Dict[str, Any]: processed / failed (入力パス) と output (出力ファイル、無ければ None)
+        """
+        self.invocations += 1
+        frames, processed, failed = [], [], []
+        for event in events:
+            for path in event_paths(event):
+                try:
+                    df = self.process(path)
+                except Exception as e:
+                    logging.error(f"Error processing file {path}: {e}")
+                    failed.append(path)
+                    continue
+                processed.append(path)
+                if df is not None:
+                    frames.append(df)
+
+        output = None
+        if frames:
+            pd = cli.lazy_import('pandas')
+            stem = Path(self.config['output_file']).stem
+            output = self.output_dir / f'{stem}-{time.time_ns():020d}-{os.getpid()}.csv'
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            tmp = output.with_suffix('.csv.tmp')
+            pd.concat(frames, ignore_index=True).to_csv(tmp, index=False)
+            os.replace(tmp, output)
+            logging.info(f"Wrote {output} ({len(processed)} files)")
+        return {'processed': processed, 'failed': failed, 'output': str(output) if output else None}
+
+    def serve(self, source: DirectoryEventSource, window: float = BATCH_WINDOW,
+              max_batch: int = MAX_BATCH, idle_timeout: Optional[float] = None,
+              heartbeat_interval: float = HEARTBEAT_INTERVAL) -> int:
+        """
+        キューのイベントを処理し続ける
+
+        キューを見るたびに、落ちたワーカーの残したイベント (ハートビートが止まったもの) を
+        pending/ に戻す。処理中はハートビートで取り出したイベントの mtime を更新し続ける。
+        読めないイベントや処理全体が失敗したバッチのイベントは failed/ に移し、次のバッチに進む。
+
+        Args:
+            source (DirectoryEventSource): イベントキュー
+            window (float): まとめる時間幅 (秒)
+            max_batch (int): まとめる最大数
+            idle_timeout (Optional[float]): この秒数イベントが無ければ終わる (None なら終わらない)
+            heartbeat_interval (float): ハートビートの間隔 (秒)。この数回分止まったイベントを戻す
+
+        Returns:
+            int: 処理したバッチ数
+        """
+        stale_after = STALE_AFTER / HEARTBEAT_INTERVAL * heartbeat_interval
+        batches = 0
+        idle_since = time.monotonic()
+        while True:
+            source.requeue_stale(stale_after)
+            # 待つのは長くてもハートビートの間隔まで (待っている間も落ちたワーカーのイベントを戻せるように)
+            wait = heartbeat_interval
+            if idle_timeout is not None:
+                wait = min(wait, max(idle_timeout - (time.monotonic() - idle_since), 0.0))
+            claimed = source.receive(max_batch, window, timeout=wait)
+            if not claimed:
+                if idle_timeout is not None and time.monotonic() - idle_since >= idle_timeout:
+                    return batches
+                continue
+            with source.heartbeat(claimed, heartbeat_interval):
+                self._serve_batch(source, claimed)
+            batches += 1
+            idle_since = time.monotonic()
+
+    def _serve_batch(self, source: DirectoryEventSource, claimed: List[Path]) -> None:
+        """
+        取り出したイベントを1回の処理で片付け、結果に応じて ack / fail する
+        """
+        loaded = []
+        for path in claimed:
+            try:
+                event = source.load(path)
+                paths = event_paths(event)
+            except Exception as e:
+                logging.error(f"Invalid event {path.name}: {e}")
+                source.fail(path)
+                continue
+            loaded.append((path, event, paths))
+        if not loaded:
+            return
+        try:
+            result = self.handle([event for _, event, _ in loaded])
+        except Exception as e:
+            logging.error(f"Error handling batch of {len(loaded)} events: {e}")
+            for path, _, _ in loaded:
+                source.fail(path)
+            return
+        failed = set(result['failed'])
+        for path, _, paths in loaded:
+            failed_paths = [p for p in paths if p in failed]
+            if not failed_paths:
+                source.ack(path)
+            elif len(failed_paths) == len(paths):
+                source.fail(path)
+            else:
+                source.fail(path, failed_paths)
+
+
+# Lambda の実行環境はプロセスを使い回すので、ハンドラもモジュールに保持する
+_HANDLER: Optional[WarmHandler] = None
+
+
+def lambda_handler(event: Dict[str, Any], context: Any = None) -> Dict[str, Any]:
+    """
+    Lambda 形式のエントリポイント (初回だけ WarmHandler を作る)
+
+    Args:
+        event (Dict[str, Any]): イベント ({"path": ...} または S3 通知)
+        context (Any): Lambda のコンテキスト (使わない)
+
+    Returns:
+        Dict[str, Any]: WarmHandler.handle の結果
+    """
+    global _HANDLER
+    if _HANDLER is None:
+        _HANDLER = WarmHandler(os.environ.get('TLC_QLC_CONFIG', cli.DEFAULT_CONFIG))
+    return _HANDLER.handle([event])
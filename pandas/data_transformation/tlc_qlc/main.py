@@ -1,14 +1,21 @@
-import os
 import pandas as pd
 import numpy as np
 import glob
 import logging
-import yaml
-from typing import List
+from typing import List, Optional
+
+import compressed
 
 # ログの設定
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Jupyter 以外 (CLI やスケジューラからの実行) では display が無いので DEBUG ログに出す
+try:
+    display
+except NameError:
+    def display(df: pd.DataFrame) -> None:
+        logging.debug("\n%s", df)
+
 class DataProcessor:
     def __init__(self, df: pd.DataFrame, filename: str) -> None:
         """
@@ -65,11 +72,10 @@ class DataProcessor:
             display(self.df.head())
         
         # ステップ7: fbcXを選択する
-        def select_fbc_closest_to_zero(group: pd.DataFrame) -> pd.Series:
-            closest_shift_index = group[[f'shift{i}' for i in 'ABCDEFG']].abs().idxmin(axis=1)
-            return group.lookup(closest_shift_index.index, 'fbc' + closest_shift_index.str[-1])
-        
-        self.df['FBC'] = self.df.groupby('Unit').apply(select_fbc_closest_to_zero).reset_index(level=0, drop=True)
+        # 行ごとに |shiftX| が最小の X の fbcX (DataFrame.lookup は pandas 2 で削除された)
+        shifts = self.df[[f'shift{i}' for i in 'ABCDEFG']].abs().to_numpy()
+        fbcs = self.df[[f'fbc{i}' for i in 'ABCDEFG']].to_numpy()
+        self.df['FBC'] = fbcs[np.arange(len(self.df)), shifts.argmin(axis=1)]
         logging.info("After Step 7: fbcXを選択する")
         display(self.df.head())
         
@@ -138,6 +144,45 @@ class QLCProcessor(DataProcessor):
             default=self.df['Page']
         )
 
+def get_processor_class(pattern: str) -> Optional[type]:
+    """
+    ファイルパターンから処理クラスを選ぶ
+
+    Args:
+        pattern (str): ファイルパターン
+
+    Returns:
+        Optional[type]: TLCProcessor / QLCProcessor (どちらでもなければ None)
+    """
+    if 'TLC' in pattern:
+        return TLCProcessor
+    if 'QLC' in pattern:
+        return QLCProcessor
+    return None
+
+def process_file(filepath: str, pattern: str) -> Optional[pd.DataFrame]:
+    """
+    1つのファイルを処理
+
+    Args:
+        filepath (str): 入力ファイル (.csv / .csv.gz / .csv.zst / .csv.lz4)
+        pattern (str): ファイルパターン (TLC / QLC の判定に使う)
+
+    Returns:
+        Optional[pd.DataFrame]: 処理後のデータフレーム (対象外のファイルなら None)
+    """
+    if not compressed.is_csv_input(filepath):
+        return None
+    logging.info(f"Processing file: {filepath}")
+    processor_class = get_processor_class(pattern)
+    if processor_class is None:
+        logging.error(f"Unknown file pattern: {pattern}")
+        return None
+    # .csv.gz / .csv.zst / .csv.lz4 は伸長しながら読む
+    with compressed.open_input(filepath) as stream:
+        df = pd.read_csv(stream)
+    return processor_class(df, compressed.csv_name(filepath)).process()
+
 def process_all_files(pattern: str) -> pd.DataFrame:
     """
     ワイルドカードパターンに一致する全てのファイルを処理
@@ -151,18 +196,8 @@ def process_all_files(pattern: str) -> pd.DataFrame:
     all_processed_data: List[pd.DataFrame] = []
     for filepath in glob.glob(pattern, recursive=True):
         try:
-            if filepath.endswith('.csv'):
-                logging.info(f"Processing file: {filepath}")
-                df = pd.read_csv(filepath)
-                filename = os.path.basename(filepath)
-                if 'TLC' in pattern:
-                    processor = TLCProcessor(df, filename)
-                elif 'QLC' in pattern:
-                    processor = QLCProcessor(df, filename)
-                else:
-                    logging.error(f"Unknown file pattern: {pattern}")
-                    continue
-                processed_df = processor.process()
+            processed_df = process_file(filepath, pattern)
+            if processed_df is not None:
                 all_processed_data.append(processed_df)
         except Exception as e:
             logging.error(f"Error processing file {filepath}: {e}")
@@ -170,6 +205,9 @@ def process_all_files(pattern: str) -> pd.DataFrame:
     return pd.concat(all_processed_data, ignore_index=True)
 
 if __name__ == "__main__":
+    # yaml はスクリプトとして実行するときだけ使う (cli などから import したときは読まない)
+    import yaml
+
     with open('config.yaml') as file:
         config = yaml.safe_load(file)
     
@@ -0,0 +1,125 @@
+"""
+uid の仮名化 (鍵付きハッシュによるトークン化)
+
+uid を秘密鍵付きの BLAKE2b でトークンに置き換える。鍵を知らなければ元の uid には戻せず、
+同じ鍵なら同じ uid は常に同じトークンになる (ファイルや実行をまたいで結合できる)。
+
+uid はファイル内で一定なので、ハッシュは異なる uid ごとに1回だけ計算し、
+factorize のコードでカラム全体に配る。行ごとの Python 呼び出しは無い。
+
+トークンの形式:
+    int64:  8 バイトのダイジェストの上位1ビットを落とした 63 ビットの整数
+            (符号付き 64 ビットに収まるので CSV / DuckDB / SQLite の INTEGER にそのまま入る)
+    binary: digest_size バイトの固定長バイナリ (Arrow の fixed_size_binary)
+"""
+import hashlib
+import os
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# 秘密鍵を渡す環境変数 (16進文字列)
+KEY_ENV = 'TLC_QLC_PSEUDONYM_KEY'
+
+# 鍵の最小の長さ (バイト)
+MIN_KEY_BYTES = 16
+
+TOKEN_FORMATS = ('int64', 'binary')
+
+# 63 ビットのトークンにするマスク
+TOKEN_MASK = np.uint64((1 << 63) - 1)
+
+
+def load_key(env: str = KEY_ENV) -> bytes:
+    """
+    環境変数から秘密鍵を読む
+
+    Args:
+        env (str): 環境変数名
+
+    Returns:
+        bytes: 鍵
+
+    Raises:
+        KeyError: 環境変数が無い
+        ValueError: 16進でない、または短すぎる
+    """
+    if env not in os.environ:
+        raise KeyError(f"Pseudonymization key is not set: {env}")
+    key = bytes.fromhex(os.environ[env])
+    if not MIN_KEY_BYTES <= len(key) <= hashlib.blake2b.MAX_KEY_SIZE:
+        raise ValueError(f"Pseudonymization key must be {MIN_KEY_BYTES}-{hashlib.blake2b.MAX_KEY_SIZE} bytes")
+    return key
+
+
+def hash_unique(values: np.ndarray, key: bytes, digest_size: int = 8) -> np.ndarray:
+    """
+    異なる値ごとに鍵付きハッシュを計算する
+
+    Args:
+        values (np.ndarray): 異なる値 (factorize の uniques)
+        key (bytes): 秘密鍵
+        digest_size (int): ダイジェストのバイト数
+
+    Returns:
+        np.ndarray: (len(values), digest_size) の uint8 の配列
+    """
+    digests = b''.join(hashlib.blake2b(str(v).encode(), key=key, digest_size=digest_size).digest()
+                       for v in values)
+    return np.frombuffer(digests, dtype='uint8').reshape(len(values), digest_size)
+
+
+def tokenize(values: pd.Series, key: bytes, token_format: str = 'int64', digest_size: int = 16) -> pd.Series:
+    """
+    カラム全体をトークンにする (null は null のまま)
+
+    Args:
+        values (pd.Series): uid のカラム
+        key (bytes): 秘密鍵
+        token_format (str): 'int64' / 'binary'
+        digest_size (int): binary のときのバイト数 (int64 は常に 8)
+
+    Returns:
+        pd.Series: トークンのカラム (int64 / Int64 / fixed_size_binary)
+    """
+    if token_format not in TOKEN_FORMATS:
+        raise ValueError(f"Unknown token format: {token_format}")
+    codes, uniques = pd.factorize(values)
+    missing = codes < 0
+    size = 8 if token_format == 'int64' else digest_size
+    # 末尾にダミー (null 用) を1つ足して、コード -1 もそのまま引けるようにする
+    table = np.vstack([hash_unique(np.asarray(uniques), key, size), np.zeros((1, size), dtype='uint8')])
+    digests = table[codes]
+
+    if token_format == 'int64':
+        # 上位1ビットを落として int64 の範囲 (0 <= token < 2^63) に収める
+        tokens = (digests.copy().view('<u8').ravel() & TOKEN_MASK).astype('int64')
+        if missing.any():
+            return pd.Series(pd.arrays.IntegerArray(tokens, missing), index=values.index, name=values.name)
+        return pd.Series(tokens, index=values.index, name=values.name)
+
+    validity = pa.py_buffer(np.packbits(~missing, bitorder='little')) if missing.any() else None
+    array = pa.FixedSizeBinaryArray.from_buffers(pa.binary(size), len(codes),
+                                                 [validity, pa.py_buffer(digests.tobytes())])
+    return pd.Series(pd.arrays.ArrowExtensionArray(array), index=values.index, name=values.name)
+
+
+def pseudonymize(df: pd.DataFrame, column: str = 'uid', key: Optional[bytes] = None,
+                 token_format: str = 'int64', digest_size: int = 16) -> pd.DataFrame:
+    """
+    データフレームの uid をトークンに置き換える (カラム名はそのまま)
+
+    Args:
+        df (pd.DataFrame): 処理済みのデータ
+        column (str): 仮名化するカラム
+        key (Optional[bytes]): 秘密鍵 (既定: 環境変数 TLC_QLC_PSEUDONYM_KEY)
+        token_format (str): 'int64' / 'binary'
+        digest_size (int): binary のときのバイト数
+
+    Returns:
+        pd.DataFrame: 仮名化したデータ (元のデータは変更しない)
+    """
+    key = load_key() if key is None else key
+    return df.assign(**{column: tokenize(df[column], key, token_format, digest_size)})
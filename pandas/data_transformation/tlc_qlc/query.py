@@ -0,0 +1,254 @@
+import argparse
+import glob
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+
+import duckdb
+import yaml
+
+import compaction
+
+# ログの設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# 処理済み出力を登録する既定のビュー名
+DEFAULT_VIEW = 'processed'
+
+# Parquet パーティションのキー (WECyc=3000/DR=0/part-*.parquet)
+PARTITION_COLUMNS = ['WECyc', 'DR']
+
+# 有効なファイルが1つも無いデータレイクの、スキーマが分かる前の型 (パーティションのキーだけ)
+EMPTY_LAKE_SCHEMA = [(column, 'BIGINT') for column in PARTITION_COLUMNS]
+
+
+def _quote(path: str) -> str:
+    """
+    SQL 文字列リテラル用にパスをクォートする
+
+    Args:
+        path (str): ファイルパスまたはグロブ
+
+    Returns:
+        str: シングルクォートで囲んだ文字列
+    """
+    return "'" + path.replace("'", "''") + "'"
+
+
+def is_compacted_lake(source: str) -> bool:
+    """
+    コンパクションの manifest があるデータレイクか (有効なファイルがクエリのたびに変わる)
+    """
+    return os.path.isdir(source) and bool(
+        glob.glob(os.path.join(source, '**', compaction.MANIFEST_NAME), recursive=True))
+
+
+def source_relation(source: str) -> str:
+    """
+    処理済み出力のパスを DuckDB のテーブル関数式に変換する
+
+    単一の CSV / Parquet、グロブ、Hive 形式でパーティション分割された
+    ディレクトリ (WECyc=.../DR=.../*.parquet) を受け付ける。
+    ディレクトリの場合は hive_partitioning を有効にするため、
+    WHERE 句の WECyc / DR はファイル単位で枝刈りされる。
+    コンパクションの manifest があるディレクトリは、まとめ済みの元ファイルを除いて読む
+    (この関数を呼んだ時点の有効なファイルを並べるので、式はすぐに実行すること)。
+
+    Args:
+        source (str): 処理済み出力のパス
+
+    Returns:
+        str: FROM 句に書ける読み込み式
+    """
+    if os.path.isdir(source):
+        if is_compacted_lake(source):
+            # コンパクション中のパーティションがあるので、有効なファイルだけを読む
+            live = compaction.lake_live_files(source)
+            if not live:
+                raise ValueError(f"No live files in {source}")
+            files = ', '.join(_quote(str(p)) for p in live)
+            return f"read_parquet([{files}], hive_partitioning = true, union_by_name = true)"
+        if glob.glob(os.path.join(source, '**', '*.parquet'), recursive=True):
+            pattern = os.path.join(source, '**', '*.parquet')
+            return f"read_parquet({_quote(pattern)}, hive_partitioning = true, union_by_name = true)"
+        pattern = os.path.join(source, '**', '*.csv')
+        return f"read_csv_auto({_quote(pattern)}, hive_partitioning = true, union_by_name = true)"
+    if source.endswith('.parquet'):
+        return f"read_parquet({_quote(source)}, hive_partitioning = true)"
+    if source.endswith('.csv'):
+        return f"read_csv_auto({_quote(source)})"
+    raise ValueError(f"Unsupported source: {source}")
+
+
+class QueryEngine:
+    def __init__(self, sources: Optional[Dict[str, str]] = None, threads: Optional[int] = None,
+                 memory_limit: Optional[str] = None) -> None:
+        """
+        QueryEngineクラスの初期化
+
+        サーバー不要のインメモリ DuckDB に接続し、処理済み出力をビューとして登録する。
+        ビューはファイルを読み込まないので、登録は一瞬で終わる。
+
+        Args:
+            sources (Optional[Dict[str, str]]): ビュー名 -> 処理済み出力のパス
+            threads (Optional[int]): スキャンの並列数 (None なら全コア)
+            memory_limit (Optional[str]): DuckDB のメモリ上限 (例: '4GB')
+        """
+        self.con = duckdb.connect(database=':memory:')
+        # コンパクションされるデータレイク (ビュー名 -> パス)。有効なファイルはクエリのたびに取り直す
+        self.live_sources: Dict[str, str] = {}
+        # 有効なファイルが無くなったときに空のビューを作るための、最後に見えたスキーマ
+        self.schemas: Dict[str, List[Tuple[str, str]]] = {}
+        if threads is not None:
+            self.con.execute(f"SET threads = {int(threads)}")
+        if memory_limit is not None:
+            self.con.execute(f"SET memory_limit = {_quote(memory_limit)}")
+        for name, source in (sources or {}).items():
+            self.register(name, source)
+
+    def register(self, name: str, source: str) -> None:
+        """
+        処理済み出力をビューとして登録する
+
+        コンパクションされるデータレイクは、登録時のファイル一覧を固定しないよう
+        クエリのたびに有効なファイルを取り直す (refresh)。
+
+        Args:
+            name (str): ビュー名
+            source (str): 処理済み出力のパス
+        """
+        if is_compacted_lake(source):
+            self.live_sources[name] = source
+            self._refresh_view(name, source)
+        else:
+            self.live_sources.pop(name, None)
+            relation = source_relation(source)
+            self.con.execute(f'CREATE OR REPLACE VIEW "{name}" AS SELECT * FROM {relation}')
+        logging.info(f"Registered view {name}: {source}")
+
+    def _refresh_view(self, name: str, source: str) -> None:
+        """
+        コンパクションされるデータレイクのビューを、今の有効なファイルで作り直す
+
+        ファイルの一覧は SQL に埋め込まず DuckDB の変数に入れる (ビューの SQL はファイル数によらない)。
+        有効なファイルが無ければ、最後に見えたスキーマの空のビューにする。
+        """
+        files = [str(p) for p in compaction.lake_live_files(source)]
+        variable = f'{name}_files'
+        if files:
+            self.con.execute(f'SET VARIABLE "{variable}" = ?', [files])
+            self.con.execute(f'CREATE OR REPLACE VIEW "{name}" AS SELECT * FROM read_parquet('
+                             f"getvariable({_quote(variable)}), hive_partitioning = true, union_by_name = true)")
+            self.schemas[name] = [(row[0], row[1]) for row in self.con.execute(f'DESCRIBE "{name}"').fetchall()]
+        else:
+            columns = ', '.join(f'CAST(NULL AS {dtype}) AS "{column}"'
+                                for column, dtype in self.schemas.get(name, EMPTY_LAKE_SCHEMA))
+            self.con.execute(f'CREATE OR REPLACE VIEW "{name}" AS SELECT {columns} WHERE false')
+
+    def refresh(self) -> None:
+        """
+        コンパクションされるデータレイクのビューを、今の有効なファイルで作り直す
+        """
+        for name, source in self.live_sources.items():
+            self._refresh_view(name, source)
+
+    def query(self, sql: str, output: str = 'pandas'):
+        """
+        SQL を実行して結果を返す
+
+        Args:
+            sql (str): 実行する SQL
+            output (str): 'pandas' / 'arrow' / 'polars'
+
+        Returns:
+            pd.DataFrame | pyarrow.Table | pl.DataFrame: クエリ結果
+        """
+        try:
+            self.refresh()
+            result = self.con.execute(sql)
+        except duckdb.IOException as e:
+            if not self.live_sources:
+                raise
+            # 一覧を取った後にコンパクションが元ファイルを消した。一覧を取り直して1回だけやり直す
+            logging.warning(f"Retrying after a file disappeared: {e}")
+            self.refresh()
+            result = self.con.execute(sql)
+        if output == 'pandas':
+            return result.df()
+        if output == 'arrow':
+            # DuckDB 1.4 以降では arrow() が RecordBatchReader を返す
+            if hasattr(result, 'to_arrow_table'):
+                return result.to_arrow_table()
+            return result.arrow()
+        if output == 'polars':
+            return result.pl()
+        raise ValueError(f"Unknown output: {output}")
+
+    def export_partitioned(self, source: str, dest: str,
+                           partition_by: Optional[list] = None) -> None:
+        """
+        処理済み出力を Hive 形式の Parquet パーティションに書き出す
+
+        processed.csv を一度変換しておくと、以後のクエリは列指向スキャンと
+        WECyc / DR によるパーティション枝刈りが効く。
+
+        Args:
+            source (str): 処理済み出力のパス
+            dest (str): 出力先ディレクトリ
+            partition_by (Optional[list]): パーティションキー (既定: WECyc, DR)
+        """
+        keys = ', '.join(partition_by or PARTITION_COLUMNS)
+        self.con.execute(
+            f"COPY (SELECT * FROM {source_relation(source)}) TO {_quote(dest)} "
+            f"(FORMAT PARQUET, PARTITION_BY ({keys}), OVERWRITE_OR_IGNORE true)"
+        )
+        logging.info(f"Exported {source} to {dest}")
+
+    def close(self) -> None:
+        """
+        接続を閉じる
+        """
+        self.con.close()
+
+    def __enter__(self) -> 'QueryEngine':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def run_query(sql: str, source: str, view: str = DEFAULT_VIEW, output: str = 'pandas',
+              threads: Optional[int] = None):
+    """
+    処理済み出力を登録して SQL を1回実行する
+
+    Args:
+        sql (str): 実行する SQL
+        source (str): 処理済み出力のパス
+        view (str): 登録するビュー名
+        output (str): 'pandas' / 'arrow' / 'polars'
+        threads (Optional[int]): スキャンの並列数
+
+    Returns:
+        pd.DataFrame | pyarrow.Table | pl.DataFrame: クエリ結果
+    """
+    with QueryEngine({view: source}, threads=threads) as engine:
+        return engine.query(sql, output=output)
+
+
+if __name__ == "__main__":
+    with open('config.yaml') as file:
+        config = yaml.safe_load(file)
+
+    parser = argparse.ArgumentParser(description='処理済み出力に SQL を実行する')
+    parser.add_argument('sql', nargs='?', help=f'実行する SQL (ビュー名: {DEFAULT_VIEW})')
+    parser.add_argument('--source', default=config['output_file'], help='処理済み出力のパス')
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--export-parquet', metavar='DIR', help='WECyc/DR パーティションの Parquet に変換する')
+    args = parser.parse_args()
+
+    with QueryEngine({DEFAULT_VIEW: args.source}, threads=args.threads) as engine:
+        if args.export_parquet:
+            engine.export_partitioned(args.source, args.export_parquet)
+        if args.sql:
+            print(engine.query(args.sql).to_string(index=False))
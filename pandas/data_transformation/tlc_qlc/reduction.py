@@ -0,0 +1,305 @@
+"""
+並列数によらずビット単位で再現する総和 (浮動小数点の FBC 集計用)
+
+浮動小数点の足し算は結合則が成り立たないので、並列に部分和を取ると
+ワーカー数や完了順で結果の下位ビットが変わる。固定サイズのブロックと固定の2分木順で
+結合することで、並列数を変えても同じ結果にする。
+
+整数のカラムは int64 のまま厳密に足す (足す順序で結果は変わらない)。
+main.py のステップ5 (seg 合算) は整数の FBC を pandas の groupby().sum() で足しており、
+この関数は使っていない。FBC を率などの浮動小数点に直してから集計するときに使う。
+"""
+import os
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+# ブロックの行数 (並列数によらず固定。変えると結果のビット列も変わる)
+BLOCK_SIZE = 1 << 16
+
+# 並列実行時に同時に計算中にしておくブロック数 (ワーカー数に対する倍率)
+IN_FLIGHT_PER_WORKER = 2
+
+# 部分和: (合計, 補正項)
+Partial = Tuple[np.ndarray, np.ndarray]
+
+
+def _two_sum(a: np.ndarray, b: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    誤差なし変換 TwoSum (a + b = s + e が厳密に成り立つ)
+
+    Args:
+        a (np.ndarray): 加数
+        b (np.ndarray): 加数
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: 丸めた和 s と丸め誤差 e
+    """
+    s = a + b
+    bb = s - a
+    e = (a - (s - bb)) + (b - bb)
+    return s, e
+
+
+def _pairwise_compensated_sum(values: np.ndarray) -> Tuple[float, float]:
+    """
+    ブロック内の補正付き総和
+
+    隣り合う要素を TwoSum で2分木状に足し、各段の丸め誤差を補正項に集める。
+    ベクトル演算のみで Kahan/Neumaier と同等の精度が得られる。
+
+    Args:
+        values (np.ndarray): 1ブロックぶんの値
+
+    Returns:
+        Tuple[float, float]: 合計と補正項
+    """
+    x = values.astype(np.float64, copy=True)
+    comp = 0.0
+    while x.size > 1:
+        if x.size % 2:
+            x = np.append(x, 0.0)
+        x, e = _two_sum(x[0::2], x[1::2])
+        comp += float(np.sum(e))
+    return (float(x[0]) if x.size else 0.0), comp
+
+
+def _grouped_compensated_sum(codes: np.ndarray, values: np.ndarray, n_groups: int) -> Partial:
+    """
+    ブロック内のグループ別 Neumaier 総和
+
+    各グループの r 番目の要素をまとめて1回のベクトル演算で足すため、
+    ループ回数はブロック内の最大グループサイズ (seg 合算なら 4) で済む。
+
+    Args:
+        codes (np.ndarray): グループ番号
+        values (np.ndarray): 値
+        n_groups (int): グループ数
+
+    Returns:
+        Partial: グループ別の合計と補正項
+    """
+    total = np.zeros(n_groups)
+    comp = np.zeros(n_groups)
+    if codes.size == 0:
+        return total, comp
+    order = np.argsort(codes, kind='stable')
+    c = codes[order]
+    v = values[order].astype(np.float64)
+    starts = np.flatnonzero(np.r_[True, c[1:] != c[:-1]])
+    rank = np.arange(c.size) - np.repeat(starts, np.diff(np.r_[starts, c.size]))
+    by_rank = np.argsort(rank, kind='stable')
+    bounds = np.r_[0, np.cumsum(np.bincount(rank))]
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        idx = by_rank[lo:hi]
+        g, x = c[idx], v[idx]
+        s = total[g]
+        t = s + x
+        comp[g] += np.where(np.abs(s) >= np.abs(x), (s - t) + x, (x - t) + s)
+        total[g] = t
+    return total, comp
+
+
+def _block_partial(codes: Optional[np.ndarray], values: np.ndarray, n_groups: int,
+                   compensated: bool) -> Partial:
+    """
+    1ブロックの部分和を計算する (ワーカーで実行される)
+
+    Args:
+        codes (Optional[np.ndarray]): グループ番号 (None なら全体で1グループ)
+        values (np.ndarray): 値
+        n_groups (int): グループ数
+        compensated (bool): 補正付き総和を使うか
+
+    Returns:
+        Partial: グループ別の合計と補正項
+    """
+    if codes is None:
+        if compensated:
+            total, comp = _pairwise_compensated_sum(values)
+            return np.array([total]), np.array([comp])
+        return np.array([np.sum(values, dtype=np.float64)]), np.zeros(1)
+    if compensated:
+        return _grouped_compensated_sum(codes, values, n_groups)
+    return np.bincount(codes, weights=values, minlength=n_groups), np.zeros(n_groups)
+
+
+def _combine(a: Partial, b: Partial, compensated: bool) -> Partial:
+    """
+    2つの部分和を結合する
+
+    Args:
+        a (Partial): 左の部分和
+        b (Partial): 右の部分和
+        compensated (bool): 丸め誤差を補正項に残すか
+
+    Returns:
+        Partial: 結合した部分和
+    """
+    if not compensated:
+        return a[0] + b[0], a[1]
+    s, e = _two_sum(a[0], b[0])
+    return s, a[1] + b[1] + e
+
+
+def _tree_reduce(partials: Iterator[Partial], compensated: bool) -> Partial:
+    """
+    ブロック番号順に届く部分和を固定の2分木順で結合する
+
+    2進カウンタと同じ要領で同じ高さの部分木同士を結合するため、
+    木の形はブロック数だけで決まり、ワーカー数や完了順には依存しない。
+    保持する部分和は log2(ブロック数) 個まで。
+
+    Args:
+        partials (Iterator[Partial]): ブロック番号順の部分和
+        compensated (bool): 補正付きで結合するか
+
+    Returns:
+        Partial: 全体の合計と補正項
+    """
+    stack: List[Tuple[int, Partial]] = []
+    for partial in partials:
+        height = 0
+        while stack and stack[-1][0] == height:
+            _, left = stack.pop()
+            partial = _combine(left, partial, compensated)
+            height += 1
+        stack.append((height, partial))
+    if not stack:
+        raise ValueError("No blocks to reduce")
+    _, result = stack.pop()
+    while stack:
+        _, left = stack.pop()
+        result = _combine(left, result, compensated)
+    return result
+
+
+def _ordered_map(executor: Optional[Executor], workers: int, tasks: Iterator[tuple]) -> Iterator[Partial]:
+    """
+    タスクを並列実行し、結果を投入順に返す (同時実行数は有限)
+
+    Args:
+        executor (Optional[Executor]): 使用する Executor (None ならスレッドプール)
+        workers (int): ワーカー数
+        tasks (Iterator[tuple]): _block_partial の引数
+
+    Returns:
+        Iterator[Partial]: ブロック番号順の部分和
+    """
+    if workers <= 1 and executor is None:
+        for args in tasks:
+            yield _block_partial(*args)
+        return
+    own = executor is None
+    pool = executor or ThreadPoolExecutor(max_workers=workers)
+    try:
+        pending = []
+        for args in tasks:
+            pending.append(pool.submit(_block_partial, *args))
+            if len(pending) >= workers * IN_FLIGHT_PER_WORKER:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+    finally:
+        if own:
+            pool.shutdown()
+
+
+def _blocks(codes: Optional[np.ndarray], values: np.ndarray, n_groups: int, block_size: int,
+            compensated: bool) -> Iterator[tuple]:
+    for start in range(0, max(len(values), 1), block_size):
+        stop = start + block_size
+        yield (None if codes is None else codes[start:stop]), values[start:stop], n_groups, compensated
+
+
+def block_sum(values: Sequence[float], block_size: int = BLOCK_SIZE, workers: int = 1,
+              compensated: bool = False, executor: Optional[Executor] = None) -> float:
+    """
+    ワーカー数によらずビット単位で再現する総和
+
+    固定サイズのブロックごとに部分和を取り、固定の2分木順で結合する。
+
+    Args:
+        values (Sequence[float]): 値
+        block_size (int): ブロックの行数
+        workers (int): 並列数 (結果には影響しない)
+        compensated (bool): 補正付き (TwoSum/Neumaier) 総和を使うか
+        executor (Optional[Executor]): ブロック計算に使う Executor
+
+    Returns:
+        float: 総和
+    """
+    values = np.asarray(values, dtype=np.float64)
+    tasks = _blocks(None, values, 1, block_size, compensated)
+    total, comp = _tree_reduce(_ordered_map(executor, workers, tasks), compensated)
+    return float(total[0] + comp[0])
+
+
+def grouped_block_sum(codes: Sequence[int], values: Sequence[float], n_groups: int,
+                      block_size: int = BLOCK_SIZE, workers: int = 1, compensated: bool = False,
+                      executor: Optional[Executor] = None) -> np.ndarray:
+    """
+    ワーカー数によらずビット単位で再現するグループ別総和
+
+    Args:
+        codes (Sequence[int]): 0 から n_groups-1 のグループ番号
+        values (Sequence[float]): 値
+        n_groups (int): グループ数
+        block_size (int): ブロックの行数
+        workers (int): 並列数 (結果には影響しない)
+        compensated (bool): 補正付き (Neumaier) 総和を使うか
+        executor (Optional[Executor]): ブロック計算に使う Executor
+
+    Returns:
+        np.ndarray: グループ別の総和 (float64)
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    if codes.shape != values.shape:
+        raise ValueError("codes and values must have the same length")
+    tasks = _blocks(codes, values, n_groups, block_size, compensated)
+    total, comp = _tree_reduce(_ordered_map(executor, workers, tasks), compensated)
+    return total + comp
+
+
+def deterministic_groupby_sum(df: pd.DataFrame, by: List[str], columns: List[str],
+                              block_size: int = BLOCK_SIZE, workers: Optional[int] = None,
+                              compensated: bool = False) -> pd.DataFrame:
+    """
+    再現性のある groupby().sum()
+
+    浮動小数点のカラムは並列数を変えても同じビット列になる順序で足し、
+    整数のカラムは float64 を経由せず int64 のまま厳密に足す。
+    pandas の groupby() と同じく、キーに欠損値のある行は除く。
+
+    Args:
+        df (pd.DataFrame): 入力データフレーム
+        by (List[str]): グループキー
+        columns (List[str]): 合算するカラム
+        block_size (int): ブロックの行数
+        workers (Optional[int]): 並列数 (None なら CPU 数)
+        compensated (bool): 補正付き総和を使うか
+
+    Returns:
+        pd.DataFrame: キー昇順に並んだ集計結果
+    """
+    grouper = df.groupby(by, sort=True)
+    # キーに欠損値のある行は ngroup() が NaN (どのグループにも入らない) になる
+    groups = grouper.ngroup()
+    valid = groups.notna().to_numpy()
+    codes = groups[valid].to_numpy(dtype=np.int64)
+    keys = grouper.size().index.to_frame(index=False)
+    workers = workers or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for column in columns:
+            if pd.api.types.is_integer_dtype(df[column]):
+                sums = np.zeros(len(keys), dtype=np.int64)
+                np.add.at(sums, codes, df[column].to_numpy(dtype=np.int64)[valid])
+            else:
+                sums = grouped_block_sum(codes, df[column].to_numpy(dtype=np.float64)[valid], len(keys),
+                                         block_size=block_size, workers=workers,
+                                         compensated=compensated, executor=pool)
+            keys[column] = sums
+    return keys
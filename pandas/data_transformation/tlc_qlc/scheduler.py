@@ -0,0 +1,250 @@
+"""
+メモリを見積もって大きいファイルから処理するスケジューラ
+
+入力ファイルは数 KB から数 GB まである。素朴なプールだと大きいファイルが同時に
+ワーカーに乗って OOM になるか、最後に1つの巨大なファイルだけが残ってコアが遊ぶ。
+
+- MemoryModel: ピーク RSS を「基礎 + 係数 × ファイルサイズ」で見積もる。係数はセル種別
+  (TLC / QLC) ごとに過去の実行履歴 (JSON Lines) から最小二乗で求める
+- run_scheduled: 見積もりの合計が RSS の予算に収まる範囲で、大きいファイルから順に投入する
+  (Longest Processing Time first)。1つで予算を超えるファイルは単独で処理する
+- ワーカーは既定で1ファイルごとに作り直す (max_tasks_per_child=1) ので、
+  ファイルごとの実際のピーク RSS が測れ、メモリの断片化も持ち越さない。
+  ワーカーは spawn で起動するので、ファイルごとに pandas の import (1 秒前後) がかかる。
+  小さいファイルが多いときは max_tasks_per_child=None でワーカーを使い回す
+  (ピーク RSS はそれまでのファイルの最大になるので、履歴には残さない)
+- 見積もりと実測をファイルごとに報告し、履歴に追記して次回の見積もりに使う
+"""
+import json
+import logging
+import os
+import resource
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+import compressed
+
+# ログの設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# 履歴が無いときの見積もり: 基礎 (インタプリタ + pandas) とファイルサイズに対する倍率
+DEFAULT_BASE_BYTES = 200 << 20
+DEFAULT_SLOPE = 12.0
+
+# 見積もりに掛ける安全率
+SAFETY_FACTOR = 1.2
+
+# 最小二乗に使う履歴の最小件数
+MIN_HISTORY = 3
+
+
+def cell_type(path: str, pattern: str = '') -> str:
+    """
+    ファイルのセル種別 (パスかパターンに QLC を含めば QLC、それ以外は TLC)
+    """
+    return 'QLC' if 'QLC' in path or 'QLC' in pattern else 'TLC'
+
+
+def peak_rss_bytes() -> int:
+    """
+    このプロセスのピーク RSS (Linux の ru_maxrss は KB)
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@dataclass
+class FileTask:
+    path: str
+    cell: str
+    size: int  # 伸長後のサイズ (compressed.uncompressed_size)
+    predicted: int
+
+
+class MemoryModel:
+    def __init__(self, coefficients: Optional[Dict[str, Tuple[float, float]]] = None,
+                 safety: float = SAFETY_FACTOR) -> None:
+        """
+        MemoryModelクラスの初期化
+
+        Args:
+            coefficients (Optional[Dict[str, Tuple[float, float]]]): セル種別 -> (基礎, 係数)
+            safety (float): 見積もりに掛ける安全率
+        """
+        self.coefficients = coefficients or {}
+        self.safety = safety
+
+    def predict(self, size: int, cell: str) -> int:
+        """
+        ピーク RSS の見積もり
+
+        Args:
+            size (int): ファイルサイズ
+            cell (str): セル種別
+
+        Returns:
+            int: バイト数
+        """
+        base, slope = self.coefficients.get(cell, (DEFAULT_BASE_BYTES, DEFAULT_SLOPE))
+        return int((base + slope * size) * self.safety)
+
+    @classmethod
+    def fit(cls, records: Sequence[Dict], safety: float = SAFETY_FACTOR) -> 'MemoryModel':
+        """
+        履歴からセル種別ごとの基礎と係数を求める
+
+        Args:
+            records (Sequence[Dict]): {'cell', 'size', 'actual'} の履歴
+            safety (float): 見積もりに掛ける安全率
+
+        Returns:
+            MemoryModel: 見積もり
+        """
+        coefficients = {}
+        for cell in sorted({r['cell'] for r in records}):
+            rows = [r for r in records if r['cell'] == cell]
+            sizes = np.array([r['size'] for r in rows], dtype='float64')
+            actual = np.array([r['actual'] for r in rows], dtype='float64')
+            if len(rows) < MIN_HISTORY or np.ptp(sizes) == 0:
+                continue
+            slope, base = np.polyfit(sizes, actual, 1)
+            # 小さいファイルしか無い履歴で係数が負にならないようにする
+            coefficients[cell] = (max(base, 0.0), max(slope, 0.0))
+        return cls(coefficients, safety)
+
+    @classmethod
+    def from_history(cls, path: Union[str, Path], safety: float = SAFETY_FACTOR) -> 'MemoryModel':
+        """
+        履歴のファイル (JSON Lines) から見積もりを作る (無ければ既定値)
+        """
+        path = Path(path)
+        if not path.exists():
+            return cls(safety=safety)
+        records = [json.loads(line) for line in path.read_text().splitlines() if line.strip()]
+        return cls.fit(records, safety)
+
+
+def next_task(pending: List[FileTask], in_flight: int, budget: int, running: int) -> Optional[int]:
+    """
+    次に投入するタスク (大きい順に並んだ pending のうち、予算に収まる最初のもの)
+
+    Args:
+        pending (List[FileTask]): 未投入のタスク (見積もりの大きい順)
+        in_flight (int): 処理中のタスクの見積もりの合計
+        budget (int): RSS の予算
+        running (int): 処理中のタスク数
+
+    Returns:
+        Optional[int]: pending の添字 (今は投入できなければ None)
+    """
+    for i, task in enumerate(pending):
+        if in_flight + task.predicted <= budget:
+            return i
+    # 1つで予算を超えるものは、他に何も動いていないときに単独で処理する
+    if running == 0 and pending:
+        return 0
+    return None
+
+
+def _process_file(path: str, pattern: str):
+    import main
+    return main.process_file(path, pattern)
+
+
+def _run_task(process: Callable, path: str, pattern: str) -> Tuple[object, int, float]:
+    """
+    ワーカーで1ファイルを処理し、結果とピーク RSS と処理時間を返す
+    """
+    start = time.perf_counter()
+    result = process(path, pattern)
+    return result, peak_rss_bytes(), time.perf_counter() - start
+
+
+def run_scheduled(paths: Sequence[str], pattern: str, budget_bytes: int, workers: Optional[int] = None,
+                  model: Optional[MemoryModel] = None, history: Optional[Union[str, Path]] = None,
+                  process: Callable = _process_file,
+                  max_tasks_per_child: Optional[int] = 1) -> Tuple[List[object], List[Dict]]:
+    """
+    ファイルを RSS の予算の範囲で大きい順に並列処理する
+
+    Args:
+        paths (Sequence[str]): 入力ファイル
+        pattern (str): ファイルパターン (TLC / QLC の判定に使う)
+        budget_bytes (int): 同時に処理するファイルの見積もりの合計の上限
+        workers (Optional[int]): ワーカー数 (既定: CPU 数)
+        model (Optional[MemoryModel]): 見積もり (既定: history から作る)
+        history (Optional[Union[str, Path]]): 履歴のファイル (実測を追記する)
+        process (Callable): 1ファイルの処理 (モジュールの関数。既定: main.process_file)
+        max_tasks_per_child (Optional[int]): ワーカーを作り直すまでのファイル数
+            (既定: 1。None ならワーカーを使い回し、実測を履歴に残さない)
+
+    Returns:
+        Tuple[List[object], List[Dict]]: paths と同じ順・同じ長さの結果 (失敗したファイルは None) と、
+            ファイルごとの見積もりと実測の報告
+    """
+    if model is None:
+        model = MemoryModel.from_history(history) if history else MemoryModel()
+    # 圧縮した入力は伸長後のサイズで見積もる (メモリに載るのは伸長したデータ)
+    tasks = [FileTask(p, cell_type(p, pattern), compressed.uncompressed_size(p), 0) for p in paths]
+    for task in tasks:
+        task.predicted = model.predict(task.size, task.cell)
+    # pending と order は同じ順 (見積もりの大きい順) に並べ、order に paths の添字を持つ
+    # (同じパスが2回あってもそれぞれの結果を返す)
+    order = sorted(range(len(tasks)), key=lambda i: tasks[i].predicted, reverse=True)
+    pending = [tasks[i] for i in order]
+
+    results: List[object] = [None] * len(tasks)
+    report: List[Dict] = []
+    running: Dict = {}
+    in_flight = 0
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), max_tasks_per_child=max_tasks_per_child) as pool:
+        while pending or running:
+            while pending and len(running) < (workers or os.cpu_count()):
+                i = next_task(pending, in_flight, budget_bytes, len(running))
+                if i is None:
+                    break
+                task, index = pending.pop(i), order.pop(i)
+                in_flight += task.predicted
+                running[pool.submit(_run_task, process, task.path, pattern)] = (index, task)
+                logging.info(f"Scheduled {task.path} ({task.size} bytes, predicted {task.predicted >> 20} MB)")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, task = running.pop(future)
+                in_flight -= task.predicted
+                try:
+                    result, actual, seconds = future.result()
+                except Exception as e:
+                    logging.error(f"Error processing file {task.path}: {e}")
+                    report.append({**asdict(task), 'actual': None, 'seconds': None, 'error': str(e)})
+                    continue
+                results[index] = result
+                report.append({**asdict(task), 'actual': actual, 'seconds': seconds,
+                               'ratio': actual / task.predicted})
+                logging.info(f"Finished {task.path}: predicted {task.predicted >> 20} MB, "
+                             f"actual {actual >> 20} MB")
+
+    # ワーカーを使い回したときの実測はそれまでのファイルの最大なので、見積もりの学習には使わない
+    if history and max_tasks_per_child == 1:
+        with open(history, 'a') as file:
+            for row in report:
+                if row['actual'] is not None:
+                    file.write(json.dumps({k: row[k] for k in ('path', 'cell', 'size', 'actual')}) + '\n')
+    return results, report
+
+
+def format_report(report: List[Dict]) -> str:
+    """
+    見積もりと実測の表
+    """
+    lines = [f"{'file':<40}{'cell':>5}{'size MB':>10}{'pred MB':>10}{'act MB':>10}{'sec':>8}"]
+    for row in report:
+        actual = f"{row['actual'] / 2**20:10.1f}" if row['actual'] is not None else f"{'error':>10}"
+        seconds = f"{row['seconds']:8.2f}" if row['seconds'] is not None else f"{'':>8}"
+        lines.append(f"{os.path.basename(row['path']):<40}{row['cell']:>5}{row['size'] / 2**20:10.2f}"
+                     f"{row['predicted'] / 2**20:10.1f}{actual}{seconds}")
+    return '\n'.join(lines)
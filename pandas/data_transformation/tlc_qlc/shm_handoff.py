@@ -0,0 +1,367 @@
+"""
+ワーカープロセスの結果を共有メモリで親に渡す
+
+ワーカーが DataFrame をそのまま返すと、親へのパイプで pickle とコピーが走る。
+ここではワーカーが結果を Arrow IPC の形で共有メモリに書き、パイプには小さな
+記述子 (共有メモリの名前とサイズ) だけを流す。親は共有メモリにアタッチして
+コピーせずに Arrow のテーブルとして読み、そのまま出力先に書き出してから解放する。
+
+run_scheduled (scheduler.run_scheduled に process_file_shared を渡す) の結果はこの記述子になる。
+共有メモリの後始末は親の resource_tracker に任せる。ワーカーは親の resource_tracker を
+共有するので、親が読んで消したものは登録が外れ、読まれずに残ったものは親の終了時に消される。
+
+使い方 (pickle との比較):
+    python shm_handoff.py --rows 100000 1000000 --repeat 3
+"""
+import argparse
+import logging
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from multiprocessing import resource_tracker, shared_memory
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv
+import pyarrow.parquet as pq
+
+import scheduler
+
+# ログの設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+@dataclass(frozen=True)
+class ShmResult:
+    name: str
+    size: int
+    rows: int
+
+
+def to_shared(df: Optional[pd.DataFrame]) -> Optional[ShmResult]:
+    """
+    DataFrame を Arrow IPC にして共有メモリに書く (ワーカー側)
+
+    共有メモリは親が consume で解放するので、ここでは閉じるだけで消さない
+    (登録は親と共有の resource_tracker に残り、親が消すときに外れる)。
+
+    Args:
+        df (Optional[pd.DataFrame]): 処理結果
+
+    Returns:
+        Optional[ShmResult]: 親に渡す記述子 (df が None なら None)
+    """
+    if df is None:
+        return None
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    # 先にサイズだけ測って、ちょうどの大きさの共有メモリを取る
+    sizer = pa.MockOutputStream()
+    with pa.ipc.new_stream(sizer, table.schema) as writer:
+        writer.write_table(table)
+    size = sizer.size()
+
+    shm = shared_memory.SharedMemory(create=True, size=size)
+    try:
+        target = sink = writer = None
+        try:
+            target = pa.py_buffer(shm.buf)
+            sink = pa.FixedSizeBufferWriter(target)
+            with pa.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+            sink.close()
+        finally:
+            # 共有メモリを指している Arrow のバッファを手放してから閉じる (失敗したときも)
+            del writer, sink, target
+    except BaseException:
+        _close_and_unlink(shm)
+        raise
+    shm.close()
+    return ShmResult(shm.name, size, table.num_rows)
+
+
+def _close_and_unlink(shm: shared_memory.SharedMemory) -> None:
+    """
+    共有メモリを閉じて消す (まだ参照が残っていて閉じられなくても、必ず消す)
+    """
+    try:
+        shm.close()
+    except BufferError as e:
+        # 参照が消えればマッピングも解放される。名前は消しておけば /dev/shm には残らない
+        logging.warning(f"Shared memory {shm.name} is still referenced: {e}")
+    finally:
+        shm.unlink()
+
+
+@contextmanager
+def _attached(result: ShmResult) -> Iterator[pa.Buffer]:
+    """
+    共有メモリにアタッチして中身を Arrow のバッファとして渡し、抜けるときに閉じて消す
+
+    バッファから作ったテーブルなどは、with を抜ける前に手放すこと。
+    """
+    shm = shared_memory.SharedMemory(name=result.name)
+    try:
+        buffer = pa.py_buffer(shm.buf)[:result.size]
+        try:
+            yield buffer
+        finally:
+            del buffer
+    finally:
+        _close_and_unlink(shm)
+
+
+def release(result: ShmResult) -> None:
+    """
+    共有メモリを解放する (読まずに捨てるとき)
+    """
+    try:
+        shm = shared_memory.SharedMemory(name=result.name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
+
+def _release_all(results: Iterable[Optional[ShmResult]]) -> None:
+    for result in results:
+        if result is not None:
+            release(result)
+
+
+class TableSink:
+    def __init__(self, path: Union[str, Path]) -> None:
+        """
+        TableSinkクラスの初期化
+
+        Arrow のテーブルを受け取るたびに出力ファイルへ追記する (.parquet なら Parquet、それ以外は CSV)。
+
+        Args:
+            path (Union[str, Path]): 出力ファイル
+        """
+        self.path = Path(path)
+        self.writer = None
+        self.rows = 0
+
+    def write(self, table: pa.Table) -> None:
+        if self.path.suffix == '.parquet':
+            if self.writer is None:
+                self.writer = pq.ParquetWriter(self.path, table.schema)
+            self.writer.write_table(table)
+        else:
+            # CSVWriter は最後に書いたテーブルを手放さない (共有メモリを閉じられない) ので、
+            # 開いたファイルに write_csv で1回ずつ書く
+            if self.writer is None:
+                self.writer = pa.OSFile(str(self.path), 'wb')
+            pyarrow.csv.write_csv(table, self.writer, pyarrow.csv.WriteOptions(include_header=self.rows == 0))
+        self.rows += table.num_rows
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def __enter__(self) -> 'TableSink':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def consume(result: ShmResult, sink: TableSink) -> int:
+    """
+    共有メモリにアタッチしてコピーせずに読み、出力先に書いてから解放する (親側)
+
+    Args:
+        result (ShmResult): ワーカーからの記述子
+        sink (TableSink): 出力先
+
+    Returns:
+        int: 書いた行数
+    """
+    with _attached(result) as buffer:
+        table = None
+        try:
+            table = pa.ipc.open_stream(buffer).read_all()
+            sink.write(table)
+            return table.num_rows
+        except BaseException as e:
+            # 例外のトレースバックに残った呼び出し先のローカル変数もテーブルを持っているので消す
+            traceback.clear_frames(e.__traceback__)
+            raise
+        finally:
+            # 共有メモリを指している Arrow のテーブルを先に手放す (書き込みに失敗したときも)
+            del table, buffer
+
+
+def read_shared(result: ShmResult) -> pd.DataFrame:
+    """
+    共有メモリの結果を DataFrame にして解放する (pandas で続きを処理するとき)
+
+    Arrow から pandas への変換で1回だけコピーする (pickle の書き出しと読み込みの2回のコピーが無い)。
+
+    Args:
+        result (ShmResult): ワーカーからの記述子
+
+    Returns:
+        pd.DataFrame: 処理結果
+    """
+    with _attached(result) as buffer:
+        table = None
+        try:
+            table = pa.ipc.open_stream(buffer).read_all()
+            return table.to_pandas()
+        except BaseException as e:
+            traceback.clear_frames(e.__traceback__)
+            raise
+        finally:
+            del table, buffer
+
+
+def stream_to_sink(results: Iterable[Optional[ShmResult]], path: Union[str, Path]) -> int:
+    """
+    ワーカーの記述子を順に出力ファイルへ書く
+
+    Args:
+        results (Iterable[Optional[ShmResult]]): 記述子 (None は飛ばす)
+        path (Union[str, Path]): 出力ファイル
+
+    Returns:
+        int: 書いた行数
+    """
+    pending = [r for r in results if r is not None]
+    try:
+        with TableSink(path) as sink:
+            while pending:
+                consume(pending.pop(0), sink)
+            return sink.rows
+    finally:
+        # 途中で失敗したら、まだ読んでいない共有メモリを解放する
+        _release_all(pending)
+
+
+def iter_shared(results: Iterable[Optional[ShmResult]]) -> Iterator[pd.DataFrame]:
+    """
+    ワーカーの記述子を順に DataFrame にする (読み終えたものから解放する)
+
+    途中で失敗したり、読む側が途中でやめたりしたときは、まだ読んでいない共有メモリを解放する。
+
+    Args:
+        results (Iterable[Optional[ShmResult]]): 記述子 (None は飛ばす)
+
+    Yields:
+        pd.DataFrame: 処理結果
+    """
+    pending = [r for r in results if r is not None]
+    try:
+        while pending:
+            yield read_shared(pending.pop(0))
+    finally:
+        _release_all(pending)
+
+
+def run_scheduled(paths: Sequence[str], pattern: str, budget_bytes: int, workers: Optional[int] = None,
+                  **kwargs) -> Tuple[List[Optional[ShmResult]], List[Dict]]:
+    """
+    scheduler.run_scheduled のワーカーの結果を共有メモリで受け取る
+
+    ワーカーが親と同じ resource_tracker を使うよう、プールを作る前に起動しておく
+    (起動していないと、ワーカーごとに resource_tracker ができ、ワーカーの終了時に共有メモリが消される)。
+
+    Args:
+        paths (Sequence[str]): 入力ファイル
+        pattern (str): ファイルパターン
+        budget_bytes (int): 同時に処理するファイルの見積もりの合計の上限
+        workers (Optional[int]): ワーカー数
+        **kwargs: scheduler.run_scheduled の残りの引数 (model / history)
+
+    Returns:
+        Tuple[List[Optional[ShmResult]], List[Dict]]: 入力順の記述子と、ファイルごとの報告
+    """
+    resource_tracker.ensure_running()
+    return scheduler.run_scheduled(paths, pattern, budget_bytes, workers,
+                                   process=process_file_shared, **kwargs)
+
+
+def process_file_shared(path: str, pattern: str) -> Optional[ShmResult]:
+    """
+    1ファイルを処理して結果を共有メモリに置く (ワーカーで実行する)
+    """
+    import main
+    return to_shared(main.process_file(path, pattern))
+
+
+# =====================================================================
+# pickle との比較
+# =====================================================================
+def make_processed_frame(rows: int, seed: int = 0) -> pd.DataFrame:
+    """
+    main.py の出力と同じカラム構成のデータ
+    """
+    rng = np.random.default_rng(seed)
+    frame = {'Unit': np.arange(rows) // 4}
+    frame.update({f'fbc{x}': rng.integers(0, 1000, rows) for x in 'ABCDEFG'})
+    frame.update({'WECyc': 3000, 'DR': 0, 'BlockID': 38, 'uid': '65941710_72013617_20406727_43122179',
+                  'FBC': rng.integers(0, 3000, rows), 'Page': 'Lower',
+                  'String': np.arange(rows) % 4, 'WL': np.arange(rows) // 16})
+    return pd.DataFrame(frame)
+
+
+def _bench_pickle(rows: int) -> pd.DataFrame:
+    return make_processed_frame(rows)
+
+
+def _bench_shared(rows: int) -> ShmResult:
+    return to_shared(make_processed_frame(rows))
+
+
+def benchmark(rows: int, repeat: int = 3, out_dir: Union[str, Path] = '.') -> Dict[str, float]:
+    """
+    ワーカーから親への受け渡しと出力までの時間を pickle と共有メモリで比べる
+
+    どちらも同じワーカーで同じデータを作り、親で Parquet に書き終わるまでを測る。
+
+    Args:
+        rows (int): 結果の行数
+        repeat (int): 繰り返し回数 (最小値を取る)
+        out_dir (Union[str, Path]): 出力ファイルの置き場所
+
+    Returns:
+        Dict[str, float]: 方式 -> 秒
+    """
+    out = Path(out_dir)
+    timings = {'pickle': [], 'shared_memory': []}
+    resource_tracker.ensure_running()
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        pool.submit(_bench_pickle, 1).result()  # ワーカーの起動を測定から外す
+        for _ in range(repeat):
+            start = time.perf_counter()
+            df = pool.submit(_bench_pickle, rows).result()
+            with TableSink(out / 'bench_pickle.parquet') as sink:
+                sink.write(pa.Table.from_pandas(df, preserve_index=False))
+            timings['pickle'].append(time.perf_counter() - start)
+            del df
+
+            start = time.perf_counter()
+            result = pool.submit(_bench_shared, rows).result()
+            stream_to_sink([result], out / 'bench_shared.parquet')
+            timings['shared_memory'].append(time.perf_counter() - start)
+    for name in ('bench_pickle.parquet', 'bench_shared.parquet'):
+        (out / name).unlink(missing_ok=True)
+    return {k: min(v) for k, v in timings.items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='ワーカーからの結果の受け渡しを pickle と共有メモリで比べる')
+    parser.add_argument('--rows', type=int, nargs='+', default=[100_000, 1_000_000, 5_000_000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'rows':>10}{'pickle s':>12}{'shm s':>12}{'speedup':>10}")
+    for rows in args.rows:
+        t = benchmark(rows, args.repeat)
+        print(f"{rows:>10}{t['pickle']:>12.3f}{t['shared_memory']:>12.3f}{t['pickle'] / t['shared_memory']:>10.2f}")
@@ -0,0 +1,184 @@
+"""
+TLC / QLC の変換の PySpark 版 (Glue へ持っていくための実装)
+
+main.py の DataProcessor と同じステップを Spark の DataFrame の式で書く。
+ローカルでは local[*] で動かし、pandas 版 (main.process_file) の出力と一致することをテストで確かめる。
+
+ステップと Spark での書き方:
+    1-2  WECyc / DR: input_file_name() のファイル名 (WECyc_DR.csv) から取る
+    3-4  BlockID / uid: ファイルごとにドライバーで乱数を振り、ブロードキャスト結合で配る
+    5    seg 合算: (ファイル, Unit, shiftIndex) の groupBy で fbcX を sum
+         (shiftX は (Unit, shiftIndex) の中で一定なので、pandas の first の代わりに決定的な min を使う)
+    7    |shiftX| が最小の fbcX: (|shiftX|, X の順番, fbcX) の struct の配列の array_min
+         (同じ距離なら A に近い方を選ぶ。numpy の argmin と同じ)
+    9    page: pandas 版と同じく全ての行が Lower になり、FBC は page の合計 (Lower = fbcD) で上書きされる
+    10   String: (ファイル, Unit) の中の shiftIndex 順の行番号 % 4
+    11   WL: Unit // 4
+
+対応するのは TLC だけ。QLC は pandas 版でもステップ5 の後に seg が残らず QLCProcessor が失敗する
+(一致させる相手が無い) ので、QLC のパターンは process_files とコマンドラインの引数の段階で
+ValueError / エラーとして断る。
+
+使い方:
+    python spark_engine.py --master 'local[*]' -o processed_spark/
+"""
+import argparse
+import glob
+import logging
+from functools import reduce
+from typing import Optional, Sequence
+
+import numpy as np
+import yaml
+from pyspark.sql import DataFrame, SparkSession, Window
+from pyspark.sql import functions as F
+
+# ログの設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+LETTERS = 'ABCDEFG'
+SHIFT_COLUMNS = [f'shift{x}' for x in LETTERS]
+FBC_COLUMNS = [f'fbc{x}' for x in LETTERS]
+
+# page -> 合計する fbcX (README のステップ9)
+PAGE_SUMS = {'Lower': ['fbcD'], 'Middle': ['fbcA', 'fbcC', 'fbcF'], 'Upper': ['fbcB', 'fbcE', 'fbcG']}
+
+# 入力ファイルの列 (ファイル名は WECyc_DR.csv。圧縮されていても同じ)
+FILE_COLUMN = '_file'
+FILENAME_REGEX = r'(\d+)_(\d+)\.csv[^/]*$'
+
+# main.py の出力と同じ列の順序
+OUTPUT_COLUMNS = ['Unit'] + FBC_COLUMNS + ['WECyc', 'DR', 'BlockID', 'uid', 'FBC', 'Page', 'String', 'WL']
+
+
+def build_spark(master: str = 'local[*]', app_name: str = 'tlc_qlc') -> SparkSession:
+    """
+    SparkSession を作る (Glue では GlueContext の spark_session を使う)
+    """
+    return (SparkSession.builder.master(master).appName(app_name)
+            .config('spark.sql.shuffle.partitions', '8')
+            .getOrCreate())
+
+
+def read_inputs(spark: SparkSession, paths: Sequence[str]) -> DataFrame:
+    """
+    入力 CSV を読み、行ごとに元のファイル名を持たせる
+    """
+    return (spark.read.csv(list(paths), header=True, inferSchema=True)
+            .withColumn(FILE_COLUMN, F.input_file_name()))
+
+
+def device_ids(spark: SparkSession, df: DataFrame, seed: Optional[int] = None) -> DataFrame:
+    """
+    ファイルごとの BlockID と uid (ステップ3・4)
+
+    pandas 版と同じく実行ごとの乱数。ファイルの数は少ないのでドライバーで振る。
+    """
+    rng = np.random.RandomState(seed)
+    files = sorted(row[0] for row in df.select(FILE_COLUMN).distinct().collect())
+    rows = [(f, int(rng.randint(1, 49)), '_'.join(str(rng.randint(10000000, 99999999)) for _ in range(4)))
+            for f in files]
+    return spark.createDataFrame(rows, f'{FILE_COLUMN} string, BlockID long, uid string')
+
+
+def transform(spark: SparkSession, df: DataFrame, seed: Optional[int] = None) -> DataFrame:
+    """
+    TLC の変換 (main.TLCProcessor と同じステップ)
+
+    Args:
+        spark (SparkSession): セッション
+        df (DataFrame): read_inputs の結果
+        seed (Optional[int]): BlockID / uid の乱数のシード
+
+    Returns:
+        DataFrame: main.py と同じ列の処理済みデータ
+    """
+    # ステップ1・2: ファイル名から WECyc / DR
+    name = F.col(FILE_COLUMN)
+    df = (df.withColumn('WECyc', F.regexp_extract(name, FILENAME_REGEX, 1).cast('long'))
+            .withColumn('DR', F.regexp_extract(name, FILENAME_REGEX, 2).cast('long')))
+
+    # ステップ5: seg合算
+    keys = [FILE_COLUMN, 'Unit', 'shiftIndex']
+    df = df.groupBy(*keys).agg(
+        *[F.min(c).alias(c) for c in SHIFT_COLUMNS],
+        *[F.sum(c).alias(c) for c in FBC_COLUMNS],
+        F.first('WECyc').alias('WECyc'), F.first('DR').alias('DR'))
+
+    # ステップ3・4: ファイルごとの BlockID / uid
+    df = df.join(F.broadcast(device_ids(spark, df, seed)), on=FILE_COLUMN, how='left')
+
+    # ステップ7: |shiftX| が最小の fbcX
+    candidates = F.array(*[F.struct(F.abs(F.col(s)).alias('distance'), F.lit(i).alias('order'),
+                                     F.col(f).alias('fbc'))
+                           for i, (s, f) in enumerate(zip(SHIFT_COLUMNS, FBC_COLUMNS))])
+    df = df.withColumn('FBC', F.array_min(candidates)['fbc'])
+
+    # ステップ9: page (pandas 版の np.select は条件が全て True なので全ての行が Lower)
+    page_sum = {page: reduce(lambda a, b: a + b, [F.col(c) for c in columns]) for page, columns in PAGE_SUMS.items()}
+    df = df.withColumn('Page', F.lit('Lower'))
+    df = df.withColumn('FBC', F.when(F.col('Page') == 'Lower', page_sum['Lower'])
+                               .when(F.col('Page') == 'Middle', page_sum['Middle'])
+                               .when(F.col('Page') == 'Upper', page_sum['Upper'])
+                               .otherwise(F.lit(0)))
+
+    # ステップ10・11: String / WL
+    within_unit = Window.partitionBy(FILE_COLUMN, 'Unit').orderBy('shiftIndex')
+    df = (df.withColumn('String', ((F.row_number().over(within_unit) - 1) % 4).cast('long'))
+            .withColumn('WL', F.floor(F.col('Unit') / 4).cast('long')))
+
+    return df.orderBy(FILE_COLUMN, 'Unit', 'shiftIndex').select(*OUTPUT_COLUMNS)
+
+
+def check_pattern(pattern: str) -> None:
+    """
+    Spark 版で処理できるパターンか確かめる (TLC だけ)
+
+    Raises:
+        ValueError: QLC か、TLC / QLC のどちらでもないパターン
+    """
+    if 'QLC' in pattern:
+        raise ValueError(f"QLC is not supported by the Spark engine (only TLC): {pattern}")
+    if 'TLC' not in pattern:
+        raise ValueError(f"Unknown file pattern: {pattern}")
+
+
+def process_files(spark: SparkSession, paths: Sequence[str], pattern: str,
+                  seed: Optional[int] = None) -> DataFrame:
+    """
+    ファイルをまとめて処理する (main.process_all_files の Spark 版)
+
+    Args:
+        spark (SparkSession): セッション
+        paths (Sequence[str]): 入力ファイル
+        pattern (str): ファイルパターン (TLC / QLC の判定に使う)
+        seed (Optional[int]): BlockID / uid の乱数のシード
+
+    Returns:
+        DataFrame: 処理済みデータ
+
+    Raises:
+        ValueError: TLC 以外のパターン (check_pattern)
+    """
+    check_pattern(pattern)
+    return transform(spark, read_inputs(spark, paths), seed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='TLC / QLC の変換を PySpark で実行する')
+    parser.add_argument('--config', default='config.yaml', help='設定ファイル')
+    parser.add_argument('--master', default='local[*]', help='Spark の master')
+    parser.add_argument('-o', '--output', required=True, help='出力ディレクトリ (Parquet)')
+    args = parser.parse_args()
+
+    with open(args.config) as file:
+        config = yaml.safe_load(file)
+    pattern = config['file_pattern']
+    try:
+        check_pattern(pattern)
+    except ValueError as e:
+        parser.error(str(e))
+    spark = build_spark(args.master)
+    result = process_files(spark, glob.glob(pattern, recursive=True), pattern)
+    result.write.mode('overwrite').parquet(args.output)
+    spark.stop()
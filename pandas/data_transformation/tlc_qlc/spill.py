@@ -0,0 +1,237 @@
+"""
+メモリの予算を超えるファイルをディスクに逃がして処理する (spill-to-disk)
+
+ステップ5 の seg 合算と最後の pd.concat は全てメモリ上で行うので、大きな QLC のファイルは
+ワーカーのメモリを超えて OOM killer に落とされる。
+
+- 1ファイルの作業領域を scheduler.MemoryModel で見積もり、予算に収まればそのまま処理する
+- 収まらなければ、入力をチャンクで読んで Unit のハッシュでパーティションに分け、
+  ローカルディスクの一時 Arrow ファイルに書き出す。パーティションを1つずつ読んで処理する
+  (ステップ5・10 は Unit ごとの処理なので、同じ Unit の行が1つのパーティションにそろえば結果は同じ)
+- BlockID と uid はファイルごとに1回だけ振り、全てのパーティションで共有する
+- 結果は pd.concat せずに出力へ順に追記する
+- パーティションの結果はいったん一時 Arrow ファイルに書き、ファイルの全てのパーティションが
+  終わってから返す (途中で失敗したファイルの一部の行が出力に残らない)
+
+遅くはなるが、大きな入力でも落ちずに最後まで処理できる。
+出力の行の順序は、パーティション内では Unit 順、パーティション間では Unit のハッシュ順になる。
+
+使い方:
+    python spill.py --budget-mb 2048 -o processed.csv
+"""
+import argparse
+import glob
+import logging
+import math
+import os
+import tempfile
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+import compressed
+import main
+import scheduler
+
+# ログの設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# 入力を読むチャンクの行数
+CHUNK_ROWS = 1_000_000
+
+# Unit のハッシュの偏りに備えてパーティション数に掛ける倍率
+SKEW_FACTOR = 1.25
+
+
+class SpillingProcessor:
+    def __init__(self, budget_bytes: int, tmp_dir: Optional[Union[str, Path]] = None,
+                 model: Optional[scheduler.MemoryModel] = None, chunk_rows: int = CHUNK_ROWS) -> None:
+        """
+        SpillingProcessorクラスの初期化
+
+        Args:
+            budget_bytes (int): 1ファイルの処理に使ってよいメモリ
+            tmp_dir (Optional[Union[str, Path]]): パーティションを書き出すローカルディスク (既定: システムの一時ディレクトリ)
+            model (Optional[scheduler.MemoryModel]): 作業領域の見積もり (既定: scheduler の既定値)
+            chunk_rows (int): 入力を読むチャンクの行数
+        """
+        self.budget_bytes = budget_bytes
+        self.tmp_dir = tmp_dir
+        self.model = model or scheduler.MemoryModel()
+        self.chunk_rows = chunk_rows
+
+    def partitions_for(self, size: int, cell: str) -> int:
+        """
+        予算に収めるためのパーティション数 (1 ならディスクに逃がさない)
+
+        Args:
+            size (int): ファイルサイズ
+            cell (str): セル種別
+
+        Returns:
+            int: パーティション数
+        """
+        predicted = self.model.predict(size, cell)
+        if predicted <= self.budget_bytes:
+            return 1
+        # 基礎の分 (インタプリタ + pandas) はパーティションに分けても減らない
+        base = self.model.predict(0, cell)
+        if base >= self.budget_bytes:
+            raise MemoryError(f"Memory budget {self.budget_bytes >> 20} MB is below the base {base >> 20} MB")
+        return max(2, math.ceil((predicted - base) * SKEW_FACTOR / (self.budget_bytes - base)))
+
+    def spill(self, filepath: str, directory: Union[str, Path], partitions: int) -> List[Path]:
+        """
+        入力をチャンクで読み、Unit のハッシュでパーティションの Arrow ファイルに書き出す
+
+        Args:
+            filepath (str): 入力ファイル
+            directory (Union[str, Path]): 書き出し先
+            partitions (int): パーティション数
+
+        Returns:
+            List[Path]: 行のあるパーティションのファイル
+        """
+        directory = Path(directory)
+        writers = {}
+        schema = None
+        try:
+            with compressed.open_input(filepath) as stream:
+                for chunk in pd.read_csv(stream, chunksize=self.chunk_rows):
+                    table = pa.Table.from_pandas(chunk, preserve_index=False)
+                    # 後のチャンクで型の推定が変わっても、最初のチャンクの型にそろえる
+                    schema = schema or table.schema
+                    table = table.cast(schema)
+                    # 型をそろえた後の Unit でハッシュする (チャンクで型の推定が違っても同じパーティションに入る)
+                    part = pd.util.hash_array(table.column('Unit').to_numpy()) % np.uint64(partitions)
+                    for p in np.unique(part):
+                        if p not in writers:
+                            writers[p] = pa.ipc.new_file(directory / f'unit-{p:04d}.arrow', schema)
+                        writers[p].write_table(table.filter(pa.array(part == p)))
+        finally:
+            for writer in writers.values():
+                writer.close()
+        return [directory / f'unit-{p:04d}.arrow' for p in sorted(writers)]
+
+    def iter_file(self, filepath: str, pattern: str) -> Iterator[pd.DataFrame]:
+        """
+        1ファイルを処理する (予算に収まらなければパーティションごとに結果を返す)
+
+        Args:
+            filepath (str): 入力ファイル
+            pattern (str): ファイルパターン (TLC / QLC の判定に使う)
+
+        Yields:
+            pd.DataFrame: 処理後のデータフレーム (1つ、またはパーティションごと)
+        """
+        if not compressed.is_csv_input(filepath):
+            return
+        processor_class = main.get_processor_class(pattern)
+        if processor_class is None:
+            logging.error(f"Unknown file pattern: {pattern}")
+            return
+        # 圧縮した入力は伸長後のサイズで見積もる
+        partitions = self.partitions_for(compressed.uncompressed_size(filepath), scheduler.cell_type(filepath, pattern))
+        if partitions == 1:
+            yield main.process_file(filepath, pattern)
+            return
+
+        logging.info(f"Spilling {filepath} into {partitions} partitions")
+        filename = compressed.csv_name(filepath)
+        shared = None
+        with tempfile.TemporaryDirectory(prefix='tlc_qlc-spill-', dir=self.tmp_dir) as tmp:
+            # 処理済みのパーティションは1つのレコードバッチずつ書き、最後まで成功してから返す
+            processed = Path(tmp) / 'processed.arrow'
+            writer, schema = None, None
+            try:
+                for path in self.spill(filepath, tmp, partitions):
+                    df = pa.ipc.open_file(path).read_all().to_pandas()
+                    os.remove(path)
+                    df = processor_class(df, filename).process()
+                    # BlockID と uid はファイルで1つ (最初のパーティションで振った値を使う)
+                    if shared is None:
+                        shared = {c: df[c].iloc[0] for c in ('BlockID', 'uid')}
+                    else:
+                        df = df.assign(**shared)
+                    table = pa.Table.from_pandas(df, preserve_index=False)
+                    if writer is None:
+                        schema = table.schema
+                        writer = pa.ipc.new_file(processed, schema)
+                    writer.write_table(table.cast(schema))
+                    logging.info(f"Processed partition {path.name} of {filepath}: {len(df)} rows")
+            finally:
+                if writer is not None:
+                    writer.close()
+            if writer is None:
+                return
+            reader = pa.ipc.open_file(processed)
+            for i in range(reader.num_record_batches):
+                yield reader.get_batch(i).to_pandas()
+
+    def iter_files(self, paths: Sequence[str], pattern: str) -> Iterator[pd.DataFrame]:
+        """
+        ファイルを順に処理する (失敗したファイルはログに残して飛ばす)
+
+        iter_file はファイルの全てのパーティションが成功してから結果を返すので、
+        失敗したファイルの行は1行も出力に入らない。
+        """
+        for filepath in paths:
+            try:
+                yield from self.iter_file(filepath, pattern)
+            except Exception as e:
+                logging.error(f"Error processing file {filepath}: {e}")
+
+
+def write_frames(frames: Iterable[pd.DataFrame], output: Union[str, Path]) -> int:
+    """
+    結果を CSV に順に追記する (全体を pd.concat しない)
+
+    Args:
+        frames (Iterable[pd.DataFrame]): 処理後のデータフレーム
+        output (Union[str, Path]): 出力 CSV
+
+    Returns:
+        int: 書いた行数
+    """
+    rows = 0
+    columns = None
+    tmp = f'{output}.{os.getpid()}.tmp'
+    try:
+        for df in frames:
+            if df is None:
+                continue
+            if columns is None:
+                columns = list(df.columns)
+            df[columns].to_csv(tmp, mode='a', header=rows == 0, index=False)
+            rows += len(df)
+        if rows:
+            os.replace(tmp, output)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return rows
+
+
+if __name__ == "__main__":
+    # yaml はスクリプトとして実行するときだけ使う (cli から import したときは読まない)
+    import yaml
+
+    parser = argparse.ArgumentParser(description='メモリの予算を超えるファイルをディスクに逃がして処理する')
+    parser.add_argument('--config', default='config.yaml', help='設定ファイル')
+    parser.add_argument('--budget-mb', type=int, help='1ファイルの処理に使ってよいメモリ (既定: config の memory_budget_mb)')
+    parser.add_argument('--spill-dir', help='パーティションを書き出すローカルディスク')
+    parser.add_argument('-o', '--output', help='出力 CSV (既定: config の output_file)')
+    args = parser.parse_args()
+
+    with open(args.config) as file:
+        config = yaml.safe_load(file)
+    budget_mb = args.budget_mb or config.get('memory_budget_mb')
+    if not budget_mb:
+        parser.error('--budget-mb or memory_budget_mb in the config is required')
+    runner = SpillingProcessor(budget_mb << 20, args.spill_dir)
+    pattern = config['file_pattern']
+    write_frames(runner.iter_files(glob.glob(pattern, recursive=True), pattern),
+                 args.output or config['output_file'])
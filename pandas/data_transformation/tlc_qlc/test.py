@@ -0,0 +1,1552 @@
+import pytest
+import pandas as pd
+import pyarrow as pa
+
+# =====================================================================
+# (A) DuckDB クエリ層 (query.py)
+# =====================================================================
+from query import QueryEngine, run_query
+
+
+@pytest.fixture
+def processed_csv(tmp_path):
+    """
+    main.py の出力 (processed.csv) を模したファイル
+    """
+    df = pd.DataFrame({
+        'Unit':    [0, 0, 0, 1, 1, 1],
+        'Page':    ['Lower', 'Middle', 'Upper'] * 2,
+        'FBC':     [33, 1126, 70, 40, 900, 65],
+        'WECyc':   [3000, 3000, 3000, 10000, 10000, 10000],
+        'DR':      [0, 0, 0, 3, 3, 3],
+        'BlockID': [38, 38, 38, 12, 12, 12],
+        'uid':     ['65941710_72013617_20406727_43122179'] * 6,
+    })
+    path = tmp_path / 'processed.csv'
+    df.to_csv(path, index=False)
+    return path
+
+
+def test_run_query_csv(processed_csv):
+    """
+    CSV をビューとして登録し pandas で結果を受け取る
+    """
+    df = run_query("SELECT Page, sum(FBC) AS FBC FROM processed GROUP BY Page ORDER BY Page",
+                   str(processed_csv))
+    assert df['Page'].tolist() == ['Lower', 'Middle', 'Upper']
+    assert df['FBC'].tolist() == [73, 2026, 135]
+
+
+def test_query_partitioned_parquet(processed_csv, tmp_path):
+    """
+    Parquet パーティションに変換後、WECyc で絞り込んだ結果を Arrow で受け取る
+    """
+    dest = tmp_path / 'lake'
+    with QueryEngine() as engine:
+        engine.export_partitioned(str(processed_csv), str(dest))
+    assert (dest / 'WECyc=3000' / 'DR=0').is_dir()
+
+    with QueryEngine({'processed': str(dest)}) as engine:
+        table = engine.query("SELECT FBC FROM processed WHERE WECyc = 10000 ORDER BY FBC",
+                             output='arrow')
+    assert isinstance(table, pa.Table)
+    assert table.column('FBC').to_pylist() == [40, 65, 900]
+
+
+# =====================================================================
+# (B) 再現性のある集計 (reduction.py)
+# =====================================================================
+import math
+from pathlib import Path
+
+import numpy as np
+
+from reduction import block_sum, grouped_block_sum, deterministic_groupby_sum
+
+# リポジトリ同梱のサンプル入力
+SAMPLE_CSV = Path(__file__).resolve().parent.parent / '3000_0.csv'
+
+
+@pytest.mark.parametrize("compensated", [False, True])
+def test_block_sum_independent_of_workers(compensated):
+    """
+    ワーカー数を変えても総和のビット列が変わらない
+    """
+    values = np.random.default_rng(1).gamma(2.0, 150.0, 100_003)
+    results = {block_sum(values, block_size=1000, workers=w, compensated=compensated)
+               for w in (1, 2, 3, 8)}
+    assert len(results) == 1
+
+
+def test_block_sum_compensated_matches_fsum():
+    """
+    補正付き総和は math.fsum (厳密な丸め) と一致する
+    """
+    data = np.concatenate(([1e8], np.full(255, 1e-8), np.random.default_rng(2).normal(0, 1e3, 10_000)))
+    assert block_sum(data, block_size=64, compensated=True) == math.fsum(data)
+
+
+def test_grouped_block_sum_independent_of_workers():
+    """
+    グループ別総和もワーカー数によらず一致し、補正付きは fsum に一致する
+    """
+    rng = np.random.default_rng(3)
+    codes = rng.integers(0, 50, 20_000)
+    values = rng.normal(0, 1e6, 20_000)
+    plain = [grouped_block_sum(codes, values, 50, block_size=777, workers=w) for w in (1, 4)]
+    assert plain[0].tobytes() == plain[1].tobytes()
+    comp = grouped_block_sum(codes, values, 50, block_size=777, workers=4, compensated=True)
+    assert comp.tolist() == [math.fsum(values[codes == g]) for g in range(50)]
+
+
+def test_deterministic_groupby_sum_seg():
+    """
+    seg 合算 (Unit, shiftIndex) が pandas の groupby().sum() と一致する
+    """
+    df = pd.read_csv(SAMPLE_CSV)
+    got = deterministic_groupby_sum(df, ['Unit', 'shiftIndex'], ['fbcA', 'fbcD'], block_size=7, workers=3)
+    expected = df.groupby(['Unit', 'shiftIndex'])[['fbcA', 'fbcD']].sum().reset_index()
+    pd.testing.assert_frame_equal(got, expected)
+
+
+def test_deterministic_groupby_sum_drops_missing_keys_and_keeps_integers_exact():
+    """
+    キーが欠損した行は pandas と同じく除き、float64 では表せない大きな整数も厳密に足す
+    """
+    big = 2 ** 53
+    df = pd.DataFrame({'Unit': [1.0, 1.0, np.nan, 2.0],
+                       'fbc': np.array([big, 1, 5, 3], dtype=np.int64),
+                       'rate': [0.5, 0.25, 9.0, 1.0]})
+    got = deterministic_groupby_sum(df, ['Unit'], ['fbc', 'rate'], workers=2)
+    expected = df.groupby(['Unit'])[['fbc', 'rate']].sum().reset_index()
+    pd.testing.assert_frame_equal(got, expected)
+    assert got['fbc'].iloc[0] == big + 1
+
+
+# =====================================================================
+# (C) 起動の速い CLI (cli.py)
+# =====================================================================
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import threading
+
+import cli
+
+
+@pytest.fixture
+def tlc_tree(tmp_path):
+    """
+    *TLC*/**/*.csv の入力と設定ファイル
+    """
+    data = tmp_path / 'WE_TLC' / 'lot1'
+    data.mkdir(parents=True)
+    (data / '3000_0.csv').write_bytes(SAMPLE_CSV.read_bytes())
+    config = tmp_path / 'config.yaml'
+    config.write_text(f"file_pattern: '{tmp_path}/*TLC*/**/*.csv'\noutput_file: '{tmp_path}/processed.csv'\n")
+    return tmp_path
+
+
+def test_cli_import_defers_heavy_modules():
+    """
+    cli を import しただけでは pandas / numpy / yaml / duckdb を読まない
+    """
+    code = ("import sys, cli; "
+            "print([m for m in ('pandas', 'numpy', 'yaml', 'duckdb', 'polars') if m in sys.modules])")
+    out = subprocess.run([sys.executable, '-c', code], cwd=Path(cli.__file__).parent,
+                         capture_output=True, text=True, check=True).stdout
+    assert out.strip() == '[]'
+
+
+def test_import_pipeline_does_not_import_yaml():
+    """
+    処理本体を読んでも yaml は読まない (設定はキャッシュから読めば yaml は要らない)
+    """
+    code = "import sys, cli; cli.import_pipeline(); print('yaml' in sys.modules)"
+    out = subprocess.run([sys.executable, '-c', code], cwd=Path(cli.__file__).parent,
+                         capture_output=True, text=True, check=True).stdout
+    assert out.strip() == 'False'
+
+
+def test_load_config_uses_cache(tlc_tree, monkeypatch):
+    """
+    2回目以降は yaml を使わずキャッシュから読み、設定ファイルが変われば読み直す
+    """
+    config = tlc_tree / 'config.yaml'
+    first = cli.load_config(str(config))
+    assert (tlc_tree / '.config.yaml.json').exists()
+
+    def no_yaml(name):
+        raise AssertionError(f"unexpected import of {name}")
+    monkeypatch.setattr(cli, 'lazy_import', no_yaml)
+    assert cli.load_config(str(config)) == first
+
+    monkeypatch.undo()
+    config.write_text("file_pattern: '*QLC*/**/*.csv'\noutput_file: 'other.csv'\n")
+    assert cli.load_config(str(config))['output_file'] == 'other.csv'
+
+
+def test_cli_process_single_file(tlc_tree, capsys):
+    """
+    process サブコマンドで1ファイルを処理し、import 時間の内訳を出す
+    """
+    out = tlc_tree / 'single.csv'
+    code = cli.run_cli(['--config', str(tlc_tree / 'config.yaml'), '--import-times', 'process',
+                        str(tlc_tree / 'WE_TLC' / 'lot1' / '3000_0.csv'), '-o', str(out)])
+    assert code == 0
+    df = pd.read_csv(out)
+    assert len(df) == 15
+    assert {'WECyc', 'DR', 'FBC', 'Page', 'String', 'WL'} <= set(df.columns)
+    assert (df['WECyc'] == 3000).all()
+    assert 'total' in capsys.readouterr().err
+
+
+def test_cli_run_workers_without_results(tmp_path, caplog):
+    """
+    --workers で処理できたファイルが無ければ 1 を返す (空の pd.concat で落ちない)
+    """
+    config = tmp_path / 'config.yaml'
+    config.write_text(f"file_pattern: '{tmp_path}/*TLC*/**/*.csv'\noutput_file: '{tmp_path}/processed.csv'\n")
+    assert cli.run_cli(['--config', str(config), 'run', '--workers', '1', '--no-sketches']) == 1
+    assert "No files were processed" in caplog.text
+    assert not (tmp_path / 'processed.csv').exists()
+
+
+def test_cli_run_without_workers_or_results(tmp_path, caplog, capsys):
+    """
+    --workers 無しでも処理できたファイルが無ければ 1 を返し、--shm-handoff だけの指定は弾く
+    """
+    config = tmp_path / 'config.yaml'
+    config.write_text(f"file_pattern: '{tmp_path}/*TLC*/**/*.csv'\noutput_file: '{tmp_path}/processed.csv'\n")
+    assert cli.run_cli(['--config', str(config), 'run', '--no-sketches']) == 1
+    assert "No files were processed" in caplog.text
+    assert not (tmp_path / 'processed.csv').exists()
+    with pytest.raises(SystemExit) as exc:
+        cli.run_cli(['--config', str(config), 'run', '--shm-handoff'])
+    assert exc.value.code == 2
+    assert '--shm-handoff requires --workers' in capsys.readouterr().err
+
+
+# =====================================================================
+# (D) イベント駆動のハンドラ (handler.py)
+# =====================================================================
+import threading
+import time
+
+import handler
+from handler import DirectoryEventSource, WarmHandler
+
+
+def test_event_source_batches_close_events(tmp_path):
+    """
+    時間幅の中に届いたイベントは1回で受け取り、取り出したものは pending から消える
+    """
+    source = DirectoryEventSource(tmp_path / 'spool')
+    source.put({'path': 'a.csv'})
+    late = threading.Timer(0.1, source.put, args=({'path': 'b.csv'},))
+    late.start()
+    claimed = source.receive(window=0.5)
+    late.join()
+    assert [source.load(p)['path'] for p in claimed] == ['a.csv', 'b.csv']
+    assert list(source.pending.iterdir()) == []
+    assert source.receive(timeout=0.1) == []
+
+
+def test_warm_handler_serves_batches(tlc_tree):
+    """
+    設定は1回だけ読み、まとめたイベントを1つの出力にし、失敗したイベントは failed/ に移す
+    """
+    calls = []
+
+    def process(path):
+        calls.append(path)
+        if path.endswith('bad.csv'):
+            raise ValueError('broken file')
+        return pd.read_csv(path)
+
+    worker = WarmHandler(str(tlc_tree / 'config.yaml'), process=process, output_dir=tlc_tree / 'out')
+    source = DirectoryEventSource(tlc_tree / 'spool')
+    good = str(tlc_tree / 'WE_TLC' / 'lot1' / '3000_0.csv')
+    source.put({'path': good})
+    source.put({'Records': [{'s3': {'object': {'key': good}}}]})
+    source.put({'path': 'bad.csv'})
+
+    assert worker.serve(source, window=0.05, idle_timeout=0.1) == 1
+    assert worker.invocations == 1
+    assert len(calls) == 3
+    outputs = list((tlc_tree / 'out').glob('processed-*.csv'))
+    assert len(outputs) == 1
+    assert len(pd.read_csv(outputs[0])) == 2 * len(pd.read_csv(SAMPLE_CSV))
+    assert len(list(source.failed.iterdir())) == 1
+    assert list(source.processing.iterdir()) == []
+
+
+def test_serve_isolates_bad_events(tlc_tree):
+    """
+    読めないイベントは failed/ に移して続け、一部だけ失敗したイベントは失敗したパスだけ残し、
+    落ちたワーカーの取り出したイベントは起動時に戻す
+    """
+    def process(path):
+        if path.endswith('bad.csv'):
+            raise ValueError('broken file')
+        return pd.read_csv(path)
+
+    worker = WarmHandler(str(tlc_tree / 'config.yaml'), process=process, output_dir=tlc_tree / 'out')
+    source = DirectoryEventSource(tlc_tree / 'spool')
+    good = str(tlc_tree / 'WE_TLC' / 'lot1' / '3000_0.csv')
+    (source.pending / '00000000000000000000-broken.json').write_text('{not json')
+    source.put({'Records': [{'s3': {'object': {'key': good}}}, {'s3': {'object': {'key': 'bad.csv'}}}]})
+    stale = source.processing / '00000000000000000001-stale.json'
+    stale.write_text(json.dumps({'path': good}))
+    os.utime(stale, (time.time() - 2 * handler.STALE_AFTER,) * 2)
+
+    assert worker.serve(source, window=0.05, idle_timeout=0.1) == 1
+    outputs = list((tlc_tree / 'out').glob('processed-*.csv'))
+    assert len(pd.read_csv(outputs[0])) == 2 * len(pd.read_csv(SAMPLE_CSV))
+    failed = sorted(source.failed.iterdir())
+    assert failed[0].name == '00000000000000000000-broken.json'
+    assert [DirectoryEventSource.load(p) for p in failed[1:]] == [{'path': 'bad.csv'}]
+    assert list(source.processing.iterdir()) == [] and list(source.pending.iterdir()) == []
+
+
+def test_serve_heartbeats_long_batches_and_requeues_while_polling(tlc_tree):
+    """
+    処理中のイベントはハートビートで戻されず、serve の途中で止まったイベントは次のポーリングで戻す
+    """
+    source = DirectoryEventSource(tlc_tree / 'spool')
+    good = str(tlc_tree / 'WE_TLC' / 'lot1' / '3000_0.csv')
+    requeued = []
+
+    def process(path):
+        # 処理に掛かる間にハートビートが止まったイベントとして扱われないこと
+        time.sleep(0.5)
+        requeued.extend(source.requeue_stale(older_than=0.2))
+        return pd.read_csv(path)
+
+    worker = WarmHandler(str(tlc_tree / 'config.yaml'), process=process, output_dir=tlc_tree / 'out')
+    source.put({'path': good})
+    stale = source.processing / '00000000000000000001-stale.json'
+
+    def drop_stale():
+        # 1つ目のバッチが終わってイベント待ちになってから落ちたワーカーの残骸を置く
+        time.sleep(0.9)
+        stale.write_text(json.dumps({'path': good}))
+        os.utime(stale, (time.time() - 60,) * 2)
+
+    dropper = threading.Thread(target=drop_stale)
+    dropper.start()
+    batches = worker.serve(source, window=0.05, idle_timeout=1.5, heartbeat_interval=0.05)
+    dropper.join()
+
+    assert requeued == []
+    assert batches == 2 and worker.invocations == 2
+    assert list(source.processing.iterdir()) == [] and list(source.pending.iterdir()) == []
+    assert list(source.failed.iterdir()) == []
+
+
+def test_lambda_handler_keeps_handler_warm(tlc_tree, monkeypatch):
+    """
+    lambda_handler は初回に作ったハンドラを使い回す
+    """
+    monkeypatch.setattr(handler, '_HANDLER', None)
+    monkeypatch.setenv('TLC_QLC_CONFIG', str(tlc_tree / 'config.yaml'))
+    path = str(tlc_tree / 'WE_TLC' / 'lot1' / '3000_0.csv')
+    first = handler.lambda_handler({'path': path})
+    warm = handler._HANDLER
+    second = handler.lambda_handler({'path': path})
+    assert handler._HANDLER is warm and warm.invocations == 2
+    assert first['processed'] == second['processed'] == [path]
+    assert len(pd.read_csv(second['output'])) == 15
+
+
+# =====================================================================
+# (E) ディレクトリ監視の逐次取り込み (watch.py)
+# =====================================================================
+from watch import LOG_NAME, MANIFEST_NAME, StreamIngestor
+
+
+def _read_csv_process(path, pattern):
+    return pd.read_csv(path)
+
+
+def make_ingestor(root, **kwargs):
+    return StreamIngestor(root, root / 'out', process=_read_csv_process, settle=1.0,
+                          max_latency=2.0, use_inotify=False, **kwargs)
+
+
+def test_stream_waits_until_file_is_complete(tlc_tree):
+    """
+    サイズが変わっている間は取り込まず、settle 秒変わらなければ処理待ちにする
+    """
+    ingestor = make_ingestor(tlc_tree)
+    growing = tlc_tree / 'WE_TLC' / 'lot1' / '10000_3.csv'
+    growing.write_text(SAMPLE_CSV.read_text()[:200])
+    ingestor.scan(now=0.0)
+    with open(growing, 'a') as file:
+        file.write('more')
+    ingestor.scan(now=1.5)
+    assert str(growing) not in ingestor.ready
+    ingestor.scan(now=2.0)
+    assert str(growing) not in ingestor.ready
+    ingestor.scan(now=3.0)
+    assert str(growing) in ingestor.ready
+
+
+def test_stream_micro_batch_is_exactly_once(tlc_tree):
+    """
+    レイテンシの上限で1つのパートにまとめ、再起動しても同じファイルを2回出力しない
+    """
+    (tlc_tree / 'WE_QLC' / 'lot2').mkdir(parents=True)
+    (tlc_tree / 'WE_QLC' / 'lot2' / '3000_1.csv').write_bytes(SAMPLE_CSV.read_bytes())
+    ingestor = make_ingestor(tlc_tree)
+    assert ingestor.step(now=0.0) is None
+    assert ingestor.step(now=1.0) is None  # 完了は確認したがバッチはまだ待つ
+    part = ingestor.step(now=3.0)
+    assert part is not None and part.exists()
+    assert len(pd.read_parquet(part)) == 2 * len(pd.read_csv(SAMPLE_CSV))
+
+    restarted = make_ingestor(tlc_tree)
+    for now in (10.0, 11.0, 20.0):
+        assert restarted.step(now=now) is None
+    assert restarted.manifest.parts == [part.name] and len(restarted.manifest.files) == 2
+
+
+def test_stream_ignores_partial_uploads(tlc_tree):
+    """
+    x.csv.part / x.csv.tmp などの書きかけの一時ファイルは取り込まない
+    """
+    lot = tlc_tree / 'WE_TLC' / 'lot1'
+    for name in ('3000_1.csv.part', '3000_2.csv.tmp'):
+        (lot / name).write_bytes(SAMPLE_CSV.read_bytes())
+    ingestor = make_ingestor(tlc_tree)
+    ingestor.scan(now=0.0)
+    ingestor.scan(now=1.0)
+    assert list(ingestor.ready) == [str(lot / '3000_0.csv')]
+
+
+def test_stream_reprocesses_replaced_file(tlc_tree):
+    """
+    同じパスに置き直されたファイルはもう一度処理し、manifest は小さいまま記録を追記する
+    """
+    ingestor = make_ingestor(tlc_tree)
+    for now in (0.0, 1.0, 3.0):
+        first = ingestor.step(now=now)
+    assert first is not None
+
+    target = tlc_tree / 'WE_TLC' / 'lot1' / '3000_0.csv'
+    stat = target.stat()
+    target.write_bytes(SAMPLE_CSV.read_bytes())
+    os.utime(target, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    restarted = make_ingestor(tlc_tree)
+    for now in (10.0, 11.0, 13.0):
+        second = restarted.step(now=now)
+    assert second is not None and second != first
+    assert restarted.manifest.parts == [first.name, second.name]
+    assert restarted.manifest.files[str(target)]['part'] == 1
+    manifest = json.loads((tlc_tree / 'out' / MANIFEST_NAME).read_text())
+    assert sorted(manifest) == ['log_bytes', 'next_seq']
+
+
+def test_stream_recovers_interrupted_commit(tlc_tree):
+    """
+    コミット後に落ちたパートは完了させ、コミット前に落ちたパートは捨てる
+    """
+    out = tlc_tree / 'out'
+    ingestor = make_ingestor(tlc_tree)
+    ingestor.step(now=0.0)
+    ingestor.step(now=1.0)
+    part = ingestor.step(now=3.0)
+    # コミット済みのパートが一時名のまま残った状態と、コミット前の一時ファイルを作る
+    os.replace(part, out / f'.{part.name}.tmp')
+    (out / '.part-00000009.parquet.tmp').write_bytes(b'partial')
+
+    make_ingestor(tlc_tree)
+    assert part.exists()
+    assert sorted(p.name for p in out.iterdir()) == sorted([MANIFEST_NAME, LOG_NAME, part.name])
+
+
+# =====================================================================
+# (F) 逐次のウィンドウ集計 (windowed.py)
+# =====================================================================
+from windowed import WindowedAggregator
+
+
+def make_result(wecyc, dr, fbc, block_ids=(1, 2)):
+    """
+    処理済みの1ファイル分を模したデータ
+    """
+    return pd.DataFrame({'WECyc': wecyc, 'DR': dr, 'BlockID': list(block_ids) * (len(fbc) // len(block_ids)),
+                         'FBC': fbc})
+
+
+def test_sliding_window_over_last_dr_steps():
+    """
+    直近 N 個の DR だけを集計し、全件からの再計算と一致する
+    """
+    agg = WindowedAggregator('DR', 'BlockID', 'FBC', mode='sliding', size=2)
+    parts = [make_result(3000, dr, [dr * 10 + i for i in range(6)]) for dr in (0, 3, 6)]
+    for i, part in enumerate(parts):
+        assert agg.update(part, source=f'f{i}.csv')
+    assert not agg.update(parts[0], source='f0.csv')
+
+    got = agg.result()
+    expected = pd.concat(parts[1:]).groupby('BlockID')['FBC'].agg(['count', 'sum', 'mean', 'max', 'std'])
+    assert got['window_start'].tolist() == [3, 3] and got['window_end'].tolist() == [6, 6]
+    assert got['count'].tolist() == expected['count'].tolist()
+    for column in ('sum', 'mean', 'max', 'std'):
+        np.testing.assert_allclose(got[column], expected[column])
+
+
+def test_tumbling_window_checkpoint_restore(tmp_path):
+    """
+    WECyc ごとのウィンドウはチェックポイントから戻しても続きから集計できる
+    """
+    agg = WindowedAggregator('WECyc', 'BlockID', 'FBC', mode='tumbling')
+    agg.update(make_result(3000, 0, [1, 2, 3, 4]))
+    agg.checkpoint(tmp_path / 'windows.json')
+
+    restored = WindowedAggregator.restore(tmp_path / 'windows.json')
+    restored.update(make_result(3000, 3, [5, 6]))
+    restored.update(make_result(10000, 0, [7, 8]))
+    got = restored.result().set_index(['WECyc', 'BlockID'])
+    assert got.loc[(3000, 1), 'count'] == 3 and got.loc[(3000, 1), 'sum'] == 1 + 3 + 5
+    assert got.loc[(3000, 2), 'max'] == 6
+    assert got.loc[(10000, 2), 'mean'] == 8
+    assert len(got) == 4
+
+
+def test_window_forgets_sources_with_evicted_windows():
+    """
+    反映済みの入力はウィンドウと一緒に忘れ、チェックポイントが伸び続けない
+    """
+    agg = WindowedAggregator('DR', 'BlockID', 'FBC', mode='sliding', size=2)
+    for dr in range(10):
+        agg.update(make_result(3000, dr, [1, 2]), source=f'f{dr}.csv')
+    assert sorted(agg.sources) == ['f8.csv', 'f9.csv']
+    assert not agg.update(make_result(3000, 0, [1, 2]), source='f0.csv')
+    assert agg.result()['count'].tolist() == [2, 2]
+
+
+def test_tumbling_window_caps_sources(tmp_path):
+    """
+    ウィンドウを捨てない tumbling でも反映済みの入力は max_sources 個までで、チェックポイントにも残る
+    """
+    agg = WindowedAggregator('WECyc', 'BlockID', 'FBC', mode='tumbling', max_sources=3)
+    for i in range(10):
+        assert agg.update(make_result(3000, 0, [1, 2]), source=f'f{i}.csv')
+    assert list(agg.sources) == ['f7.csv', 'f8.csv', 'f9.csv']
+    assert not agg.update(make_result(3000, 0, [1, 2]), source='f9.csv')
+
+    agg.checkpoint(tmp_path / 'windows.json')
+    restored = WindowedAggregator.restore(tmp_path / 'windows.json')
+    assert restored.max_sources == 3 and list(restored.sources) == list(agg.sources)
+    restored.update(make_result(3000, 0, [1, 2]), source='f10.csv')
+    assert list(restored.sources) == ['f8.csv', 'f9.csv', 'f10.csv']
+    assert restored.result()['count'].tolist() == [11, 11]
+
+
+def test_stream_aggregator_counts_each_file_once_across_crash(tlc_tree, monkeypatch):
+    """
+    集計器はコミットより先にチェックポイントし、コミット前に落ちて再処理されても2回数えない
+    """
+    checkpoint = tlc_tree / 'windows.json'
+
+    def ingestor_with(aggregator):
+        return StreamIngestor(tlc_tree, tlc_tree / 'out', process=main.process_file,
+                              settle=1.0, max_latency=2.0, use_inotify=False,
+                              aggregator=aggregator, checkpoint=checkpoint)
+
+    ingestor = ingestor_with(WindowedAggregator('WECyc', 'BlockID', 'FBC', mode='tumbling'))
+
+    def crash(*args, **kwargs):
+        raise KeyboardInterrupt
+    monkeypatch.setattr(ingestor.manifest, 'commit', crash)
+    ingestor.step(now=0.0)
+    ingestor.step(now=1.0)
+    with pytest.raises(KeyboardInterrupt):
+        ingestor.step(now=3.0)
+
+    restarted = ingestor_with(WindowedAggregator.restore(checkpoint))
+    for now in (10.0, 11.0, 13.0):
+        restarted.step(now=now)
+    assert len(restarted.manifest.files) == 1
+    assert WindowedAggregator.restore(checkpoint).result()['count'].sum() == 15
+
+
+# =====================================================================
+# (G) 小さいファイルのコンパクション (compaction.py)
+# =====================================================================
+import pyarrow.parquet as pq
+
+import compaction
+
+
+@pytest.fixture
+def small_parts(tmp_path):
+    """
+    1つのパーティションに小さいパートが並んだデータレイク (古いパート 4 つ + 書き込み直後の 1 つ)
+    """
+    partition = tmp_path / 'lake' / 'WECyc=3000' / 'DR=0'
+    partition.mkdir(parents=True)
+    rng = np.random.default_rng(0)
+    old = time.time() - 600
+    for i in range(5):
+        table = pa.table({'BlockID': rng.integers(1, 49, 20), 'Unit': rng.integers(0, 448, 20),
+                          'Page': rng.choice(['Lower', 'Middle', 'Upper'], 20), 'FBC': rng.integers(0, 2000, 20)})
+        path = partition / f'part-{i}.parquet'
+        pq.write_table(table, path)
+        if i < 4:
+            os.utime(path, (old, old))
+    return partition
+
+
+def test_compaction_merges_and_sorts(small_parts):
+    """
+    古い小さいパートだけを1つにまとめて並べ替え、読む側の行数は変わらない
+    """
+    lake = str(small_parts.parent.parent)
+    before = run_query("SELECT count(*) AS n, sum(FBC) AS s FROM processed", lake)
+
+    outputs = compaction.compact_partition(small_parts)
+    assert len(outputs) == 1
+    live = [p.name for p in compaction.live_files(small_parts)]
+    assert live == [outputs[0].name, 'part-4.parquet']
+
+    merged = pq.read_table(outputs[0]).to_pandas()
+    assert len(merged) == 80
+    pd.testing.assert_frame_equal(merged, merged.sort_values(['BlockID', 'Unit', 'Page'], ignore_index=True))
+
+    after = run_query("SELECT count(*) AS n, sum(FBC) AS s, min(WECyc) AS w FROM processed", lake)
+    assert after['n'][0] == before['n'][0] == 100 and after['s'][0] == before['s'][0]
+    assert after['w'][0] == 3000
+
+
+def test_query_engine_follows_compaction(small_parts):
+    """
+    登録したままのエンジンも、クエリのたびにコンパクション後の有効なファイルを読む
+    """
+    lake = str(small_parts.parent.parent)
+    compaction._write_manifest(small_parts, {'pending': [], 'retired': {}})
+    with QueryEngine({'processed': lake}) as engine:
+        sql = "SELECT count(*) AS n FROM processed"
+        assert engine.query(sql)['n'][0] == 100
+        now = time.time()
+        compaction.compact_partition(small_parts, now=now)
+        compaction.purge_retired(small_parts, grace=0, now=now)
+        assert engine.query(sql)['n'][0] == 100
+        (small_parts / 'part-5.parquet').write_bytes((small_parts / 'part-4.parquet').read_bytes())
+        assert engine.query(sql)['n'][0] == 120
+
+
+def test_query_engine_empty_lake_and_vanished_file(small_parts, monkeypatch):
+    """
+    有効なファイルが無くなれば空のビューにし、一覧を取った後に消えたファイルは一覧を取り直して読む
+    """
+    lake = str(small_parts.parent.parent)
+    compaction._write_manifest(small_parts, {'pending': [], 'retired': {}})
+    with QueryEngine({'processed': lake}) as engine:
+        live = compaction.lake_live_files(lake)
+        calls = []
+
+        def stale_then_live(root):
+            calls.append(root)
+            return live + [small_parts / 'part-9.parquet'] if len(calls) == 1 else live
+        monkeypatch.setattr(compaction, 'lake_live_files', stale_then_live)
+        assert engine.query("SELECT count(*) AS n FROM processed")['n'][0] == 100
+        monkeypatch.undo()
+
+        names = {p.name: 0 for p in small_parts.glob('*.parquet')}
+        compaction._write_manifest(small_parts, {'pending': [], 'retired': names})
+        result = engine.query("SELECT count(*) AS n, sum(FBC) AS s FROM processed")
+        assert result['n'][0] == 0
+        assert 'FBC' in engine.query("SELECT * FROM processed").columns
+
+
+def test_compaction_recovers_and_purges(small_parts):
+    """
+    書きかけの出力は次回に消し、まとめた元ファイルは猶予を過ぎてから消す
+    """
+    (small_parts / 'compacted-dead-0000.parquet').write_bytes(b'partial')
+    compaction._write_manifest(small_parts, {'pending': ['compacted-dead-0000.parquet'], 'retired': {}})
+    assert 'compacted-dead-0000.parquet' not in [p.name for p in compaction.live_files(small_parts)]
+
+    now = time.time()
+    compaction.compact_partition(small_parts, now=now)
+    assert not (small_parts / 'compacted-dead-0000.parquet').exists()
+    assert compaction.purge_retired(small_parts, grace=60, now=now + 10) == []
+    purged = compaction.purge_retired(small_parts, grace=60, now=now + 120)
+    assert sorted(purged) == [f'part-{i}.parquet' for i in range(4)]
+    assert sorted(p.name for p in small_parts.glob('*.parquet')) == \
+        sorted(p.name for p in compaction.live_files(small_parts))
+
+
+def test_compaction_batches_and_keeps_listed_files_readable(small_parts):
+    """
+    目標サイズごとに組に分けてまとめ、コミットの前に取った有効なファイルの一覧も猶予の間は読める
+    """
+    listed = compaction.live_files(small_parts)
+    size = (small_parts / 'part-0.parquet').stat().st_size
+    outputs = compaction.compact_partition(small_parts, target_bytes=2 * size + 1)
+    assert len(outputs) == 2
+    assert [len(pq.read_table(p)) for p in outputs] == [40, 40]
+
+    # コミットの前の一覧 (元ファイル) も、コミットの後の一覧もそれぞれ 100 行
+    assert sum(len(pq.read_table(path)) for path in listed) == 100
+    assert sum(len(pq.read_table(path)) for path in compaction.live_files(small_parts)) == 100
+    assert list(small_parts.glob('.compacted-*.tmp')) == []
+
+
+# =====================================================================
+# (H) スタースキーマの DWH 読み込み (warehouse.py)
+# =====================================================================
+from warehouse import StarSchemaLoader
+
+
+def make_processed(wecyc, uid):
+    """
+    main.py の出力 (processed.csv) を模したデータ
+    """
+    return pd.DataFrame({
+        'Unit': [0, 0, 1, 1], 'FBC': [33, 1126, 70, 40], 'Page': ['Lower'] * 4,
+        'WECyc': wecyc, 'DR': 0, 'BlockID': 38, 'uid': uid,
+        'String': [0, 1, 2, 3], 'WL': [0, 0, 0, 0],
+    })
+
+
+@pytest.mark.parametrize('suffix', ['.duckdb', '.sqlite'])
+def test_star_schema_load(tmp_path, suffix):
+    """
+    サロゲートキーは読み込みを繰り返しても変わらず、結合すると元のデータに戻る
+    """
+    first = make_processed(3000, '65941710_72013617_20406727_43122179')
+    second = make_processed(10000, '65941710_72013617_20406727_43122179')
+    with StarSchemaLoader(tmp_path / f'dwh{suffix}') as loader:
+        assert loader.load(first) == {'dim_device': 1, 'dim_condition': 1, 'dim_address': 4, 'fact_fbc': 4}
+        assert loader.load(second) == {'dim_device': 0, 'dim_condition': 1, 'dim_address': 0, 'fact_fbc': 4}
+        conditions = loader._read('dim_condition')
+        assert conditions.sort_values('WECyc')['condition_id'].tolist() == [1, 2]
+
+        sql = ("SELECT d.uid, c.WECyc, a.String, f.FBC FROM fact_fbc f "
+               "JOIN dim_device d USING (device_id) JOIN dim_condition c USING (condition_id) "
+               "JOIN dim_address a USING (address_id) ORDER BY c.WECyc, a.String")
+        if loader.backend == 'duckdb':
+            joined = loader.con.execute(sql).df()
+            indexes = loader.con.execute("SELECT index_name FROM duckdb_indexes()").df()['index_name']
+        else:
+            joined = pd.read_sql_query(sql, loader.con)
+            indexes = pd.read_sql_query("SELECT name AS index_name FROM sqlite_master WHERE type = 'index'",
+                                        loader.con)['index_name']
+    expected = pd.concat([first, second])[['uid', 'WECyc', 'String', 'FBC']].reset_index(drop=True)
+    pd.testing.assert_frame_equal(joined, expected, check_dtype=False)
+    assert {'ix_fact_fbc_device_id', 'ux_dim_device_natural'} <= set(indexes)
+
+
+def test_star_schema_unsigned_and_null_keys(tmp_path):
+    """
+    uint64 は DuckDB では UBIGINT、SQLite では明示的に拒否し、自然キーの null も拒否する
+    """
+    big = make_processed(3000, 'x').assign(uid=np.uint64(1 << 63) + np.arange(4, dtype='uint64'))
+    with StarSchemaLoader(tmp_path / 'dwh.duckdb') as loader:
+        loader.load(big)
+        assert sorted(loader._read('dim_device')['uid']) == sorted(big['uid'])
+    with StarSchemaLoader(tmp_path / 'dwh.sqlite') as loader:
+        with pytest.raises(ValueError, match='unsigned 64-bit'):
+            loader.load(big)
+        with pytest.raises(ValueError, match=r"\['uid'\]"):
+            loader.load(make_processed(3000, None))
+
+
+def test_star_schema_keeps_fact_indexes(tmp_path):
+    """
+    ファクトのインデックスは最初の読み込みで作り、追加の読み込みでは作り直さない
+    """
+    with StarSchemaLoader(tmp_path / 'dwh.sqlite') as loader:
+        loader.load(make_processed(3000, 'a'))
+        sql = "SELECT name, rootpage FROM sqlite_master WHERE type = 'index' AND tbl_name = 'fact_fbc'"
+        before = sorted(loader.con.execute(sql).fetchall())
+        loader.load(make_processed(10000, 'b'))
+        assert sorted(loader.con.execute(sql).fetchall()) == before and len(before) == 3
+
+
+# =====================================================================
+# (I) 分位点と種類数のスケッチ (sketches.py)
+# =====================================================================
+from sketches import FbcSketches, HyperLogLog, TDigest, sketch_path
+
+
+def test_tdigest_merge_matches_exact_quantiles():
+    """
+    分割して作ったスケッチをマージしても、裾の分位点まで正確に近い
+    """
+    values = np.random.default_rng(0).lognormal(5, 1, 200_000).round()
+    merged = TDigest()
+    for chunk in np.array_split(values, 20):
+        merged.merge(TDigest().update(chunk))
+    assert merged.count == len(values)
+    for q in (0.5, 0.99, 0.999):
+        assert merged.quantile(q) == pytest.approx(np.quantile(values, q), rel=0.02)
+    assert merged.quantile(0) == values.min() and merged.quantile(1) == values.max()
+
+
+def test_hyperloglog_merge_is_idempotent():
+    """
+    重複やマージの順によらず同じ推定値になり、誤差は数 % に収まる
+    """
+    uids = np.array([f'{i:08d}_{i * 7:08d}' for i in range(50_000)], dtype=object)
+    a = HyperLogLog().update(uids[:30_000])
+    b = HyperLogLog().update(uids[20_000:])
+    merged = HyperLogLog().merge(a).merge(b).merge(a)
+    assert merged.count() == pytest.approx(50_000, rel=0.05)
+    assert HyperLogLog().update(uids).count() == merged.count()
+    assert HyperLogLog().update(['x', 'y', 'x']).count() == pytest.approx(2, abs=0.01)
+
+
+def test_cli_writes_mergeable_sketches(tlc_tree):
+    """
+    CLI は出力の隣にスケッチを書き、実行をまたいでマージして切り口ごとに問い合わせられる
+    """
+    config = str(tlc_tree / 'config.yaml')
+    sample = str(tlc_tree / 'WE_TLC' / 'lot1' / '3000_0.csv')
+    outputs = [tlc_tree / f'run{i}.csv' for i in range(2)]
+    for output in outputs:
+        assert cli.run_cli(['--config', config, 'process', sample, '-o', str(output)]) == 0
+
+    merged = FbcSketches.load_many([sketch_path(output) for output in outputs])
+    rows = pd.concat([pd.read_csv(output) for output in outputs])
+    lower = rows[(rows['Page'] == 'Lower') & (rows['WECyc'] == 3000)]
+    got = merged.quantiles([0.5], where={'Page': 'Lower', 'WECyc': 3000})
+    assert got[0.5] == pytest.approx(lower['FBC'].median(), rel=0.1)
+    assert merged.distinct_count() == pytest.approx(rows['uid'].nunique(), abs=0.01)
+    assert math.isnan(merged.quantiles([0.5], where={'WECyc': 999})[0.5])
+
+
+def test_sketches_save_keeps_previous_file_on_failure(tmp_path, monkeypatch):
+    """
+    保存の途中で落ちても前に保存したスケッチは壊れない
+    """
+    path = sketch_path(tmp_path / 'processed.csv')
+    sketches = FbcSketches().update(shm_handoff.make_processed_frame(100))
+    sketches.save(path)
+    before = path.read_bytes()
+
+    def broken(obj, file):
+        file.write('{"keys": ')
+        raise OSError('disk full')
+    monkeypatch.setattr(json, 'dump', broken)
+    with pytest.raises(OSError):
+        sketches.update(shm_handoff.make_processed_frame(100, seed=1)).save(path)
+    assert path.read_bytes() == before
+    assert FbcSketches.load(path).distinct_count() == pytest.approx(1, abs=0.01)
+
+
+# =====================================================================
+# (J) uid の仮名化 (pseudonymize.py)
+# =====================================================================
+import pseudonymize
+
+TEST_KEY = bytes(range(32))
+
+
+def test_tokenize_hashes_each_uid_once(monkeypatch):
+    """
+    異なる uid ごとに1回だけハッシュし、同じ uid には同じトークンを配る
+    """
+    calls = []
+    real = pseudonymize.hash_unique
+    monkeypatch.setattr(pseudonymize, 'hash_unique', lambda v, *a: calls.append(len(v)) or real(v, *a))
+    uids = pd.Series(['a_1', 'b_2', 'a_1', None] * 1000, name='uid')
+    tokens = pseudonymize.tokenize(uids, TEST_KEY)
+    assert calls == [2]
+    assert str(tokens.dtype) == 'Int64' and tokens.isna().sum() == 1000
+    assert tokens[0] == tokens[2] != tokens[1]
+    assert pseudonymize.tokenize(uids, bytes(32))[0] != tokens[0]
+
+
+def test_tokenize_fixed_width_binary():
+    """
+    binary 形式は固定長のバイナリで、同じ鍵なら実行をまたいで同じトークンになる
+    """
+    uids = pd.Series(['65941710_72013617_20406727_43122179'] * 3)
+    tokens = pseudonymize.tokenize(uids, TEST_KEY, token_format='binary', digest_size=16)
+    assert str(tokens.dtype) == 'fixed_size_binary[16][pyarrow]'
+    expected = hashlib.blake2b(uids[0].encode(), key=TEST_KEY, digest_size=16).digest()
+    assert tokens.tolist() == [expected] * 3
+
+
+@pytest.mark.parametrize('suffix', ['.duckdb', '.sqlite'])
+def test_pseudonymized_output_loads_into_warehouse(tmp_path, suffix):
+    """
+    トークンは 63 ビットなので、半分ほどのダイジェストが 2^63 以上でも DWH の INTEGER に入る
+    """
+    uids = [f'{i:08d}_72013617_20406727_43122179' for i in range(20)]
+    df = pd.concat([make_processed(3000, uid) for uid in uids], ignore_index=True)
+    masked = pseudonymize.pseudonymize(df, key=TEST_KEY)
+    assert masked['uid'].dtype == 'int64' and (masked['uid'] >= 0).all()
+    raw = pseudonymize.hash_unique(np.array(uids, dtype=object), TEST_KEY).copy().view('<u8').ravel()
+    assert (raw >= 1 << 63).any()
+    with StarSchemaLoader(tmp_path / f'dwh{suffix}') as loader:
+        assert loader.load(masked)['dim_device'] == 20
+        devices = loader._read('dim_device')
+    assert sorted(devices['uid']) == sorted(masked['uid'].unique())
+
+
+def test_cli_pseudonymize_uses_env_key(tlc_tree, monkeypatch):
+    """
+    CLI は環境変数の鍵で uid をトークンに置き換えて書く (鍵が無ければ失敗する)
+    """
+    args = ['--config', str(tlc_tree / 'config.yaml'), 'process', '--pseudonymize',
+            str(tlc_tree / 'WE_TLC' / 'lot1' / '3000_0.csv'), '-o', str(tlc_tree / 'masked.csv')]
+    monkeypatch.delenv(pseudonymize.KEY_ENV, raising=False)
+    with pytest.raises(KeyError):
+        cli.run_cli(args)
+    monkeypatch.setenv(pseudonymize.KEY_ENV, TEST_KEY.hex())
+    assert cli.run_cli(args) == 0
+    masked = pd.read_csv(tlc_tree / 'masked.csv')
+    assert masked['uid'].dtype == 'int64' and masked['uid'].nunique() == 1
+
+
+# =====================================================================
+# (K) メモリを見積もるスケジューラ (scheduler.py)
+# =====================================================================
+import scheduler
+from scheduler import FileTask, MemoryModel, next_task
+
+
+def test_memory_model_fits_history():
+    """
+    セル種別ごとに履歴から基礎と係数を求め、履歴の無い種別は既定値で見積もる
+    """
+    history = [{'cell': 'TLC', 'size': s, 'actual': 100 + 5 * s} for s in (10, 20, 40)]
+    model = MemoryModel.fit(history, safety=1.0)
+    assert model.predict(100, 'TLC') == pytest.approx(600, abs=1)
+    assert model.predict(100, 'QLC') == scheduler.DEFAULT_BASE_BYTES + scheduler.DEFAULT_SLOPE * 100
+
+
+def test_next_task_admits_largest_that_fits():
+    """
+    予算に収まる最も大きいものを選び、1つで予算を超えるものは何も動いていないときだけ投入する
+    """
+    pending = [FileTask(name, 'TLC', 0, predicted) for name, predicted in (('huge', 120), ('big', 60), ('small', 10))]
+    assert next_task(pending, in_flight=0, budget=100, running=0) == 1
+    assert next_task(pending, in_flight=60, budget=100, running=1) == 2
+    assert next_task(pending, in_flight=95, budget=100, running=2) is None
+    assert next_task(pending[:1], in_flight=0, budget=100, running=0) == 0
+    assert next_task(pending[:1], in_flight=10, budget=100, running=1) is None
+
+
+def test_run_scheduled_reports_predicted_and_actual(tlc_tree):
+    """
+    大きい順に処理し、入力順の結果とファイルごとの見積もり・実測を返して履歴に残す
+    """
+    lot = tlc_tree / 'WE_TLC' / 'lot1'
+    small = lot / '10000_3.csv'
+    small.write_text(''.join(SAMPLE_CSV.read_text().splitlines(keepends=True)[:9]))
+    paths = [str(small), str(lot / '3000_0.csv')]
+    history = tlc_tree / 'history.jsonl'
+    frames, report = scheduler.run_scheduled(paths, '*TLC*/**/*.csv', budget_bytes=1 << 40, workers=2,
+                                             history=history)
+    assert [f['WECyc'].iloc[0] for f in frames] == [10000, 3000]
+    assert all(r['actual'] > 0 for r in report)
+    assert {r['path'] for r in report} == set(paths)
+    assert len(history.read_text().splitlines()) == 2
+    assert 'pred MB' in scheduler.format_report(report)
+
+
+def test_run_scheduled_keeps_positions_of_failures_and_duplicates(tlc_tree):
+    """
+    失敗したファイルは None で位置を残し、同じパスが2回あればそれぞれの結果を返す
+    """
+    lot = tlc_tree / 'WE_TLC' / 'lot1'
+    broken = lot / 'broken.csv'
+    broken.write_text(SAMPLE_CSV.read_text())
+    good = str(lot / '3000_0.csv')
+    frames, report = scheduler.run_scheduled([str(broken), good, good], '*TLC*/**/*.csv',
+                                             budget_bytes=1 << 40, workers=2, max_tasks_per_child=None)
+    assert frames[0] is None
+    assert [len(f) for f in frames[1:]] == [15, 15]
+    assert sum(r['actual'] is None for r in report) == 1
+
+
+# =====================================================================
+# (L) 共有メモリでの結果の受け渡し (shm_handoff.py)
+# =====================================================================
+from multiprocessing import shared_memory
+
+import shm_handoff
+
+
+def test_shared_result_round_trip_and_release(tmp_path):
+    """
+    共有メモリに置いた結果をそのまま出力に書き、書いた後は共有メモリが消えている
+    """
+    df = shm_handoff.make_processed_frame(1000)
+    result = shm_handoff.to_shared(df)
+    assert result.rows == 1000 and result.size > 0
+    assert shm_handoff.stream_to_sink([result, None], tmp_path / 'out.parquet') == 1000
+    pd.testing.assert_frame_equal(pq.read_table(tmp_path / 'out.parquet').to_pandas(), df)
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=result.name)
+    assert shm_handoff.to_shared(None) is None
+
+
+def test_scheduler_hands_off_through_shared_memory(tlc_tree):
+    """
+    スケジューラのワーカーからは記述子だけが返り、親で DataFrame に戻せる
+    """
+    path = str(tlc_tree / 'WE_TLC' / 'lot1' / '3000_0.csv')
+    other = str(tlc_tree / 'WE_TLC' / 'lot1' / '3000_1.csv')
+    Path(other).write_bytes(Path(path).read_bytes())
+    results, _ = shm_handoff.run_scheduled([path, other], '*TLC*/**/*.csv', budget_bytes=1 << 40, workers=1)
+    assert results[0].name != results[1].name
+    assert all(isinstance(r, shm_handoff.ShmResult) for r in results)
+    df = shm_handoff.read_shared(results[0])
+    assert len(df) == results[0].rows == 15
+    assert (df['WECyc'] == 3000).all()
+    shm_handoff.release(results[1])
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=results[1].name)
+
+
+def test_unconsumed_shared_results_are_released(tmp_path):
+    """
+    途中で失敗しても、まだ読んでいない共有メモリは解放する
+    """
+    results = [shm_handoff.to_shared(shm_handoff.make_processed_frame(10)) for _ in range(3)]
+    frames = shm_handoff.iter_shared(results)
+    assert len(next(frames)) == 10
+    frames.close()
+
+    broken = shm_handoff.ShmResult('tlc_qlc_missing', 1, 1)
+    rest = [shm_handoff.to_shared(shm_handoff.make_processed_frame(10))]
+    with pytest.raises(FileNotFoundError):
+        shm_handoff.stream_to_sink([broken] + rest, tmp_path / 'out.parquet')
+    for result in results + rest:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=result.name)
+
+
+@pytest.mark.parametrize('keep', [
+    False,
+    # テーブルを持ったままの出力先では閉じられず、後で SharedMemory.__del__ が警告を出す
+    pytest.param(True, marks=pytest.mark.filterwarnings('ignore::pytest.PytestUnraisableExceptionWarning')),
+])
+def test_consume_unlinks_when_sink_raises(keep):
+    """
+    出力先への書き込みが失敗しても元の例外を返し、共有メモリは /dev/shm に残さない
+    (出力先がテーブルを持ったままで閉じられなくても消す)
+    """
+    class BrokenSink:
+        def write(self, table):
+            if keep:
+                self.table = table
+            raise ValueError('disk full')
+
+    result = shm_handoff.to_shared(shm_handoff.make_processed_frame(10))
+    sink = BrokenSink()
+    with pytest.raises(ValueError, match='disk full'):
+        shm_handoff.consume(result, sink)
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=result.name)
+
+
+@pytest.mark.parametrize('extra', [['--no-sketches'], []])
+def test_cli_run_shm_handoff_streams_output(tlc_tree, extra):
+    """
+    --shm-handoff はスケッチが要らなければ Arrow のまま、要れば1ファイルずつ出力に書く
+    """
+    code = cli.run_cli(['--config', str(tlc_tree / 'config.yaml'), 'run', '--workers', '1', '--shm-handoff'] + extra)
+    assert code == 0
+    assert len(pd.read_csv(tlc_tree / 'processed.csv')) == 15
+    assert (tlc_tree / 'processed.sketches.json').exists() == (extra == [])
+
+
+def test_handoff_benchmark_reports_both_paths(tmp_path):
+    timings = shm_handoff.benchmark(10_000, repeat=1, out_dir=tmp_path)
+    assert set(timings) == {'pickle', 'shared_memory'} and all(t > 0 for t in timings.values())
+    assert not list(tmp_path.iterdir())
+
+
+# =====================================================================
+# (M) 処理済み出力の差分 (diffout.py)
+# =====================================================================
+import diffout
+
+
+def test_diff_outputs_skips_identical_partitions(tmp_path):
+    """
+    CSV と Parquet、行の順序が違っても中身が同じなら全パーティションを飛ばす
+    """
+    df = shm_handoff.make_processed_frame(2000)
+    df.to_csv(tmp_path / 'old.csv', index=False)
+    df.sample(frac=1, random_state=0).to_parquet(tmp_path / 'new.parquet', index=False)
+    report = diffout.diff_outputs(tmp_path / 'old.csv', tmp_path / 'new.parquet', partitions=8)
+    assert diffout.is_identical(report)
+    assert report['skipped'] == 8 and report['left_rows'] == report['right_rows'] == 2000
+
+
+def test_diff_outputs_reports_added_removed_changed(tmp_path):
+    """
+    同じキーの中の出現順で突き合わせ、許容誤差内の違いは変更に数えない
+    """
+    old = shm_handoff.make_processed_frame(400).astype({'FBC': 'float64'})
+    new = old.copy()
+    new.loc[10, 'FBC'] += 5
+    new.loc[20, 'FBC'] += 1e-12
+    # Unit ごとに4行あるので、キーの最後の行 (出現順 3) を消す
+    new = pd.concat([new.drop(index=[31]), new.iloc[[0]].assign(Unit=10_000)], ignore_index=True)
+    old.to_parquet(tmp_path / 'old.parquet', index=False)
+    new.to_parquet(tmp_path / 'new.parquet', index=False)
+
+    report = diffout.diff_outputs(tmp_path / 'old.parquet', tmp_path / 'new.parquet', partitions=4,
+                                  atol=1e-9, output=tmp_path / 'diff.csv')
+    assert (report['added'], report['removed'], report['changed']) == (1, 1, 1)
+    assert report['changed_by_column'] == {'FBC': 1}
+    assert 0 < report['skipped'] < 4
+    diff = pd.read_csv(tmp_path / 'diff.csv')
+    assert sorted(diff['_status']) == ['added', 'changed', 'removed']
+    changed = diff[diff['_status'] == 'changed'].iloc[0]
+    assert changed['FBC_right'] - changed['FBC_left'] == 5
+    assert not diffout.is_identical(diffout.diff_outputs(tmp_path / 'old.parquet', tmp_path / 'new.parquet',
+                                                         partitions=4))
+
+
+
+def test_diff_outputs_ignores_reordered_duplicate_keys(tmp_path):
+    """
+    同じキーの行の並びが変わっただけでは差分にならず、本当に変わった行だけを変更に数える
+    """
+    old = shm_handoff.make_processed_frame(400, seed=1).astype({'FBC': 'float64'})
+    new = old.iloc[::-1].reset_index(drop=True)
+    new.loc[new.index[-1], 'FBC'] += 5
+    old.to_parquet(tmp_path / 'old.parquet', index=False)
+    new.to_parquet(tmp_path / 'new.parquet', index=False)
+
+    report = diffout.diff_outputs(tmp_path / 'old.parquet', tmp_path / 'new.parquet', partitions=1)
+    assert (report['added'], report['removed'], report['changed']) == (0, 0, 1)
+    assert report['changed_by_column'] == {'FBC': 1}
+    assert report['samples'][0]['FBC_right'] - report['samples'][0]['FBC_left'] == 5
+
+# =====================================================================
+# (N) ディスクに逃がす処理 (spill.py)
+# =====================================================================
+import main
+import spill
+
+
+@pytest.fixture
+def many_units_csv(tmp_path):
+    """
+    サンプル入力の Unit をずらして 20 個の Unit にしたファイル
+    """
+    sample = pd.read_csv(SAMPLE_CSV)
+    df = pd.concat([sample.assign(Unit=sample['Unit'] + u) for u in range(20)], ignore_index=True)
+    path = tmp_path / '3000_0.csv'
+    df.to_csv(path, index=False)
+    return path
+
+
+def test_spilled_partitions_match_in_memory(many_units_csv, tmp_path):
+    """
+    予算を超えると Unit のパーティションに分けて処理し、Unit 順に並べれば一括処理と同じ結果になる
+    """
+    size = many_units_csv.stat().st_size
+    model = MemoryModel({'TLC': (0.0, 100.0)}, safety=1.0)
+    runner = spill.SpillingProcessor(budget_bytes=size * 30, tmp_dir=tmp_path, model=model, chunk_rows=50)
+    assert runner.partitions_for(size, 'TLC') == 5
+    frames = list(runner.iter_file(str(many_units_csv), '*TLC*/**/*.csv'))
+    assert len(frames) > 1
+    assert not [p for p in tmp_path.iterdir() if p.name.startswith('tlc_qlc-spill-')]
+
+    spilled = pd.concat(frames, ignore_index=True)
+    assert spilled['BlockID'].nunique() == 1 and spilled['uid'].nunique() == 1
+    expected = main.process_file(str(many_units_csv), '*TLC*/**/*.csv')
+    ignore = ['BlockID', 'uid']
+    pd.testing.assert_frame_equal(
+        spilled.drop(columns=ignore).sort_values('Unit', kind='stable', ignore_index=True),
+        expected.drop(columns=ignore))
+
+
+def test_spilled_file_failing_midway_writes_nothing(many_units_csv, tmp_path, monkeypatch):
+    """
+    途中のパーティションで失敗したファイルは、先に終わったパーティションの行も出力に入らない
+    """
+    class FailingSecond(main.TLCProcessor):
+        calls = 0
+
+        def process(self):
+            FailingSecond.calls += 1
+            if FailingSecond.calls == 2:
+                raise ValueError('broken partition')
+            return super().process()
+
+    monkeypatch.setattr(main, 'get_processor_class', lambda pattern: FailingSecond)
+    size = many_units_csv.stat().st_size
+    model = MemoryModel({'TLC': (0.0, 100.0)}, safety=1.0)
+    runner = spill.SpillingProcessor(budget_bytes=size * 30, tmp_dir=tmp_path, model=model, chunk_rows=50)
+    output = tmp_path / 'processed.csv'
+    assert spill.write_frames(runner.iter_files([str(many_units_csv)], '*TLC*/**/*.csv'), output) == 0
+    assert not output.exists()
+
+
+def test_cli_rejects_memory_budget_with_workers(tlc_tree):
+    with pytest.raises(SystemExit):
+        cli.run_cli(['--config', str(tlc_tree / 'config.yaml'), 'run', '--workers', '2',
+                     '--memory-budget-mb', '4096'])
+
+
+def test_spill_hashes_units_after_casting_chunks(tmp_path):
+    """
+    後のチャンクで Unit の型の推定が変わっても (1 と 1.0)、同じ Unit は1つのパーティションに入る
+    """
+    path = tmp_path / '3000_0.csv'
+    path.write_text('Unit,fbcA\n' + ''.join(f'{u},{u}\n' for u in range(8))
+                    + ''.join(f'{u}.0,{u}\n' for u in range(8)))
+    files = spill.SpillingProcessor(1 << 40, chunk_rows=8).spill(str(path), tmp_path, partitions=4)
+    seen = {}
+    for file in files:
+        for unit in pa.ipc.open_file(file).read_all().column('Unit').to_pylist():
+            seen.setdefault(unit, set()).add(file.name)
+    assert sorted(seen) == list(range(8)) and all(len(names) == 1 for names in seen.values())
+
+
+def test_spill_import_does_not_import_yaml():
+    code = "import sys, spill; print('yaml' in sys.modules)"
+    out = subprocess.run([sys.executable, '-c', code], cwd=Path(spill.__file__).parent,
+                         capture_output=True, text=True, check=True).stdout
+    assert out.strip() == 'False'
+
+
+def test_spill_budget_below_base_is_rejected():
+    runner = spill.SpillingProcessor(budget_bytes=1 << 20)
+    assert spill.SpillingProcessor(budget_bytes=1 << 40).partitions_for(1 << 20, 'TLC') == 1
+    with pytest.raises(MemoryError):
+        runner.partitions_for(1 << 30, 'TLC')
+
+
+def test_cli_run_with_memory_budget_streams_output(tlc_tree):
+    """
+    メモリの予算を指定すると結果を順に追記して書く (スケッチも同じ)
+    """
+    code = cli.run_cli(['--config', str(tlc_tree / 'config.yaml'), 'run', '--memory-budget-mb', '4096'])
+    assert code == 0
+    assert len(pd.read_csv(tlc_tree / 'processed.csv')) == 15
+    assert (tlc_tree / 'processed.sketches.json').exists()
+
+
+# =====================================================================
+# (O) 複数ホストでの分担 (distributed.py)
+# =====================================================================
+import distributed
+from distributed import Coordinator, Worker
+
+
+def _read_csv(path, pattern):
+    return pd.read_csv(path)
+
+
+def test_run_local_collects_result_locations(tlc_tree):
+    """
+    1台で N 個のワーカープロセスを動かし、コーディネーターは結果の場所だけを集める
+    """
+    lot = tlc_tree / 'WE_TLC' / 'lot1'
+    for name in ('10000_0.csv', '3000_3.csv'):
+        (lot / name).write_bytes(SAMPLE_CSV.read_bytes())
+    paths = sorted(str(p) for p in lot.glob('*.csv'))
+    coordinator = distributed.run_local(paths, '*TLC*/**/*.csv', tlc_tree / 'results', workers=2, timeout=60)
+    assert set(coordinator.results) == set(paths) and not coordinator.failed
+    locations = coordinator.ordered_results()
+    assert all(Path(loc).parent == tlc_tree / 'results' for loc in locations)
+    assert distributed.gather(locations, tlc_tree / 'processed.csv') == 45
+    assert sorted(pd.read_csv(tlc_tree / 'processed.csv')['WECyc'].unique()) == [3000, 10000]
+
+
+def test_expired_lease_is_reissued(tmp_path):
+    """
+    ハートビートの途切れたリースは別のワーカーに出し直し、後から届いた元の完了は使わない
+    """
+    source = tmp_path / '3000_0.csv'
+    source.write_bytes(SAMPLE_CSV.read_bytes())
+    coordinator = Coordinator([str(source)], '*TLC*/**/*.csv', lease_ttl=0.3).start()
+    try:
+        dead = Worker(coordinator.address, tmp_path / 'out', worker_id='dead')
+        stale = dead.request({'op': 'lease'})
+        assert stale['file'] == str(source)
+
+        alive = Worker(coordinator.address, tmp_path / 'out', process=_read_csv, worker_id='alive')
+        assert alive.run() == 1
+        assert coordinator.wait(timeout=5) and coordinator.reissued == 1
+        assert len(pd.read_parquet(coordinator.results[str(source)])) == len(pd.read_csv(SAMPLE_CSV))
+        late = dead.request({'op': 'complete', 'lease': stale['lease'], 'file': str(source), 'result': 'x'})
+        assert late == {'ok': False}
+    finally:
+        coordinator.close()
+
+
+def test_superseded_result_is_removed(tmp_path):
+    """
+    リースの期限が切れて別のワーカーが先に完了したら、遅れた方は自分の結果のファイルを消す
+    """
+    source = tmp_path / '3000_0.csv'
+    source.write_bytes(SAMPLE_CSV.read_bytes())
+    coordinator = Coordinator([str(source)], '*TLC*/**/*.csv', lease_ttl=0.3).start()
+    try:
+        alive = Worker(coordinator.address, tmp_path / 'out', process=_read_csv, worker_id='alive')
+
+        def stalled(path, pattern):
+            # ハートビートの無いまま期限が切れ、その間に別のワーカーが処理を終える
+            time.sleep(0.5)
+            assert alive.run() == 1
+            return pd.read_csv(path)
+
+        slow = Worker(coordinator.address, tmp_path / 'out', process=stalled, worker_id='slow')
+        slow._heartbeat = lambda *args: None
+        assert slow.run() == 0
+        assert coordinator.wait(timeout=5) and coordinator.reissued == 1
+        assert list((tmp_path / 'out').iterdir()) == [Path(coordinator.results[str(source)])]
+    finally:
+        coordinator.close()
+
+
+def test_worker_abandons_file_when_heartbeat_finds_reissued_lease(tmp_path):
+    """
+    ハートビートでリースが出し直されたと分かったら、遅れた方は結果を書かずに完了も送らない
+    """
+    source = tmp_path / '3000_0.csv'
+    source.write_bytes(SAMPLE_CSV.read_bytes())
+    coordinator = Coordinator([str(source)], '*TLC*/**/*.csv', lease_ttl=0.3).start()
+    try:
+        alive = Worker(coordinator.address, tmp_path / 'out', process=_read_csv, worker_id='alive')
+
+        def stalled(path, pattern):
+            # リースの期限を切らせて別のワーカーに処理させ、次のハートビートを待つ
+            with coordinator.cond:
+                for info in coordinator.leases.values():
+                    info['deadline'] = 0.0
+            assert alive.run() == 1
+            time.sleep(0.3)
+            return pd.read_csv(path)
+
+        slow = Worker(coordinator.address, tmp_path / 'out', process=stalled, worker_id='slow')
+        sent = []
+        request = slow.request
+        slow.request = lambda message: sent.append(message['op']) or request(message)
+        assert slow.run() == 0
+        assert 'complete' not in sent and 'fail' not in sent
+        assert coordinator.wait(timeout=5) and coordinator.reissued == 1
+        assert list((tmp_path / 'out').iterdir()) == [Path(coordinator.results[str(source)])]
+    finally:
+        coordinator.close()
+
+
+def test_distributed_import_does_not_import_yaml():
+    code = "import sys, distributed; print('yaml' in sys.modules)"
+    out = subprocess.run([sys.executable, '-c', code], cwd=Path(distributed.__file__).parent,
+                         capture_output=True, text=True, check=True).stdout
+    assert out.strip() == 'False'
+
+
+def test_run_local_raises_on_timeout(tlc_tree):
+    with pytest.raises(TimeoutError):
+        distributed.run_local([str(tlc_tree / 'WE_TLC' / 'lot1' / '3000_0.csv')], '*TLC*/**/*.csv',
+                              tlc_tree / 'results', workers=1, lease_ttl=1.0, timeout=0.01)
+
+
+def test_failing_file_gives_up_after_max_attempts(tmp_path):
+    def broken(path, pattern):
+        raise ValueError('broken file')
+
+    coordinator = Coordinator(['missing.csv'], '*TLC*/**/*.csv', max_attempts=2).start()
+    try:
+        assert Worker(coordinator.address, tmp_path, process=broken).run() == 0
+        assert coordinator.wait(timeout=5)
+        assert coordinator.failed == {'missing.csv': 'broken file'} and coordinator.attempts['missing.csv'] == 2
+    finally:
+        coordinator.close()
+
+
+# =====================================================================
+# (P) PySpark 版 (spark_engine.py)
+# =====================================================================
+import shutil
+
+
+@pytest.fixture(scope='module')
+def spark():
+    pytest.importorskip('pyspark')
+    if not (shutil.which('java') or os.environ.get('JAVA_HOME')):
+        pytest.skip('Java is not available')
+    import spark_engine
+    session = spark_engine.build_spark('local[2]')
+    yield session
+    session.stop()
+
+
+@pytest.mark.parametrize('suffix', ['', '.gz'])
+def test_spark_engine_matches_pandas(spark, tmp_path, suffix):
+    """
+    local モードの Spark の結果が pandas 版と一致する (BlockID / uid はファイルごとに1つであることだけ確かめる)
+    """
+    import gzip
+
+    import spark_engine
+    lot = tmp_path / 'WE_TLC' / 'lot1'
+    lot.mkdir(parents=True)
+    paths = [lot / f'10000_3.csv{suffix}', lot / f'3000_0.csv{suffix}']
+    for path in paths:
+        data = SAMPLE_CSV.read_bytes()
+        path.write_bytes(gzip.compress(data) if suffix else data)
+    pattern = '*TLC*/**/*.csv*'
+
+    got = spark_engine.process_files(spark, [str(p) for p in paths], pattern, seed=0).toPandas()
+    expected = pd.concat([main.process_file(str(p), pattern) for p in paths], ignore_index=True)
+    assert list(got.columns) == list(expected.columns)
+    assert (got.groupby('WECyc')[['BlockID', 'uid']].nunique() == 1).all().all()
+    ignore = ['BlockID', 'uid']
+    pd.testing.assert_frame_equal(got.drop(columns=ignore), expected.drop(columns=ignore), check_dtype=False)
+
+
+def test_spark_engine_rejects_qlc(spark, tmp_path):
+    """
+    QLC は Spark 版の対象外なので、処理を始める前に断る
+    """
+    import spark_engine
+    with pytest.raises(ValueError, match='QLC is not supported'):
+        spark_engine.process_files(spark, [str(SAMPLE_CSV)], '*QLC*/**/*.csv')
+
+
+# =====================================================================
+# (Q) 圧縮された入力 (compressed.py)
+# =====================================================================
+import gzip
+import io
+
+import compressed
+
+
+def _write_compressed(path, data):
+    if path.suffix == '.gz':
+        path.write_bytes(gzip.compress(data))
+    elif path.suffix == '.zst':
+        path.write_bytes(compressed.zstandard.ZstdCompressor().compress(data))
+    else:
+        path.write_bytes(compressed.lz4frame.compress(data))
+
+
+@pytest.mark.parametrize('suffix', ['.gz', '.zst', '.lz4'])
+def test_compressed_input_matches_plain(tmp_path, suffix):
+    """
+    圧縮した入力を伸長しながら読み、元の CSV と同じ結果になる (WECyc / DR は拡張子を除いた名前から取る)
+    """
+    if suffix == '.zst':
+        pytest.importorskip('zstandard')
+    if suffix == '.lz4':
+        pytest.importorskip('lz4.frame')
+    path = tmp_path / f'10000_3.csv{suffix}'
+    _write_compressed(path, SAMPLE_CSV.read_bytes())
+    assert compressed.is_csv_input(str(path)) and compressed.csv_name(str(path)) == '10000_3.csv'
+    with compressed.open_input(str(path)) as stream:
+        assert stream.read() == SAMPLE_CSV.read_bytes()
+
+    got = main.process_file(str(path), '*TLC*/**/*.csv*')
+    expected = main.process_file(str(SAMPLE_CSV), '*TLC*/**/*.csv')
+    assert (got['WECyc'] == 10000).all() and (got['DR'] == 3).all()
+    ignore = ['WECyc', 'DR', 'BlockID', 'uid']
+    pd.testing.assert_frame_equal(got.drop(columns=ignore), expected.drop(columns=ignore))
+    assert sorted(p.name for p in tmp_path.iterdir()) == [path.name]
+
+
+def test_background_reader_streams_and_reports_errors(tmp_path):
+    """
+    別スレッドで小さいチャンクに分けて伸長しても同じバイト列になり、壊れたファイルは読む側で例外になる
+    """
+    data = SAMPLE_CSV.read_bytes() * 50
+    reader = compressed.BackgroundReader(gzip.GzipFile(fileobj=io.BytesIO(gzip.compress(data))),
+                                         chunk_bytes=1000, queue_chunks=2)
+    with io.BufferedReader(reader) as stream:
+        assert stream.read() == data
+
+    broken = tmp_path / '3000_0.csv.gz'
+    broken.write_bytes(gzip.compress(data)[:-100])
+    with pytest.raises((EOFError, OSError)):
+        with compressed.open_input(str(broken)) as stream:
+            stream.read()
+
+
+@pytest.mark.parametrize('command', [None, ['zstd', '-q'], ['lz4', '-q', '--content-size'], ['lz4', '-q']])
+def test_uncompressed_size_reads_headers(tmp_path, command):
+    """
+    伸長後のサイズを gzip の ISIZE / zstd・lz4 のヘッダから取り、無ければ圧縮率で見積もる
+    """
+    data = SAMPLE_CSV.read_bytes() * 20
+    plain = tmp_path / '3000_0.csv'
+    plain.write_bytes(data)
+    if command is None:
+        path = tmp_path / '3000_0.csv.gz'
+        path.write_bytes(gzip.compress(data))
+    else:
+        if shutil.which(command[0]) is None:
+            pytest.skip(f'{command[0]} is not available')
+        path = tmp_path / f'3000_0.csv.{"zst" if command[0] == "zstd" else "lz4"}'
+        output = ['-o', str(path)] if command[0] == 'zstd' else [str(path)]
+        subprocess.run(command + [str(plain)] + output, check=True)
+    expected = len(data)
+    if command == ['lz4', '-q']:
+        expected = int(path.stat().st_size * compressed.DEFAULT_RATIOS['lz4'])
+    assert compressed.uncompressed_size(str(path)) == expected
+    assert compressed.uncompressed_size(str(plain)) == len(data)
+
+    _, report = scheduler.run_scheduled([str(path)], '*TLC*/**/*.csv*', budget_bytes=1 << 40, workers=1)
+    assert report[0]['size'] == expected
+
+
+def test_process_all_files_reads_compressed_sweeps(tmp_path):
+    """
+    *.csv* のパターンで圧縮した入力と元の CSV を一緒に処理する (.csv 以外は飛ばす)
+    """
+    lot = tmp_path / 'WE_TLC' / 'lot1'
+    lot.mkdir(parents=True)
+    (lot / '3000_0.csv').write_bytes(SAMPLE_CSV.read_bytes())
+    _write_compressed(lot / '10000_3.csv.gz', SAMPLE_CSV.read_bytes())
+    (lot / '3000_0.csv.bak').write_bytes(SAMPLE_CSV.read_bytes())
+    df = main.process_all_files(f'{tmp_path}/*TLC*/**/*.csv*')
+    assert sorted(df['WECyc'].unique()) == [3000, 10000] and len(df) == 30
+
+
+# =====================================================================
+# (R) エンジン比較の処理 (../../engine_bench.py)
+# =====================================================================
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+import engine_bench
+
+
+@pytest.mark.parametrize('engine', ['numpy', 'pandas', 'polars', 'duckdb'])
+def test_engine_bench_closest_matches_main_step7(engine, monkeypatch):
+    """
+    closest はステップ7 (seg 合算した行ごとに |shiftX| が最小の fbcX) と、page_sum はステップ9 と同じ値になる
+    """
+    table = engine_bench.make_sweep(240, seed=1)
+    for column in engine_bench.FBC_COLS:
+        # 合算の順序で値が変わらないよう整数にする
+        table[column] = np.round(table[column])
+
+    # ステップ7 の直後 (shiftX を消す前) の DataFrame を display から取る
+    captured = {}
+
+    def capture(df):
+        frame = sys._getframe(1).f_locals['self'].df
+        if 'FBC' in frame.columns and 'shiftA' in frame.columns and 'step7' not in captured:
+            captured['step7'] = frame.copy()
+    monkeypatch.setattr(main, 'display', capture)
+    processor = main.TLCProcessor(pd.DataFrame(table), '3000_0.csv')
+    processor.create_basic_data()
+    processor.create_page_data()
+    # seg 合算の結果は (Unit, shiftIndex) 順なので、各エンジンの正規化した結果と同じ順
+    step7 = captured['step7']
+
+    data = table if engine == 'numpy' else getattr(engine_bench, f'{engine}_frame')(table)
+    closest = engine_bench.normalize(engine, 'closest', getattr(engine_bench, f'{engine}_closest')(data))
+    np.testing.assert_array_equal(closest[:, 0], step7['FBC'].to_numpy(dtype=np.float64))
+    pages = engine_bench.normalize(engine, 'page_sum', getattr(engine_bench, f'{engine}_page_sum')(data))
+    np.testing.assert_array_equal(pages[:, 0], processor.df['FBC'].to_numpy(dtype=np.float64))
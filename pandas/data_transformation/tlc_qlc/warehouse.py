@@ -0,0 +1,248 @@
+"""
+処理済み出力をスタースキーマとしてローカルの DWH (DuckDB / SQLite) に読み込む
+
+    dim_device    (device_id, uid, BlockID)
+    dim_condition (condition_id, WECyc, DR)
+    dim_address   (address_id, WL, String, Page)
+    fact_fbc      (device_id, condition_id, address_id, FBC)
+
+ディメンションには整数のサロゲートキーを振り、ファクトはキーと FBC だけを持つ。
+35 文字の uid を行ごとに繰り返さないので、ファクトは小さく結合も速い。
+サロゲートキーは読み込みを繰り返しても変わらない (既存の行はそのまま、新しい行だけ追加する)。
+
+読み込みは一括の経路を使う (DuckDB は Arrow からの INSERT、SQLite は1トランザクションの
+executemany)。インデックスは最初の読み込みの後に1回だけ作り、以降の追加では作り直さない。
+自然キーに null があるデータは読み込まない (サロゲートキーが振れない)。
+
+使い方:
+    python warehouse.py processed.csv warehouse.duckdb
+"""
+import argparse
+import logging
+import sqlite3
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+import pandas as pd
+
+# ログの設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# ディメンション名 -> 自然キーのカラム
+DIMENSIONS: Dict[str, List[str]] = {
+    'device': ['uid', 'BlockID'],
+    'condition': ['WECyc', 'DR'],
+    'address': ['WL', 'String', 'Page'],
+}
+
+FACT_TABLE = 'fact_fbc'
+MEASURE = 'FBC'
+
+# SQLite で一度に executemany する行数
+SQLITE_BATCH_ROWS = 50_000
+
+
+def dim_table(name: str) -> str:
+    return f'dim_{name}'
+
+
+def dim_key(name: str) -> str:
+    return f'{name}_id'
+
+
+def _sql_type(dtype, backend: str) -> str:
+    """
+    pandas の dtype -> SQL の型
+
+    Raises:
+        ValueError: SQLite に符号なし 64 ビット整数を入れようとした (INTEGER は符号付き 64 ビット)
+    """
+    if pd.api.types.is_unsigned_integer_dtype(dtype) and pd.api.types.pandas_dtype(dtype).itemsize == 8:
+        if backend == 'duckdb':
+            return 'UBIGINT'
+        raise ValueError(f"SQLite INTEGER cannot hold unsigned 64-bit values ({dtype}); "
+                         f"use the duckdb backend or convert the column to int64")
+    if pd.api.types.is_integer_dtype(dtype):
+        return 'BIGINT' if backend == 'duckdb' else 'INTEGER'
+    if pd.api.types.is_float_dtype(dtype):
+        return 'DOUBLE' if backend == 'duckdb' else 'REAL'
+    return 'VARCHAR' if backend == 'duckdb' else 'TEXT'
+
+
+def _assign_keys(existing: pd.DataFrame, incoming: pd.DataFrame, name: str) -> tuple:
+    """
+    ディメンションの新しい行にサロゲートキーを振る
+
+    Args:
+        existing (pd.DataFrame): 読み込み済みのディメンション (キー + 自然キー)
+        incoming (pd.DataFrame): 今回のデータ
+        name (str): ディメンション名
+
+    Returns:
+        tuple: (全ての行のディメンション, 追加する行)
+    """
+    columns = DIMENSIONS[name]
+    key = dim_key(name)
+    unique = incoming[columns].drop_duplicates().sort_values(columns, ignore_index=True)
+    if len(existing):
+        unique = unique.astype({c: existing[c].dtype for c in columns})
+    merged = unique.merge(existing, on=columns, how='left')
+    new_rows = merged[merged[key].isna()][columns].reset_index(drop=True)
+    start = int(existing[key].max()) + 1 if len(existing) else 1
+    new_rows.insert(0, key, range(start, start + len(new_rows)))
+    return pd.concat([existing, new_rows], ignore_index=True), new_rows
+
+
+class StarSchemaLoader:
+    def __init__(self, path: Union[str, Path], backend: Optional[str] = None) -> None:
+        """
+        StarSchemaLoaderクラスの初期化
+
+        Args:
+            path (Union[str, Path]): DWH のファイル
+            backend (Optional[str]): 'duckdb' / 'sqlite' (既定: 拡張子が .duckdb なら duckdb、それ以外は sqlite)
+        """
+        self.path = Path(path)
+        self.backend = backend or ('duckdb' if self.path.suffix == '.duckdb' else 'sqlite')
+        if self.backend == 'duckdb':
+            import duckdb
+            self.con = duckdb.connect(str(self.path))
+        elif self.backend == 'sqlite':
+            # トランザクションは load() で明示的に張る
+            self.con = sqlite3.connect(str(self.path), isolation_level=None)
+        else:
+            raise ValueError(f"Unknown backend: {self.backend}")
+
+    def _tables(self) -> List[str]:
+        if self.backend == 'duckdb':
+            return [row[0] for row in self.con.execute("SELECT table_name FROM information_schema.tables").fetchall()]
+        return [row[0] for row in self.con.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()]
+
+    def _read(self, table: str) -> pd.DataFrame:
+        if self.backend == 'duckdb':
+            return self.con.execute(f'SELECT * FROM "{table}"').df()
+        return pd.read_sql_query(f'SELECT * FROM "{table}"', self.con)
+
+    def _create(self, table: str, frame: pd.DataFrame) -> None:
+        columns = ', '.join(f'"{c}" {_sql_type(t, self.backend)}' for c, t in frame.dtypes.items())
+        self.con.execute(f'CREATE TABLE IF NOT EXISTS "{table}" ({columns})')
+
+    def _insert(self, table: str, frame: pd.DataFrame) -> None:
+        """
+        一括で追加する (DuckDB: Arrow 経由、SQLite: executemany)
+        """
+        if frame.empty:
+            return
+        if self.backend == 'duckdb':
+            self.con.register('_incoming', frame)
+            self.con.execute(f'INSERT INTO "{table}" SELECT * FROM _incoming')
+            self.con.unregister('_incoming')
+            return
+        placeholders = ', '.join('?' * frame.shape[1])
+        sql = f'INSERT INTO "{table}" VALUES ({placeholders})'
+        for start in range(0, len(frame), SQLITE_BATCH_ROWS):
+            chunk = frame.iloc[start:start + SQLITE_BATCH_ROWS]
+            self.con.executemany(sql, chunk.astype(object).where(chunk.notna(), None).itertuples(index=False))
+
+    def _indexes(self) -> List[str]:
+        """
+        最初の読み込みの後に作るインデックス
+        """
+        statements = []
+        for name, columns in DIMENSIONS.items():
+            natural = ', '.join(f'"{c}"' for c in columns)
+            statements.append(f'CREATE UNIQUE INDEX IF NOT EXISTS "ux_{dim_table(name)}_key" '
+                              f'ON "{dim_table(name)}" ("{dim_key(name)}")')
+            statements.append(f'CREATE UNIQUE INDEX IF NOT EXISTS "ux_{dim_table(name)}_natural" '
+                              f'ON "{dim_table(name)}" ({natural})')
+            statements.append(f'CREATE INDEX IF NOT EXISTS "ix_{FACT_TABLE}_{dim_key(name)}" '
+                              f'ON "{FACT_TABLE}" ("{dim_key(name)}")')
+        return statements
+
+    def load(self, df: pd.DataFrame) -> Dict[str, int]:
+        """
+        処理済みのデータをディメンションとファクトに分けて追加する
+
+        Args:
+            df (pd.DataFrame): 処理済みのデータ
+
+        Returns:
+            Dict[str, int]: テーブル -> 追加した行数
+
+        Raises:
+            ValueError: 自然キーのカラムに null がある
+        """
+        natural = [c for columns in DIMENSIONS.values() for c in columns]
+        nulls = [c for c in natural if df[c].isna().any()]
+        if nulls:
+            raise ValueError(f"Natural key columns contain nulls: {nulls}")
+        tables = self._tables()
+        dims, added = {}, {}
+        for name, columns in DIMENSIONS.items():
+            table = dim_table(name)
+            existing = (self._read(table) if table in tables
+                        else pd.DataFrame({dim_key(name): pd.Series(dtype='int64'),
+                                           **{c: pd.Series(dtype=df[c].dtype) for c in columns}}))
+            dims[name], new_rows = _assign_keys(existing, df, name)
+            dims[name] = dims[name].astype({c: df[c].dtype for c in columns})
+            added[table] = new_rows
+
+        fact = df[natural + [MEASURE]]
+        for name, columns in DIMENSIONS.items():
+            fact = fact.merge(dims[name], on=columns, how='left')
+        fact = fact[[dim_key(name) for name in DIMENSIONS] + [MEASURE]].astype(
+            {dim_key(name): 'int64' for name in DIMENSIONS})
+
+        self.con.execute('BEGIN')
+        try:
+            for table, new_rows in added.items():
+                self._create(table, new_rows)
+                self._insert(table, new_rows)
+            first_load = FACT_TABLE not in tables
+            self._create(FACT_TABLE, fact)
+            self._insert(FACT_TABLE, fact)
+            # インデックスは最初の読み込みの後に作り、以降はそのまま使う
+            if first_load:
+                for statement in self._indexes():
+                    self.con.execute(statement)
+            self.con.execute('COMMIT')
+        except BaseException:
+            self.con.execute('ROLLBACK')
+            raise
+
+        counts = {table: len(rows) for table, rows in added.items()}
+        counts[FACT_TABLE] = len(fact)
+        logging.info(f"Loaded into {self.path}: {counts}")
+        return counts
+
+    def load_csv(self, path: Union[str, Path]) -> Dict[str, int]:
+        """
+        処理済みの CSV (main.py の出力) を読み込む
+
+        Args:
+            path (Union[str, Path]): 処理済みの CSV
+
+        Returns:
+            Dict[str, int]: テーブル -> 追加した行数
+        """
+        return self.load(pd.read_csv(path))
+
+    def close(self) -> None:
+        self.con.close()
+
+    def __enter__(self) -> 'StarSchemaLoader':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='処理済み出力をスタースキーマで DWH に読み込む')
+    parser.add_argument('source', help='処理済みの CSV')
+    parser.add_argument('warehouse', help='DWH のファイル (.duckdb なら DuckDB、それ以外は SQLite)')
+    parser.add_argument('--backend', choices=['duckdb', 'sqlite'])
+    args = parser.parse_args()
+
+    with StarSchemaLoader(args.warehouse, args.backend) as loader:
+        loader.load_csv(args.source)
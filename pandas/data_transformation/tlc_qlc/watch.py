@@ -0,0 +1,395 @@
+"""
+ディレクトリを監視して届いたファイルを逐次処理する (ストリーミング取り込み)
+
+*TLC* / *QLC* のツリーを監視し、書き込みが終わったファイルだけをマイクロバッチに
+まとめて処理し、出力ディレクトリに Parquet のパートとして追加する。
+
+- 変更の検知: watchdog (inotify) があればそれでループを起こし、無ければポーリング
+- 書き込み完了の判定: サイズと mtime が settle 秒変わらなければ完了とみなす
+- マイクロバッチ: 合計サイズが max_batch_bytes を超えるか、最も古いファイルが
+  max_latency 秒待ったら処理する
+- exactly-once: _manifest.json を原子的に置き換えた時点をコミットとする。
+  取り込んだファイルとパートの記録は _files.jsonl に追記し、manifest にはコミット済みの
+  長さだけを持つ (manifest はバッチ数やファイル数によらず小さい)。
+  パートは一時名で書いて fsync し、manifest に載せてから本来の名前にする。
+  途中で落ちても再起動時に manifest に従って完了または破棄するので、
+  同じファイルが2回出力されたり、コミットされていないパートが読まれたりしない。
+- 同じパスに置き直された (サイズか mtime が変わった) ファイルは、新しいファイルとしてもう一度処理する
+- 逐次の集計 (windowed.WindowedAggregator): manifest のコミットより先に反映してチェックポイントする。
+  その間に落ちると再起動後に同じファイルをもう一度処理するが、集計器は反映済みのファイルを飛ばすので
+  どのファイルもちょうど1回だけ数えられる。
+
+使い方:
+    python watch.py /data/tester /data/processed
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import cli
+import compressed
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    Observer = None
+
+# ログの設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# 監視するパターン (監視ルートからの相対パス。圧縮した .csv.gz なども含む)。
+# x.csv.part などの書きかけの一時ファイルは compressed.is_csv_input で除く
+DEFAULT_PATTERNS = ['*TLC*/**/*.csv*', '*QLC*/**/*.csv*']
+
+# manifest と、取り込んだファイルの記録のファイル名 (出力ディレクトリ直下)
+MANIFEST_NAME = '_manifest.json'
+LOG_NAME = '_files.jsonl'
+
+
+def _part_name(seq: int) -> str:
+    return f'part-{seq:08d}.parquet'
+
+
+def _tmp_name(seq: int) -> str:
+    # query.py の *.parquet のグロブに掛からない名前
+    return f'.part-{seq:08d}.parquet.tmp'
+
+
+class StabilityTracker:
+    def __init__(self, settle: float) -> None:
+        """
+        StabilityTrackerクラスの初期化
+
+        ファイルのサイズと mtime を観測し、settle 秒以上変わらなければ書き込み完了とみなす。
+
+        Args:
+            settle (float): 変化が無いとみなすまでの秒数
+        """
+        self.settle = settle
+        self.seen: Dict[str, Tuple[int, int, float]] = {}
+
+    def observe(self, path: str, size: int, mtime_ns: int, now: float) -> bool:
+        """
+        観測結果を記録し、書き込みが終わっていれば True を返す
+
+        Args:
+            path (str): ファイル
+            size (int): サイズ
+            mtime_ns (int): 更新時刻
+            now (float): 観測時刻
+
+        Returns:
+            bool: 書き込み完了なら True
+        """
+        previous = self.seen.get(path)
+        if previous is None or previous[:2] != (size, mtime_ns):
+            self.seen[path] = (size, mtime_ns, now)
+            return False
+        return now - previous[2] >= self.settle
+
+    def forget(self, path: str) -> None:
+        self.seen.pop(path, None)
+
+
+class Manifest:
+    def __init__(self, output_dir: Union[str, Path]) -> None:
+        """
+        Manifestクラスの初期化
+
+        取り込み済みのファイルとコミット済みのパートを記録する。
+        記録は _files.jsonl に追記し、_manifest.json (次のバッチ番号と _files.jsonl の
+        コミット済みの長さ) を原子的に置き換えた時点がコミット。コミット済みの長さより
+        後ろはコミット前に落ちたバッチの記録なので読まない (次のコミットで切り詰める)。
+
+        Args:
+            output_dir (Union[str, Path]): 出力ディレクトリ
+        """
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.path = self.output_dir / MANIFEST_NAME
+        self.log_path = self.output_dir / LOG_NAME
+        if self.path.exists():
+            self.state = json.loads(self.path.read_text())
+        else:
+            self.state = {'next_seq': 0, 'log_bytes': 0}
+        # コミット済みのパート、取り込んだファイル -> {size, mtime_ns, part}、失敗したファイル -> {size, mtime_ns, error}
+        self.parts: List[str] = []
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.failed: Dict[str, Dict[str, Any]] = {}
+        if self.log_path.exists():
+            with open(self.log_path, 'rb') as file:
+                committed = file.read(self.state['log_bytes'])
+            for line in committed.splitlines():
+                self._apply(json.loads(line))
+
+    def _apply(self, record: Dict[str, Any]) -> None:
+        if 'part' in record and 'path' not in record:
+            self.parts.append(record['part'])
+        elif 'error' in record:
+            self.failed[record['path']] = record
+            self.files.pop(record['path'], None)
+        else:
+            self.files[record['path']] = record
+            self.failed.pop(record['path'], None)
+
+    def commit(self, seq: int, files: Dict[str, Dict[str, Any]], failed: Dict[str, Dict[str, Any]],
+               has_part: bool) -> None:
+        """
+        バッチの結果を書き込む (この関数が返った時点でバッチはコミット済み)
+
+        Args:
+            seq (int): バッチ番号
+            files (Dict[str, Dict[str, Any]]): 取り込んだファイル -> {size, mtime_ns, part}
+            failed (Dict[str, Dict[str, Any]]): 失敗したファイル -> {size, mtime_ns, error}
+            has_part (bool): パートを書いたか
+        """
+        records = [{'seq': seq, 'part': _part_name(seq)}] if has_part else []
+        records += [{'path': path, **info} for path, info in files.items()]
+        records += [{'path': path, **info} for path, info in failed.items()]
+        data = b''.join(json.dumps(record).encode() + b'\n' for record in records)
+
+        # コミット前に落ちたバッチの記録を切り詰めてから追記する
+        with open(self.log_path, 'ab') as file:
+            file.truncate(self.state['log_bytes'])
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+
+        state = {'next_seq': seq + 1, 'log_bytes': self.state['log_bytes'] + len(data)}
+        tmp = self.path.with_suffix(f'.{os.getpid()}.tmp')
+        with open(tmp, 'w') as file:
+            json.dump(state, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp, self.path)
+        self.state = state
+        for record in records:
+            self._apply(record)
+
+    def recover(self) -> None:
+        """
+        前回途中で止まったバッチを片付ける
+
+        manifest に載っているのに一時名のままのパートは本来の名前にし、
+        manifest に載っていない一時ファイル (コミット前に落ちたもの) は消す。
+        """
+        committed = set(self.parts)
+        for tmp in self.output_dir.glob('.part-*.parquet.tmp'):
+            name = tmp.name[1:-len('.tmp')]
+            if name in committed:
+                os.replace(tmp, self.output_dir / name)
+                logging.info(f"Recovered committed part: {name}")
+            else:
+                tmp.unlink()
+                logging.info(f"Discarded uncommitted part: {tmp.name}")
+
+    def is_done(self, path: str, size: int, mtime_ns: int) -> bool:
+        """
+        このファイルを処理済みか (同じパスでもサイズか mtime が違えば置き直された別のファイル)
+        """
+        record = self.files.get(path) or self.failed.get(path)
+        return record is not None and (record['size'], record['mtime_ns']) == (size, mtime_ns)
+
+
+class StreamIngestor:
+    def __init__(self, root: Union[str, Path], output_dir: Union[str, Path],
+                 patterns: Optional[List[str]] = None,
+                 process: Optional[Callable[[str, str], Any]] = None,
+                 settle: float = 1.0, max_batch_bytes: int = 64 << 20, max_latency: float = 2.0,
+                 poll_interval: float = 0.5, use_inotify: bool = True,
+                 aggregator: Optional[Any] = None,
+                 checkpoint: Optional[Union[str, Path]] = None) -> None:
+        """
+        StreamIngestorクラスの初期化
+
+        Args:
+            root (Union[str, Path]): 監視するディレクトリ
+            output_dir (Union[str, Path]): 出力ディレクトリ (パートと manifest を置く)
+            patterns (Optional[List[str]]): 監視するパターン (既定: *TLC* / *QLC* の CSV)
+            process (Optional[Callable[[str, str], Any]]): 1ファイルの処理 (既定: main.process_file)
+            settle (float): 書き込み完了とみなすまでの秒数
+            max_batch_bytes (int): この合計サイズに達したらすぐ処理する
+            max_latency (float): 最も古いファイルがこの秒数待ったら処理する
+            poll_interval (float): 監視の間隔 (秒)
+            use_inotify (bool): watchdog があれば使う
+            aggregator (Optional[Any]): ファイルごとの結果を反映する集計器 (windowed.WindowedAggregator)
+            checkpoint (Optional[Union[str, Path]]): 集計器のチェックポイント (コミットのたびに書く。
+                再起動時は WindowedAggregator.restore で戻したものを aggregator に渡す)
+        """
+        self.root = Path(root)
+        self.patterns = patterns or DEFAULT_PATTERNS
+        if process is None:
+            process = cli.import_pipeline().process_file
+        self.process = process
+        self.settle = settle
+        self.max_batch_bytes = max_batch_bytes
+        self.max_latency = max_latency
+        self.poll_interval = poll_interval
+        self.aggregator = aggregator
+        self.checkpoint = checkpoint
+
+        self.manifest = Manifest(output_dir)
+        self.manifest.recover()
+        self.tracker = StabilityTracker(settle)
+        # 書き込みが終わって処理待ちのファイル -> (パターン, サイズ, mtime, 完了を確認した時刻)
+        self.ready: Dict[str, Tuple[str, int, int, float]] = {}
+
+        self.wake = threading.Event()
+        self.observer = None
+        if use_inotify and Observer is not None:
+            self.observer = self._start_observer()
+
+    def _start_observer(self):
+        """
+        watchdog で変更を監視し、変更があればループを起こす
+        """
+        wake = self.wake
+
+        class Wake(FileSystemEventHandler):
+            def on_any_event(self, event) -> None:
+                wake.set()
+
+        observer = Observer()
+        observer.schedule(Wake(), str(self.root), recursive=True)
+        observer.start()
+        return observer
+
+    def scan(self, now: Optional[float] = None) -> None:
+        """
+        監視対象を見て、書き込みが終わったファイルを処理待ちに加える
+
+        Args:
+            now (Optional[float]): 現在時刻 (既定: time.monotonic())
+        """
+        now = time.monotonic() if now is None else now
+        for pattern in self.patterns:
+            for filepath in glob.glob(str(self.root / pattern), recursive=True):
+                if filepath in self.ready or not compressed.is_csv_input(filepath):
+                    continue
+                try:
+                    stat = os.stat(filepath)
+                except FileNotFoundError:
+                    self.tracker.forget(filepath)
+                    continue
+                if self.manifest.is_done(filepath, stat.st_size, stat.st_mtime_ns):
+                    continue
+                if self.tracker.observe(filepath, stat.st_size, stat.st_mtime_ns, now):
+                    self.ready[filepath] = (pattern, stat.st_size, stat.st_mtime_ns, now)
+                    self.tracker.forget(filepath)
+
+    def due(self, now: Optional[float] = None) -> bool:
+        """
+        処理待ちのファイルをいま処理すべきか (サイズかレイテンシの上限に達したか)
+        """
+        if not self.ready:
+            return False
+        now = time.monotonic() if now is None else now
+        total = sum(size for _, size, _, _ in self.ready.values())
+        oldest = min(ready_at for _, _, _, ready_at in self.ready.values())
+        return total >= self.max_batch_bytes or now - oldest >= self.max_latency
+
+    def flush(self) -> Optional[Path]:
+        """
+        処理待ちのファイルを1つのマイクロバッチとして処理しコミットする
+
+        Returns:
+            Optional[Path]: 追加したパート (出力が無ければ None)
+        """
+        if not self.ready:
+            return None
+        pd = cli.lazy_import('pandas')
+        seq = self.manifest.state['next_seq']
+        frames, results, files, failed = [], [], {}, {}
+        for filepath, (pattern, size, mtime_ns, _) in sorted(self.ready.items()):
+            try:
+                df = self.process(filepath, pattern)
+            except Exception as e:
+                logging.error(f"Error processing file {filepath}: {e}")
+                failed[filepath] = {'size': size, 'mtime_ns': mtime_ns, 'error': str(e)}
+                continue
+            if df is not None:
+                frames.append(df)
+                # 同じパスに置き直されたファイルも別の入力として数えるよう、サイズと mtime も含める
+                results.append((f'{filepath}@{size}:{mtime_ns}', df))
+            files[filepath] = {'size': size, 'mtime_ns': mtime_ns, 'part': seq}
+
+        tmp = self.manifest.output_dir / _tmp_name(seq)
+        if frames:
+            pd.concat(frames, ignore_index=True).to_parquet(tmp, index=False)
+            # コミットした後に電源が落ちてもパートの中身が残るよう、コミットの前にディスクへ書く
+            with open(tmp, 'rb') as file:
+                os.fsync(file.fileno())
+        if self.aggregator is not None:
+            # コミットより先に反映する (コミット前に落ちて再処理されても、反映済みのファイルは飛ばされる)
+            for source, df in results:
+                self.aggregator.update(df, source)
+            if self.checkpoint is not None:
+                self.aggregator.checkpoint(self.checkpoint)
+        self.manifest.commit(seq, files, failed, has_part=bool(frames))
+        self.ready.clear()
+        if not frames:
+            return None
+        part = self.manifest.output_dir / _part_name(seq)
+        os.replace(tmp, part)
+        logging.info(f"Committed {part.name} ({len(files)} files)")
+        return part
+
+    def step(self, now: Optional[float] = None) -> Optional[Path]:
+        """
+        1回分の監視と (必要なら) 処理
+
+        Args:
+            now (Optional[float]): 現在時刻 (既定: time.monotonic())
+
+        Returns:
+            Optional[Path]: 追加したパート
+        """
+        self.scan(now)
+        if self.due(now):
+            return self.flush()
+        return None
+
+    def run(self, stop: Optional[threading.Event] = None) -> None:
+        """
+        stop が立つまで監視と処理を続ける
+
+        Args:
+            stop (Optional[threading.Event]): 停止の合図
+        """
+        stop = stop or threading.Event()
+        try:
+            while not stop.is_set():
+                self.step()
+                # inotify があれば変更ですぐ起きる (書き込み完了の確認は settle 後になる)
+                self.wake.wait(self.poll_interval)
+                self.wake.clear()
+            self.flush()
+        finally:
+            if self.observer is not None:
+                self.observer.stop()
+                self.observer.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='*TLC* / *QLC* のツリーを監視して逐次処理する')
+    parser.add_argument('root', help='監視するディレクトリ')
+    parser.add_argument('output_dir', help='出力ディレクトリ')
+    parser.add_argument('--pattern', action='append', help='監視するパターン (複数指定可)')
+    parser.add_argument('--settle', type=float, default=1.0, help='書き込み完了とみなすまでの秒数')
+    parser.add_argument('--max-latency', type=float, default=2.0, help='バッチを待つ最大秒数')
+    parser.add_argument('--max-batch-mb', type=int, default=64, help='バッチの最大サイズ (MB)')
+    args = parser.parse_args()
+
+    ingestor = StreamIngestor(args.root, args.output_dir, patterns=args.pattern, settle=args.settle,
+                              max_batch_bytes=args.max_batch_mb << 20, max_latency=args.max_latency)
+    try:
+        ingestor.run()
+    except KeyboardInterrupt:
+        pass
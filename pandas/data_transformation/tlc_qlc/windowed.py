@@ -0,0 +1,206 @@
+"""
+FBC のストリームに対する逐次のウィンドウ集計
+
+処理済みのファイルが届くたびに、ウィンドウ列 (DR / WECyc) とキー (BlockID) ごとの
+小さな状態 (合計・件数・最大・二乗和) だけを更新する。集計結果はいつでも取り出せ、
+状態はディスクにチェックポイントして再起動後に続きから集計できる。
+
+- sliding: 直近 N 個の DR ステップ (例: BlockID ごとの直近 3 DR の FBC 統計)
+- tumbling: ウィンドウ列の値ごと (例: WECyc ごとの BlockID 別の FBC 統計)
+"""
+import json
+import logging
+import math
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+import pandas as pd
+
+# ログの設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# 1つのバケットの状態: [合計, 件数, 最大, 二乗和]
+State = List[float]
+
+WINDOW_MODES = ('sliding', 'tumbling')
+
+# 覚えておく反映済みの入力の最大数 (ウィンドウを捨てない tumbling でもチェックポイントが伸び続けないように)
+MAX_SOURCES = 10_000
+
+
+def _merge(state: State, other: State) -> State:
+    """
+    2つの状態をまとめる
+    """
+    return [state[0] + other[0], state[1] + other[1], max(state[2], other[2]), state[3] + other[3]]
+
+
+def _stats(state: State) -> Dict[str, float]:
+    """
+    状態から統計量を計算する (std は標本標準偏差、件数 1 なら NaN)
+    """
+    total, count, maximum, sumsq = state
+    mean = total / count
+    var = (sumsq - total * total / count) / (count - 1) if count > 1 else math.nan
+    return {'count': int(count), 'sum': total, 'mean': mean, 'max': maximum,
+            'std': math.sqrt(max(var, 0.0)) if count > 1 else math.nan}
+
+
+class WindowedAggregator:
+    def __init__(self, window_column: str = 'DR', key: str = 'BlockID', value: str = 'FBC',
+                 mode: str = 'sliding', size: int = 3, retain: Optional[int] = None,
+                 max_sources: Optional[int] = MAX_SOURCES) -> None:
+        """
+        WindowedAggregatorクラスの初期化
+
+        状態は (ウィンドウ列の値, キー) ごとのバケットで持つ。
+        sliding では直近 size 個の値のバケットだけを残し、古いものは捨てる。
+        tumbling では retain 個 (None なら全て) のウィンドウを残す。
+        反映済みの入力はウィンドウと一緒に忘れ、それでも max_sources 個を超えたら古い順に忘れる
+        (忘れた入力が再送されると2回数えるので、再送が届きうる間は覚えておける数にする)。
+
+        Args:
+            window_column (str): ウィンドウを切るカラム ('DR' / 'WECyc')
+            key (str): 集計のキー
+            value (str): 集計する値
+            mode (str): 'sliding' / 'tumbling'
+            size (int): sliding で残す直近のステップ数
+            retain (Optional[int]): tumbling で残すウィンドウ数
+            max_sources (Optional[int]): 覚えておく反映済みの入力の最大数 (None なら制限しない)
+        """
+        if mode not in WINDOW_MODES:
+            raise ValueError(f"Unknown window mode: {mode}")
+        self.window_column = window_column
+        self.key = key
+        self.value = value
+        self.mode = mode
+        self.size = size
+        self.retain = retain
+        self.max_sources = max_sources
+        # (ウィンドウ列の値, キー) -> 状態
+        self.buckets: Dict[Tuple, State] = {}
+        # 反映済みの入力 -> 反映したウィンドウの値 (再送されたファイルを2回数えない)。
+        # ウィンドウが全て捨てられた入力は一緒に忘れる (再送されても捨てたウィンドウに入るだけ)。
+        # 反映した順に並ぶ (max_sources を超えたら先頭から忘れる)
+        self.sources: Dict[str, List] = {}
+
+    def _evict(self) -> None:
+        """
+        ウィンドウから外れたバケットを捨てる
+        """
+        keep = self.size if self.mode == 'sliding' else self.retain
+        if keep is None:
+            return
+        windows = sorted({window for window, _ in self.buckets})
+        expired = set(windows[:-keep]) if len(windows) > keep else set()
+        if expired:
+            self.buckets = {k: v for k, v in self.buckets.items() if k[0] not in expired}
+            self.sources = {source: w for source, w in self.sources.items() if not expired.issuperset(w)}
+
+    def _forget_sources(self) -> None:
+        """
+        反映済みの入力が max_sources 個を超えたら古い順に忘れる
+        """
+        if self.max_sources is None or len(self.sources) <= self.max_sources:
+            return
+        excess = len(self.sources) - self.max_sources
+        for source in list(self.sources)[:excess]:
+            del self.sources[source]
+
+    def update(self, df: pd.DataFrame, source: Optional[str] = None) -> bool:
+        """
+        処理済みの結果を1つ反映する
+
+        Args:
+            df (pd.DataFrame): 処理済みのデータ (ウィンドウ列・キー・値を含む)
+            source (Optional[str]): 入力ファイル (指定すると同じファイルは1回だけ反映する)
+
+        Returns:
+            bool: 反映したら True (反映済みのファイルか、ウィンドウから外れた古いデータなら False)
+        """
+        if source is not None and source in self.sources:
+            return False
+        values = df[self.value].astype('float64')
+        partial = (df[[self.window_column, self.key]].assign(v=values, v2=values * values)
+                   .groupby([self.window_column, self.key])
+                   .agg(sum=('v', 'sum'), count=('v', 'count'), max=('v', 'max'), sumsq=('v2', 'sum')))
+        windows = set()
+        for (window, key), row in partial.iterrows():
+            if row['count'] == 0:
+                continue
+            bucket = (window.item() if hasattr(window, 'item') else window,
+                      key.item() if hasattr(key, 'item') else key)
+            state = [row['sum'], row['count'], row['max'], row['sumsq']]
+            self.buckets[bucket] = _merge(self.buckets[bucket], state) if bucket in self.buckets else state
+            windows.add(bucket[0])
+        self._evict()
+        # ウィンドウから外れた古いデータは反映しない (捨てたウィンドウに入っただけ)
+        applied = bool(windows & {window for window, _ in self.buckets})
+        if source is not None and applied:
+            self.sources[source] = sorted(windows)
+            self._forget_sources()
+        return applied
+
+    def result(self) -> pd.DataFrame:
+        """
+        現在のウィンドウの集計結果
+
+        Returns:
+            pd.DataFrame: sliding ならキーごとに1行 (window_start / window_end は対象のステップの範囲)、
+                tumbling なら (ウィンドウ列の値, キー) ごとに1行
+        """
+        columns = ['count', 'sum', 'mean', 'max', 'std']
+        if self.mode == 'tumbling':
+            rows = [{self.window_column: window, self.key: key, **_stats(state)}
+                    for (window, key), state in sorted(self.buckets.items())]
+            return pd.DataFrame(rows, columns=[self.window_column, self.key] + columns)
+
+        combined: Dict[object, State] = {}
+        windows = sorted({window for window, _ in self.buckets})
+        for (_, key), state in self.buckets.items():
+            combined[key] = _merge(combined[key], state) if key in combined else state
+        rows = [{self.key: key, 'window_start': windows[0], 'window_end': windows[-1], **_stats(state)}
+                for key, state in sorted(combined.items())]
+        return pd.DataFrame(rows, columns=[self.key, 'window_start', 'window_end'] + columns)
+
+    def checkpoint(self, path: Union[str, Path]) -> None:
+        """
+        状態をディスクに書く (一時ファイルに書いてから置き換えるので途中で落ちても壊れない)
+
+        Args:
+            path (Union[str, Path]): チェックポイントのファイル
+        """
+        path = Path(path)
+        state = {
+            'window_column': self.window_column, 'key': self.key, 'value': self.value,
+            'mode': self.mode, 'size': self.size, 'retain': self.retain, 'max_sources': self.max_sources,
+            'buckets': [[window, key] + state for (window, key), state in self.buckets.items()],
+            'sources': self.sources,
+        }
+        tmp = path.with_suffix(f'.{os.getpid()}.tmp')
+        with open(tmp, 'w') as file:
+            json.dump(state, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp, path)
+
+    @classmethod
+    def restore(cls, path: Union[str, Path]) -> 'WindowedAggregator':
+        """
+        チェックポイントから状態を戻す
+
+        Args:
+            path (Union[str, Path]): チェックポイントのファイル
+
+        Returns:
+            WindowedAggregator: 復元した集計器
+        """
+        state = json.loads(Path(path).read_text())
+        aggregator = cls(state['window_column'], state['key'], state['value'],
+                         state['mode'], state['size'], state['retain'],
+                         state.get('max_sources', MAX_SOURCES))
+        aggregator.buckets = {(window, key): values for window, key, *values in state['buckets']}
+        aggregator.sources = state['sources']
+        logging.info(f"Restored {len(aggregator.buckets)} window buckets from {path}")
+        return aggregator
@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+"""
+検証スクリプト (diff.py の拡張):
+パイプラインの実処理を NumPy / Pandas / Polars / DuckDB で実行し、
+1) スループット (rows/s) とピーク RSS
+2) NumPy を基準とした数値のずれ (最大絶対差, 最大 ULP)
+を行数 1e3〜1e8 で比較する。
+
+対象の処理 (data_transformation/README.md のステップに対応):
+  seg_sum  : ステップ5  (Unit, shiftIndex) ごとに fbcX を seg 合算
+  closest  : ステップ7  seg 合算した行ごとに |shiftX| が最小の X の fbcX を選択
+             (main.py と同じ行方向の argmin。同じ距離なら A に近い方)
+  page_sum : ステップ9  seg 合算した行ごとに Lower=D, Middle=A+C+F, Upper=B+E+G
+  groupby  : (Unit, seg) ごとの fbcX の sum / mean / max
+
+各計測は別プロセスで行うため、ピーク RSS は他の計測の影響を受けない。
+1e8 行は 1 エンジンあたり約 10GB のメモリを使うので、--sizes で明示的に指定する。
+
+例:
+  python engine_bench.py --sizes 1e3,1e5,1e7 --engines numpy,polars --ops seg_sum,page_sum
+"""
+
+import argparse
+import multiprocessing as mp
+import resource
+import sys
+import time
+
+import numpy as np
+
+# shiftX / fbcX の X
+LETTERS = 'ABCDEFG'
+SHIFT_COLS = [f'shift{x}' for x in LETTERS]
+FBC_COLS = [f'fbc{x}' for x in LETTERS]
+
+# 1 Unit あたりの行数 (seg 4 × shiftIndex 15)
+SEGS = 4
+SHIFT_INDEXES = 15
+ROWS_PER_UNIT = SEGS * SHIFT_INDEXES
+
+# shiftIndex = -7 のときの shiftX (create_original_data.py と同じ)
+SHIFT_BASE = {'A': -29, 'B': -25, 'C': -25, 'D': -20, 'E': -24, 'F': -23, 'G': -22}
+
+# page の構成 (LETTERS のインデックス)
+PAGES = {'Lower': [3], 'Middle': [0, 2, 5], 'Upper': [1, 4, 6]}
+
+ENGINES = ['numpy', 'pandas', 'polars', 'duckdb']
+OPS = ['seg_sum', 'closest', 'page_sum', 'groupby']
+SIZES = [1e3, 1e4, 1e5, 1e6]
+
+
+# =====================================================================
+# データ生成
+# =====================================================================
+def make_sweep(n_rows: int, seed: int = 0) -> dict:
+    """
+    3000_0.csv と同じ形のスイープデータを n_rows 行ぶん生成する
+
+    fbcX は合算順序による誤差が出るよう float64 にしている。
+
+    Args:
+        n_rows (int): 目標行数 (Unit 単位に切り上げ)
+        seed (int): 乱数シード
+
+    Returns:
+        dict: カラム名 -> NumPy 配列
+    """
+    rng = np.random.default_rng(seed)
+    n_units = max(1, -(-int(n_rows) // ROWS_PER_UNIT))
+    shift_index = np.tile(np.arange(-7, 8, dtype=np.int32), SEGS * n_units)
+    table = {
+        'Unit': np.repeat(np.arange(n_units, dtype=np.int32), ROWS_PER_UNIT),
+        'seg': np.tile(np.repeat(np.arange(SEGS, dtype=np.int32), SHIFT_INDEXES), n_units),
+        'shiftIndex': shift_index,
+    }
+    for x in LETTERS:
+        jitter = np.repeat(rng.integers(-1, 2, n_units, dtype=np.int32), ROWS_PER_UNIT)
+        table[f'shift{x}'] = SHIFT_BASE[x] + 3 * (shift_index + 7) + jitter
+    for x in LETTERS:
+        table[f'fbc{x}'] = rng.gamma(2.0, 150.0, n_units * ROWS_PER_UNIT)
+    return table
+
+
+# =====================================================================
+# NumPy
+# =====================================================================
+def numpy_seg_sum(t: dict) -> tuple:
+    n_units = int(t['Unit'].max()) + 1
+    gid = t['Unit'].astype(np.int64) * SHIFT_INDEXES + (t['shiftIndex'] + 7)
+    size = n_units * SHIFT_INDEXES
+    sums = np.stack([np.bincount(gid, weights=t[c], minlength=size) for c in FBC_COLS], axis=1)
+    # shiftX は seg によらず同じなので seg == 0 の行を使う
+    first = t['seg'] == 0
+    shifts = np.empty((size, len(LETTERS)), dtype=np.int32)
+    for i, c in enumerate(SHIFT_COLS):
+        shifts[gid[first], i] = t[c][first]
+    return sums, shifts
+
+
+def numpy_closest(t: dict) -> np.ndarray:
+    sums, shifts = numpy_seg_sum(t)
+    pos = np.abs(shifts).argmin(axis=1)
+    return sums[np.arange(len(sums)), pos][:, None]
+
+
+def numpy_page_sum(t: dict) -> np.ndarray:
+    fbc, _ = numpy_seg_sum(t)
+    pages = []
+    for idx in PAGES.values():
+        total = fbc[:, idx[0]].copy()
+        for i in idx[1:]:
+            total += fbc[:, i]
+        pages.append(total)
+    return np.stack(pages, axis=1)
+
+
+def numpy_groupby(t: dict) -> np.ndarray:
+    gid = t['Unit'].astype(np.int64) * SEGS + t['seg']
+    size = int(gid.max()) + 1
+    count = np.bincount(gid, minlength=size)
+    out = []
+    for c in FBC_COLS:
+        total = np.bincount(gid, weights=t[c], minlength=size)
+        peak = np.full(size, -np.inf)
+        np.maximum.at(peak, gid, t[c])
+        out += [total, total / count, peak]
+    return np.stack(out, axis=1)
+
+
+# =====================================================================
+# Pandas
+# =====================================================================
+def pandas_frame(t: dict):
+    import pandas as pd
+    return pd.DataFrame(t)
+
+
+def pandas_seg_sum(df):
+    agg = {c: 'sum' for c in FBC_COLS}
+    agg.update({c: 'first' for c in SHIFT_COLS})
+    return df.groupby(['Unit', 'shiftIndex']).agg(agg).reset_index()
+
+
+def pandas_closest(df):
+    import pandas as pd
+    s = pandas_seg_sum(df)
+    pos = s[SHIFT_COLS].abs().to_numpy().argmin(axis=1)
+    return pd.DataFrame({'FBC': s[FBC_COLS].to_numpy()[np.arange(len(s)), pos]})
+
+
+def pandas_page_sum(df):
+    import pandas as pd
+    c = pandas_seg_sum(df)
+    return pd.DataFrame({
+        page: sum((c[FBC_COLS[i]] for i in idx[1:]), c[FBC_COLS[idx[0]]])
+        for page, idx in PAGES.items()
+    })
+
+
+def pandas_groupby(df):
+    return df.groupby(['Unit', 'seg'])[FBC_COLS].agg(['sum', 'mean', 'max'])
+
+
+# =====================================================================
+# Polars
+# =====================================================================
+def polars_frame(t: dict):
+    import polars as pl
+    return pl.DataFrame(t)
+
+
+def polars_seg_sum(df):
+    import polars as pl
+    return df.group_by(['Unit', 'shiftIndex']).agg(
+        [pl.col(c).sum() for c in FBC_COLS] + [pl.col(c).first() for c in SHIFT_COLS]
+    )
+
+
+def polars_closest(df):
+    import polars as pl
+    pos = pl.concat_list([pl.col(c).abs() for c in SHIFT_COLS]).list.arg_min()
+    return polars_seg_sum(df).select(
+        'Unit', 'shiftIndex', pl.concat_list(FBC_COLS).list.get(pos).alias('FBC')
+    )
+
+
+def polars_page_sum(df):
+    import polars as pl
+    c = polars_seg_sum(df)
+    return c.select(
+        [pl.col('Unit'), pl.col('shiftIndex')]
+        + [pl.sum_horizontal([pl.col(FBC_COLS[i]) for i in idx]).alias(page) for page, idx in PAGES.items()]
+    )
+
+
+def polars_groupby(df):
+    import polars as pl
+    aggs = []
+    for c in FBC_COLS:
+        aggs += [pl.col(c).sum().alias(f'{c}_sum'), pl.col(c).mean().alias(f'{c}_mean'),
+                 pl.col(c).max().alias(f'{c}_max')]
+    return df.group_by(['Unit', 'seg']).agg(aggs)
+
+
+# =====================================================================
+# DuckDB
+# =====================================================================
+SEG_SUM_SQL = (
+    "SELECT Unit, shiftIndex, "
+    + ', '.join(f'sum({c}) AS {c}' for c in FBC_COLS) + ', '
+    + ', '.join(f'first({c}) AS {c}' for c in SHIFT_COLS)
+    + " FROM sweep GROUP BY Unit, shiftIndex"
+)
+
+# 同じ |shiftX| が複数ある場合は A に近い方を選ぶ (list_position は最初に一致した位置。numpy の argmin と同じ)
+_ABS_SHIFTS = ', '.join(f'abs({c})' for c in SHIFT_COLS)
+CLOSEST_SQL = (
+    f"SELECT Unit, shiftIndex, [{', '.join(FBC_COLS)}]"
+    f"[list_position([{_ABS_SHIFTS}], least({_ABS_SHIFTS}))] AS FBC"
+    f" FROM ({SEG_SUM_SQL})"
+)
+
+PAGE_SUM_SQL = (
+    "SELECT Unit, shiftIndex, "
+    + ', '.join(' + '.join(FBC_COLS[i] for i in idx) + f' AS {page}' for page, idx in PAGES.items())
+    + f" FROM ({SEG_SUM_SQL})"
+)
+
+GROUPBY_SQL = (
+    "SELECT Unit, seg, "
+    + ', '.join(f'sum({c}), avg({c}), max({c})' for c in FBC_COLS)
+    + " FROM sweep GROUP BY Unit, seg"
+)
+
+
+def duckdb_frame(t: dict):
+    import duckdb
+    import pyarrow as pa
+    con = duckdb.connect()
+    con.register('sweep', pa.table(t))
+    return con
+
+
+def _duckdb_run(con, sql):
+    return con.execute(sql).fetchnumpy()
+
+
+def duckdb_seg_sum(con):
+    return _duckdb_run(con, SEG_SUM_SQL)
+
+
+def duckdb_closest(con):
+    return _duckdb_run(con, CLOSEST_SQL)
+
+
+def duckdb_page_sum(con):
+    return _duckdb_run(con, PAGE_SUM_SQL)
+
+
+def duckdb_groupby(con):
+    return _duckdb_run(con, GROUPBY_SQL)
+
+
+# =====================================================================
+# 結果の正規化 (キー昇順の float64 2次元配列)
+# =====================================================================
+def _sorted_matrix(keys: list, values: list) -> np.ndarray:
+    order = np.lexsort([np.asarray(k) for k in reversed(keys)])
+    return np.stack([np.asarray(v, dtype=np.float64)[order] for v in values], axis=1)
+
+
+def normalize(engine: str, op: str, result) -> np.ndarray:
+    """
+    エンジンごとの結果を比較用の配列に揃える
+
+    Args:
+        engine (str): エンジン名
+        op (str): 処理名
+        result: 各エンジンの処理結果
+
+    Returns:
+        np.ndarray: 行 = グループ (キー昇順), 列 = 値
+    """
+    if engine == 'numpy':
+        return result[0] if op == 'seg_sum' else result
+    if engine == 'pandas':
+        if op == 'seg_sum':
+            return result[FBC_COLS].to_numpy(dtype=np.float64)
+        return result.to_numpy(dtype=np.float64)
+    if engine in ('polars', 'duckdb'):
+        cols = list(result.columns) if engine == 'polars' else list(result)
+        if op == 'seg_sum':
+            return _sorted_matrix([result['Unit'], result['shiftIndex']], [result[c] for c in FBC_COLS])
+        if op == 'groupby':
+            return _sorted_matrix([result['Unit'], result['seg']], [result[c] for c in cols[2:]])
+        # closest / page_sum は seg 合算した行 (Unit, shiftIndex) ごと
+        return _sorted_matrix([result['Unit'], result['shiftIndex']], [result[c] for c in cols[2:]])
+    raise ValueError(f"Unknown engine: {engine}")
+
+
+def ulp_distance(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    float64 同士の ULP 距離
+
+    ビット列を符号付き整数の順序に写して差を取る。
+
+    Args:
+        a (np.ndarray): 比較対象
+        b (np.ndarray): 基準
+
+    Returns:
+        np.ndarray: 要素ごとの ULP 距離
+    """
+    def ordered(x):
+        i = np.ascontiguousarray(x, dtype=np.float64).view(np.int64)
+        return np.where(i < 0, np.int64(-2**63) - i, i)
+    return np.abs(ordered(a) - ordered(b).astype(np.int64)).astype(np.uint64)
+
+
+# =====================================================================
+# 計測
+# =====================================================================
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KB, macOS は byte
+    return peak / (1024 ** 2) if sys.platform == 'darwin' else peak / 1024
+
+
+def _measure(engine: str, op: str, n_rows: int, repeat: int, queue) -> None:
+    """
+    子プロセスで1つのエンジン・処理・行数を計測する
+    """
+    try:
+        table = make_sweep(n_rows)
+        rows = len(table['Unit'])
+        data = table if engine == 'numpy' else globals()[f'{engine}_frame'](table)
+        func = globals()[f'{engine}_{op}']
+        base_rss = _peak_rss_mb()
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func(data)
+            best = min(best, time.perf_counter() - start)
+        peak_rss = _peak_rss_mb()
+
+        # 数値のずれは計測後に NumPy の結果と比較する
+        got = normalize(engine, op, result)
+        ref = normalize('numpy', op, globals()[f'numpy_{op}'](table))
+        max_abs = float(np.max(np.abs(got - ref))) if got.size else 0.0
+        max_ulp = int(ulp_distance(got, ref).max()) if got.size else 0
+        queue.put({'engine': engine, 'op': op, 'rows': rows, 'seconds': best,
+                   'rows_per_s': rows / best, 'base_rss_mb': base_rss, 'peak_rss_mb': peak_rss,
+                   'max_abs_diff': max_abs, 'max_ulp': max_ulp, 'shape_ok': got.shape == ref.shape})
+    except ImportError as e:
+        queue.put({'engine': engine, 'op': op, 'rows': n_rows, 'error': f'not installed ({e.name})'})
+    except Exception as e:
+        queue.put({'engine': engine, 'op': op, 'rows': n_rows, 'error': repr(e)})
+
+
+def run_bench(sizes: list, engines: list, ops: list, repeat: int = 3) -> list:
+    """
+    全組み合わせを計測する
+
+    Args:
+        sizes (list): 行数のリスト
+        engines (list): エンジン名のリスト
+        ops (list): 処理名のリスト
+        repeat (int): 各計測の繰り返し回数 (最速値を採用)
+
+    Returns:
+        list: 計測結果の辞書のリスト
+    """
+    ctx = mp.get_context('spawn')
+    results = []
+    for n in sizes:
+        for op in ops:
+            for engine in engines:
+                queue = ctx.Queue()
+                proc = ctx.Process(target=_measure, args=(engine, op, int(n), repeat, queue))
+                proc.start()
+                proc.join()
+                if proc.exitcode != 0:
+                    results.append({'engine': engine, 'op': op, 'rows': int(n),
+                                    'error': f'exit code {proc.exitcode} (OOM?)'})
+                else:
+                    results.append(queue.get())
+                print_row(results[-1])
+    return results
+
+
+def print_header() -> None:
+    print("=== Engine throughput / divergence test (vs numpy) ===")
+    print("      rows | op       | engine |      rows/s | peak RSS MB |  max abs diff |  max ULP")
+    print("-----------+----------+--------+-------------+-------------+---------------+---------")
+
+
+def print_row(r: dict) -> None:
+    if 'error' in r:
+        print(f"{r['rows']:10d} | {r['op']:8s} | {r['engine']:6s} | {r['error']}")
+        return
+    mismatch = '' if r['shape_ok'] else '  (shape mismatch)'
+    print(f"{r['rows']:10d} | {r['op']:8s} | {r['engine']:6s} | {r['rows_per_s']:11.3e} | "
+          f"{r['peak_rss_mb']:11.1f} | {r['max_abs_diff']:13.3e} | {r['max_ulp']:8d}{mismatch}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='エンジン間のスループットと数値のずれを比較する')
+    parser.add_argument('--sizes', default=','.join(f'{s:.0e}' for s in SIZES),
+                        help='行数のカンマ区切り (例: 1e3,1e6,1e8)')
+    parser.add_argument('--engines', default=','.join(ENGINES))
+    parser.add_argument('--ops', default=','.join(OPS))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--csv', help='結果を CSV に保存する')
+    args = parser.parse_args()
+
+    print_header()
+    results = run_bench([float(s) for s in args.sizes.split(',')],
+                        args.engines.split(','), args.ops.split(','), args.repeat)
+    if args.csv:
+        import csv
+        keys = sorted({k for r in results for k in r})
+        with open(args.csv, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=keys)
+            writer.writeheader()
+            writer.writerows(results)